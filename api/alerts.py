@@ -1,17 +1,36 @@
-from fastapi import APIRouter, HTTPException, Header, Query, Body
+from fastapi import APIRouter, HTTPException, Header, Query, Body, Depends
+from fastapi.responses import Response, StreamingResponse
+import base64, json, itertools, time, collections
 from app.models.alert_models import Alert
 from datetime import datetime, timedelta
 from typing import Optional, List, Any, Dict, Union
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
 from app.database.mongo import db_sec
-from app.api.helpers import _check_key, _normalize, _parse_ts 
+from app.api.helpers import _check_key, _normalize, _parse_ts, _admin_auth
+from app.services.alert_enrichment import enrich_many, enrich_status
+from app.services.alert_suppression import apply as suppress_alerts, suppression_status
+from app.services.alert_spool import ingest as ingest_alerts, spool_status, SpoolError
+from app.services.alert_payloads import alert_payload, migrate_inline, payload_stats
+from app.services.alert_archive import archive, query_archive, archive_status, ArchiveUnavailable
+from app.services import alert_export
+from app.services.metrics import Counter, Histogram
 
 router = APIRouter(prefix="/api/v1/alerts", tags=["alerts"])
 API_KEYS = {"sensor-1": "K1-very-secret", "sensor-2": "K2-very-secret"} 
 
+INGEST_ALERTS = Counter("alerts_ingested_total", "Alert nhận qua /push theo sensor", ("sensor",))
+INGEST_RESULT = Counter("alerts_ingest_result_total", "Kết quả ingest: inserted / spooled / suppressed", ("result",))
+INGEST_STAGE_SECONDS = Histogram("alert_ingest_stage_seconds", "Thời gian từng bước ingest 1 batch",
+                                 ("stage",))
+INGEST_BATCH_ALERTS = Histogram("alert_ingest_batch_alerts", "Số alert / batch /push", (),
+                                (1, 5, 10, 50, 100, 500, 1000, 5000))
+
         
+# def (không async): enrich / suppress / ingest gọi pymongo đồng bộ -> chạy trong threadpool, không chặn event loop
 @router.post("/push")
-async def push_flex(
+def push_flex(
     body: Union[Dict[str, Any], List[Dict[str, Any]]] = Body(...),
     x_api_key: str = Header(None)
 ):
@@ -24,14 +43,154 @@ async def push_flex(
     sid = alerts[0].get("sensor_id")
     _check_key(sid, x_api_key)
 
-    # Normalize & insert
+    # Normalize & làm giàu (sid -> event/IOC/MITRE qua LRU) & insert
+    t0 = time.perf_counter()
     docs = [_normalize(a) for a in alerts]
+    t1 = time.perf_counter()
+    docs = enrich_many(docs)
+    t2 = time.perf_counter()
+    # alert trùng trong cửa sổ suppress -> bỏ / gộp count vào alert đã lưu
+    docs, folds = suppress_alerts(docs)
+    t3 = time.perf_counter()
     # print(docs)
+    # payload -> alert_payloads, insert, gộp fold; Mongo lỗi / chậm quá ngân sách -> spool local, replay sau
     try:
-        res = db_sec.ids_alerts.insert_many(docs, ordered=False)
-        return {"ok": True, "inserted": len(res.inserted_ids)}
+        res = ingest_alerts(docs, folds)
+    except SpoolError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=f"DB error: {e}")
+    t4 = time.perf_counter()
+    for stage, dt in (("normalize", t1 - t0), ("enrich", t2 - t1), ("suppress", t3 - t2), ("write", t4 - t3)):
+        INGEST_STAGE_SECONDS.labels(stage).observe(dt)
+    INGEST_BATCH_ALERTS.observe(len(alerts))
+    for s, n in collections.Counter(a.get("sensor_id") or "unknown" for a in alerts).items():
+        INGEST_ALERTS.labels(s).inc(n)
+    for k, n in (("inserted", res["inserted"]), ("spooled", res["spooled"]), ("suppressed", len(alerts) - len(docs))):
+        if n:
+            INGEST_RESULT.labels(k).inc(n)
+    return {"ok": True, **res, "suppressed": len(alerts) - len(docs)}
+
+
+@router.get("/spool/status", dependencies=[Depends(_admin_auth)])
+def alerts_spool_status():
+    return spool_status()
+
+
+@router.get("/enrich/status", dependencies=[Depends(_admin_auth)])
+def enrich_cache_status():
+    return enrich_status()
+
+
+@router.get("/suppress/status", dependencies=[Depends(_admin_auth)])
+def suppress_status():
+    return suppression_status()
+
+
+@router.get("/payloads/stats", dependencies=[Depends(_admin_auth)])
+def payloads_stats():
+    return payload_stats()
+
+
+@router.post("/payloads/migrate", dependencies=[Depends(_admin_auth)])
+def payloads_migrate(limit: Optional[int] = Query(None, ge=1)):
+    """Chuyển b64_data inline của alert cũ sang alert_payloads."""
+    return {"ok": True, **migrate_inline(limit=limit)}
+
+
+@router.get("/archive/status", dependencies=[Depends(_admin_auth)])
+def alerts_archive_status():
+    return archive_status()
+
+
+@router.post("/archive/run", dependencies=[Depends(_admin_auth)])
+def alerts_archive_run(days: Optional[int] = Query(None, ge=1, description="mặc định ARCHIVE_AFTER_DAYS")):
+    """Chuyển alert cũ hơn `days` ngày sang Parquet (chạy đồng bộ)."""
+    try:
+        return {"ok": True, **archive(days)}
+    except ArchiveUnavailable as e:
+        raise HTTPException(503, str(e))
+
+
+@router.get("/archive", dependencies=[Depends(_admin_auth)])
+def alerts_archive_query(
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    sensor_id: Optional[str] = Query(None),
+    rule_id: Optional[str] = Query(None),
+    ip: Optional[str] = Query(None, description="src_ip hoặc dst_ip"),
+    fields: Optional[str] = Query(None, description="vd. ts,sensor_id,rule_id,src_ip,dst_ip"),
+    limit: Optional[int] = Query(None, ge=1, description="JSON: tối đa 1000 (mặc định 100); NDJSON: bỏ trống = tất cả"),
+    format: str = Query("json", regex="^(json|ndjson)$"),
+):
+    """Tìm alert đã archive (Parquet): chỉ đọc cột `fields`, filter đẩy xuống row group."""
+    cols = [c.strip() for c in fields.split(",") if c.strip()] if fields else None
+    if format == "json":
+        limit = min(limit or 100, 1000)
+    try:
+        rows = query_archive(since, until, sensor_id, rule_id, ip, cols, limit)
+        first = next(rows, None)     # lỗi cột / thiếu pyarrow báo ngay, không giữa stream
+    except ArchiveUnavailable as e:
+        raise HTTPException(503, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if format == "json":
+        return [first, *rows] if first is not None else []
+
+    def lines():
+        if first is None:
+            return
+        for row in itertools.chain([first], rows):
+            yield (json.dumps(row, default=str, separators=(",", ":")) + "\n").encode()
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/export", dependencies=[Depends(_admin_auth)])
+def alerts_export(
+    format: str = Query("ndjson", regex="^(ndjson|csv|parquet)$"),
+    since: Optional[datetime] = Query(None, description="thời điểm ingest (UTC nếu không có timezone)"),
+    until: Optional[datetime] = Query(None, description="thời điểm ingest, không gồm mốc này"),
+    sensor_id: Optional[str] = Query(None, description="s1,s2"),
+    rule_id: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="ndjson: dotted path; csv/parquet: cột phẳng (ts,sensor_id,src_ip,...)"),
+    after: Optional[str] = Query(None, description="_id cuối đã nhận (resume)"),
+    batch: Optional[int] = Query(None, ge=100, le=100000),
+):
+    """Stream toàn bộ alert khớp filter (sort _id) — bộ nhớ cố định; throughput ghi ở log khi xong."""
+    cols = [c.strip() for c in fields.split(",") if c.strip()] if fields else None
+    sensors = [c.strip() for c in sensor_id.split(",") if c.strip()] if sensor_id else None
+    try:
+        alert_export.validate_export(format, cols)
+        q = alert_export.export_filter(since, until, sensors, rule_id, after)
+    except ArchiveUnavailable as e:
+        raise HTTPException(503, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    name = f"alerts-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        alert_export.export_stream(format, q, cols, batch),
+        media_type=alert_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+@router.get("/{alert_id}/payload", dependencies=[Depends(_admin_auth)])
+def get_alert_payload(alert_id: str, format: str = Query("b64", regex="^(b64|raw)$")):
+    """Payload gói tin của alert — đọc lazy khi analyst mở alert."""
+    try:
+        oid = ObjectId(alert_id)
+    except InvalidId:
+        raise HTTPException(400, "invalid alert id")
+    alert = db_sec.ids_alerts.find_one({"_id": oid}, {"payload": 1, "b64_data": 1})
+    if alert is None:
+        raise HTTPException(404, "alert not found")
+    raw = alert_payload(alert)
+    if raw is None:
+        raise HTTPException(404, "alert has no payload")
+    if format == "raw":
+        return Response(raw, media_type="application/octet-stream")
+    ref = alert.get("payload") or {}
+    return {"sha256": ref.get("sha256"), "size": len(raw), "b64_data": base64.b64encode(raw).decode()}
 
 
 
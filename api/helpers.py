@@ -37,18 +37,23 @@ def _check_key(sensor_id: str | None, x_api_key: str | None):
 # Parsing timestamp
 def _parse_ts(ts: str | None) -> str | None:
     """
-    Snort/Zeek thường có dạng 'MM/DD-HH:MM:SS.ffffff'.
-    Nếu bạn muốn ISO 8601, convert nhanh (gắn năm hiện tại).
+    Snort/Zeek thường có dạng 'MM/DD-HH:MM:SS.ffffff' (không có năm).
+    Convert sang ISO 8601 (gắn năm hiện tại; lệch > 1 ngày về tương lai -> năm trước, vd. 12/31 nhận lúc 01/01).
+    Không parse được (vd. đã là ISO) -> giữ nguyên.
     """
     if not ts:
         return None
-    try:
-        # ví dụ: 10/24-06:41:36.678258 -> 2025-10-24T06:41:36.678258
-        now_year = datetime.utcnow().year
-        dt = datetime.strptime(f"{now_year}-{ts.replace('/', '-').replace('-', ' ', 1)}", "%Y-%m-%d %H:%M:%S.%f")
+    now = datetime.utcnow()
+    for fmt in ("%Y/%m/%d-%H:%M:%S.%f", "%Y/%m/%d-%H:%M:%S"):
+        try:
+            # ví dụ: 10/24-06:41:36.678258 -> 2025-10-24T06:41:36.678258
+            dt = datetime.strptime(f"{now.year}/{ts}", fmt)
+        except ValueError:
+            continue
+        if dt - now > timedelta(days=1):
+            dt = dt.replace(year=dt.year - 1)
         return dt.isoformat()
-    except Exception:
-        return ts  # giữ nguyên nếu không parse được
+    return ts
 
 def _normalize(a: Dict[str, Any]) -> Dict[str, Any]:
     a = dict(a)
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import Response
+from typing import Optional
+import os
+
+from app.services.metrics import render, CONTENT_TYPE
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape (text format 0.0.4). METRICS_KEY đặt -> yêu cầu `Authorization: Bearer <key>`."""
+    want = os.getenv("METRICS_KEY")
+    if want and authorization != f"Bearer {want}":
+        raise HTTPException(401, "invalid metrics key")
+    return Response(render(), media_type=CONTENT_TYPE)
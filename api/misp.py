@@ -1,14 +1,22 @@
 from __future__ import annotations
 import os, uuid
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, Header, Query
-from app.database.mongo import db_ioc
-from app.services.misp_service import MISPService
+from datetime import datetime, timezone
+from typing import Optional, List
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from app.services import misp_browse
+from app.services.misp_service import MISPService, get_misp_service, _since_to_dt
+from app.services.misp_feed_importer import import_feed
+from app.services.misp_stats import reconcile as reconcile_stats
+from app.services.ioc_index import get_ioc_index, ioc_index_status, IOC_INDEX_ENABLED, IOC_LOOKUP_MAX
+from app.models.misp_models import IocLookupRequest
+from app.services import retro_hunt
 from app.api.helpers import _admin_auth
 
 router = APIRouter(prefix="/api/v1/misp", tags=["misp"])
 def _svc() -> MISPService:
-    return MISPService(db_ioc)
+    # instance dùng chung cả process (tạo ở lifespan), không dựng lại PyMISP/index mỗi request
+    return get_misp_service()
 
 def _rid(x_request_id: Optional[str] = Header(None)) -> str:
     return x_request_id or uuid.uuid4().hex[:8]
@@ -16,19 +24,146 @@ def _rid(x_request_id: Optional[str] = Header(None)) -> str:
 def misp_ping(_=Depends(_admin_auth), svc: MISPService = Depends(_svc)):
     return svc.ping()
 @router.get("/stats")
-def misp_stats(svc: MISPService = Depends(_svc)):
-    return svc.stats()
+def misp_stats(
+    fresh: bool = Query(False, description="bỏ qua cache TTL, đọc lại doc counters"),
+    svc: MISPService = Depends(_svc),
+):
+    return svc.stats(fresh=fresh)
 
-@router.get("/events")
-def list_events(limit: int = Query(50, ge=1, le=500), svc: MISPService = Depends(_svc)):
-    docs = svc.query_events({}, limit=limit)
-    for d in docs: d.pop("_id", None)
+# Đếm lại toàn bộ (aggregate) và sửa drift của bộ đếm stats
+@router.post("/stats/reconcile")
+def misp_stats_reconcile(_=Depends(_admin_auth)):
+    return reconcile_stats()
+
+def _csv(v: Optional[str]) -> Optional[List[str]]:
+    return [x.strip() for x in v.split(",") if x.strip()] if v else None
+
+def _wants_ndjson(fmt: Optional[str], accept: Optional[str]) -> bool:
+    return fmt == "ndjson" or (fmt is None and "application/x-ndjson" in (accept or ""))
+
+def _browse_response(col, q: dict, proj: Optional[dict], cursor: Optional[str], limit: Optional[int],
+                     ndjson: bool, page_limit: int, response: Response):
+    """
+    JSON: list doc (như cũ), cursor trang sau ở header X-Next-Cursor.
+    NDJSON: stream tới hết (hoặc tới limit), không giữ cả tập kết quả trong RAM.
+    """
+    try:
+        if ndjson:
+            docs = misp_browse.browse(col, q, proj, cursor, limit + 1 if limit else None)
+            return StreamingResponse(misp_browse.ndjson_lines(docs, limit), media_type="application/x-ndjson")
+        docs, nxt = misp_browse.page(col, q, proj, cursor, min(limit or page_limit, page_limit))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if nxt:
+        response.headers["X-Next-Cursor"] = nxt
     return docs
 
+# Filter + projection + keyset cursor; ?format=ndjson (hoặc Accept: application/x-ndjson) để export cả tập
+@router.get("/events")
+def list_events(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="JSON: tối đa 500 (mặc định 50); NDJSON: bỏ trống = tất cả"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor của trang trước"),
+    published: Optional[bool] = Query(None),
+    tags: Optional[str] = Query(None, description="a,b -> có đủ các tag"),
+    event_id: Optional[int] = Query(None),
+    orgc: Optional[str] = Query(None),
+    info_prefix: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description="vd. uuid,info,tags (mặc định: bỏ galaxies.meta)"),
+    format: Optional[str] = Query(None, regex="^(json|ndjson)$"),
+    accept: Optional[str] = Header(None),
+    svc: MISPService = Depends(_svc),
+):
+    q = misp_browse.event_filter(published=published, tags=_csv(tags), event_id=event_id, orgc=orgc,
+                                 info_prefix=info_prefix, since=since, until=until)
+    try:
+        proj = misp_browse.projection(_csv(fields), misp_browse.EVENT_DEFAULT_EXCLUDE)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    nd = _wants_ndjson(format, accept)
+    return _browse_response(svc.col_events, q, proj, cursor, limit if (limit or nd) else 50, nd, 500, response)
+
 @router.get("/iocs")
-def list_iocs(limit: int = Query(100, ge=1, le=1000), svc: MISPService = Depends(_svc)):
-    docs = svc.query_iocs({}, limit=limit)
-    for d in docs: d.pop("_id", None)
+def list_iocs(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="JSON: tối đa 1000 (mặc định 100); NDJSON: bỏ trống = tất cả"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor của trang trước"),
+    type: Optional[str] = Query(None, description="ip-dst,domain,..."),
+    type_family: Optional[str] = Query(None, description="file,network,email,other"),
+    to_ids: Optional[bool] = Query(None),
+    tags: Optional[str] = Query(None, description="a,b -> có đủ các tag"),
+    event_id: Optional[int] = Query(None),
+    value_prefix: Optional[str] = Query(None, description="tiền tố value (phân biệt hoa thường)"),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description="vd. type,value,to_ids"),
+    format: Optional[str] = Query(None, regex="^(json|ndjson)$"),
+    accept: Optional[str] = Header(None),
+    svc: MISPService = Depends(_svc),
+):
+    q = misp_browse.ioc_filter(type=_csv(type), type_family=_csv(type_family), to_ids=to_ids, tags=_csv(tags),
+                               event_id=event_id, value_prefix=value_prefix, since=since, until=until)
+    try:
+        proj = misp_browse.projection(_csv(fields))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    nd = _wants_ndjson(format, accept)
+    return _browse_response(svc.col_iocs, q, proj, cursor, limit if (limit or nd) else 100, nd, 1000, response)
+
+# Bulk lookup: value nào là IOC đã biết (index trong RAM, không query Mongo mỗi value)
+@router.post("/lookup")
+def lookup_iocs(body: IocLookupRequest):
+    if not IOC_INDEX_ENABLED:
+        raise HTTPException(503, "ioc index disabled (IOC_INDEX_ENABLED=false)")
+    if len(body.values) > IOC_LOOKUP_MAX:
+        raise HTTPException(413, f"too many values (max {IOC_LOOKUP_MAX})")
+    hits = get_ioc_index().lookup(body.values, cidr=body.cidr, parents=body.parents, to_ids_only=body.to_ids_only)
+    return {"queried": len(body.values), "matched": len(hits), "results": hits}
+
+@router.get("/lookup/status")
+def lookup_status():
+    return ioc_index_status()
+
+@router.post("/lookup/rebuild")
+def lookup_rebuild(_=Depends(_admin_auth)):
+    return get_ioc_index().rebuild()
+
+# Retro-hunt: IOC (ip/host) pull trong khoảng [since, now] đối chiếu alert `days` ngày gần nhất
+@router.post("/retro-hunt", status_code=202)
+def retro_hunt_submit(
+    since: str = Query("24h", description="IOC có source.pulled_at từ mốc này (24h, 7d, ISO)"),
+    days: Optional[int] = Query(None, ge=1, le=365, description="cửa sổ alert (mặc định RETRO_HUNT_DAYS)"),
+    _=Depends(_admin_auth),
+):
+    now = datetime.now(timezone.utc)
+    try:
+        ioc_from = _since_to_dt(since, now)
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(400, f"invalid since: {e}")
+    job = retro_hunt.submit(ioc_from, now, days=days)
+    return {"job_id": job["_id"], "status": job["status"], "days": job["days"]}
+
+@router.get("/retro-hunt/jobs/{job_id}")
+def retro_hunt_job(job_id: str, _=Depends(_admin_auth)):
+    job = retro_hunt.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "job not found")
+    job["job_id"] = job.pop("_id")
+    return job
+
+@router.get("/retro-hunt/hits")
+def retro_hunt_hits(
+    event_id: Optional[int] = Query(None),
+    job_id: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    _=Depends(_admin_auth),
+):
+    docs = retro_hunt.list_hits(event_id=event_id, job_id=job_id, limit=limit)
+    for d in docs:
+        d.pop("_id", None)
+        d["alert_id"] = str(d.get("alert_id"))
     return docs
 
 # Pull ngay (24h, exclude_imported=True)
@@ -46,16 +181,61 @@ def pull_custom(
     since: str = Query("24h"),
     published: Optional[bool] = Query(None),
     exclude_imported: bool = Query(True),
+    page_size: Optional[int] = Query(None, ge=1, le=5000, description="event / trang search (mặc định MISP_PAGE_SIZE)"),
+    prefetch: Optional[int] = Query(None, ge=1, le=16, description="số trang fetch song song (mặc định MISP_PREFETCH)"),
     _=Depends(_admin_auth),
     rid: str = Depends(_rid),
     svc: MISPService = Depends(_svc),
 ):
     try:
-        res = svc.pull(since=since, published=published, exclude_imported=exclude_imported, request_id=rid)
+        res = svc.pull(since=since, published=published, exclude_imported=exclude_imported, request_id=rid,
+                       page_size=page_size, prefetch=prefetch)
         return {"request_id": rid, **res}
     except Exception as e:
         raise HTTPException(500, f"pull error: {e}")
 
+# Sync tăng dần theo watermark (không cần since / tag imported)
+@router.post("/sync")
+def sync_now(
+    tag_imported: Optional[bool] = Query(None, description="tag console:imported sau sync (mặc định MISP_SYNC_TAG)"),
+    _=Depends(_admin_auth),
+    rid: str = Depends(_rid),
+    svc: MISPService = Depends(_svc),
+):
+    try:
+        res = svc.sync(request_id=rid, tag_imported=tag_imported)
+        return {"request_id": rid, **res}
+    except Exception as e:
+        raise HTTPException(500, f"sync error: {e}")
+
+@router.get("/sync/state")
+def sync_state(svc: MISPService = Depends(_svc)):
+    return svc.sync_state()
+
+# Chạy lại các event tag console:imported bị lỗi ở lần pull/sync trước
+@router.post("/tag/retry")
+def retry_failed_tags(_=Depends(_admin_auth), rid: str = Depends(_rid), svc: MISPService = Depends(_svc)):
+    try:
+        return {"request_id": rid, **svc.retry_failed_tags(request_id=rid)}
+    except Exception as e:
+        raise HTTPException(500, f"tag retry error: {e}")
+
+# Import offline: thư mục feed MISP (manifest.json + <uuid>.json) hoặc file JSON export
+@router.post("/import-feed")
+def import_feed_now(
+    path: str = Query(..., description="đường dẫn feed / export trên máy console"),
+    workers: Optional[int] = Query(None, ge=1, le=64),
+    force: bool = Query(False, description="import lại cả event có timestamp không đổi"),
+    _=Depends(_admin_auth),
+    rid: str = Depends(_rid),
+):
+    try:
+        return {"request_id": rid, **import_feed(path, workers=workers, force=force)}
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception as e:
+        raise HTTPException(500, f"import error: {e}")
+
 @router.post("/tag")
 def tag_event(
     event_uuid: str = Query(...),
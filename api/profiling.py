@@ -0,0 +1,71 @@
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from pydantic import BaseModel, Field
+
+from app.api.helpers import _admin_auth
+from app.services.profiling import (
+    arm, disarm, armed, sample_process, list_reports, get_report, ProfileError, PROFILE_MAX_SECONDS,
+)
+
+# chỉ admin; route chưa arm không bị bọc -> không tốn gì
+router = APIRouter(prefix="/api/v1/profile", tags=["profile"], dependencies=[Depends(_admin_auth)])
+
+
+class ArmRequest(BaseModel):
+    path: str = Field(..., description="path request (không query), vd. /api/v1/misp/pull, /api/v1/rules/convert")
+    method: str = "POST"
+    mode: str = Field("sample", pattern="^(sample|cprofile)$")
+    count: int = Field(1, ge=1, le=100)
+    ttl_sec: int = Field(600, ge=1, le=86400)
+
+
+@router.post("/arm")
+def profile_arm(body: ArmRequest):
+    """Profile `count` request kế tiếp tới path; response có header X-Profile-Id, report xem ở /reports."""
+    try:
+        return {"ok": True, **arm(body.path, body.method, body.mode, body.count, body.ttl_sec)}
+    except ProfileError as e:
+        raise HTTPException(400, str(e))
+
+
+@router.delete("/arm")
+def profile_disarm(path: Optional[str] = Query(None), method: Optional[str] = Query(None)):
+    return {"ok": True, "disarmed": disarm(path, method)}
+
+
+@router.get("/armed")
+def profile_armed():
+    return armed()
+
+
+@router.post("/sample")
+def profile_sample(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: Optional[float] = Query(None, ge=0.5, le=1000),
+    include_idle: bool = Query(False, description="giữ cả thread đang chờ việc"),
+    format: str = Query("json", regex="^(json|text|collapsed)$"),
+):
+    """Sampling toàn process trong `seconds` giây (request chờ tới khi xong)."""
+    try:
+        rep = sample_process(seconds, interval_ms, include_idle)
+    except ProfileError as e:
+        raise HTTPException(409, str(e))
+    return rep if format == "json" else PlainTextResponse(rep[format])
+
+
+@router.get("/reports")
+def profile_reports():
+    return list_reports()
+
+
+@router.get("/reports/{report_id}")
+def profile_report(report_id: str, format: str = Query("json", regex="^(json|text|collapsed)$")):
+    rep = get_report(report_id)
+    if rep is None:
+        raise HTTPException(404, "report not found")
+    if format == "json":
+        return rep
+    if format not in rep:
+        raise HTTPException(400, f"{format} not available for mode={rep['mode']}")
+    return PlainTextResponse(rep[format])
@@ -1,18 +1,20 @@
 from typing import Optional, Any, List, Dict, Literal
-import re, os, datetime
+import re, os, time, datetime
 from bson import ObjectId
 from fastapi import APIRouter, Path, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel, Field
 
 
-from app.services.rule_set_builder import build_files_for_rule_set
+from app.services.rule_set_builder import build_files_for_rule_set, build_summary
+from app.services.rule_build_queue import submit_build, submit_builds, get_job, list_jobs, queue_depth, BUILD_SECONDS
 from app.services.rule_set_deploy import deploy_rule_set_version
 from app.services.rules_service import build_rules_for_event, build_rules_for_all_new
 from app.database.collections import (
     col_rule_items, col_rule_sets, col_rule_set_items, col_iocs, col_events, col_sensor_infor
 )
-from app.models.rule_models import RuleItem, RuleSetBuildResponse
+from app.models.rule_models import RuleItem, RuleSetBuildJob, RuleSetBuildResponse, SuppressPolicy
+from app.services.alert_enrichment import invalidate as invalidate_enrichment
 RULE_ENGINE = os.getenv("RULE_ENGINE", "snort3")
 
 router = APIRouter(prefix="/api/v1/rules", tags=["rules"])
@@ -32,17 +34,21 @@ def _ensure_event_id_exists(eid: int) -> None:
 
 @router.post("/convert")
 async def convert_rules(
-    event_id: Optional[int] = Query(default=None, ge=1, description="If omitted: convert all events")
+    event_id: Optional[int] = Query(default=None, ge=1, description="If omitted: convert all events"),
+    ip_mode: Optional[Literal["single", "list", "reputation"]] = Query(
+        default=None, description="IP IOC: single rule / IP list rule / reputation blocklist (default: IP_RULE_MODE)"
+    ),
 ):
     """
     Convert các IoC sang Rules item
     - event_id=int(): nhỏ nhất là 1, phải có mặt trong danh sách event
     - event_id=empty: convert all event
+    - ip_mode: gom IOC IP theo (role, port) thành IP list / reputation blocklist
     """
     if event_id is None:
-        return {"ok": True, "results": build_rules_for_all_new()}
+        return {"ok": True, "results": build_rules_for_all_new(ip_mode=ip_mode)}
     _ensure_event_id_exists(event_id)
-    return {"ok": True, **build_rules_for_event(event_id)}
+    return {"ok": True, **build_rules_for_event(event_id, ip_mode=ip_mode)}
 
 @router.get("/items", response_model=List[RuleItem])
 async def list_rule_items(
@@ -82,6 +88,19 @@ async def list_rule_items(
     return items
 
 
+@router.put("/items/{sid}/suppress")
+async def set_rule_suppress(sid: int, body: Optional[SuppressPolicy] = None):
+    """
+    Đặt policy chống bão alert cho sid (body rỗng -> bỏ policy, dùng mặc định ALERT_SUPPRESS_*).
+    Áp dụng cho alert ingest kế tiếp (cache enrichment của sid bị bỏ).
+    """
+    upd = {"$set": {"suppress": body.model_dump()}} if body else {"$unset": {"suppress": ""}}
+    res = col_rule_items.update_many({"sid": sid}, upd)
+    if not res.matched_count:
+        raise HTTPException(status_code=404, detail=f"sid={sid} not found")
+    invalidate_enrichment(sids=[sid])
+    return {"ok": True, "sid": sid, "suppress": body.model_dump() if body else None}
+
 @router.get("/sets")
 async def list_rule_sets(
     skip: int = Query(0, ge=0),
@@ -153,29 +172,61 @@ async def api_toggle_converted_tag(body: ConvertedTagRequest):
     return toggle_converted_tag(body)
 #---------------------------------------------------------------
 
-@router.post("/{rule_set_version}/build", response_model=RuleSetBuildResponse)
+@router.post(
+    "/{rule_set_version}/build",
+    response_model=RuleSetBuildResponse,      # wait=true (200)
+    responses={202: {"model": RuleSetBuildJob, "description": "wait=false: job đã vào build queue"}},
+)
 async def api_build_rule_set(
-    rule_set_version: str = Path(..., description="Rule set version, e.g. 2025.11.15-080816-e1")
+    rule_set_version: str = Path(..., description="Rule set version, e.g. 2025.11.15-080816-e1"),
+    wait: bool = Query(False, description="false: đưa vào build queue, trả 202 + job; true: build đồng bộ như cũ"),
 ):
     """
     tạo file .tgz + update rule_sets.
+    - wait=false: build chạy trên process pool, trả 202 {job_id, status}; xem /build-jobs/{job_id}
     """
+    if not wait:
+        try:
+            job = submit_build(rule_set_version)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="rule_set not found")
+        return JSONResponse(status_code=202, content=job)
+
+    t0 = time.perf_counter()
     try:
         rs = build_files_for_rule_set(rule_set_version)
     except ValueError:
         raise HTTPException(status_code=404, detail="rule_set not found")
+    BUILD_SECONDS.labels("sync", "done").observe(time.perf_counter() - t0)
+    return RuleSetBuildResponse(**build_summary(rs))
+
+
+class RuleSetBuildBatchRequest(BaseModel):
+    versions: List[str] = Field(..., min_length=1, description="list rule set version cần build")
+
+
+@router.post("/build-batch", status_code=202)
+async def api_build_rule_sets(body: RuleSetBuildBatchRequest):
+    """
+    Đưa nhiều rule set vào build queue (build song song theo RULE_BUILD_WORKERS)
+    """
+    return {"jobs": submit_builds(body.versions)}
+
+
+@router.get("/build-jobs")
+async def api_list_build_jobs(
+    status: Optional[Literal["queued", "running", "done", "failed"]] = Query(None)
+):
+    return {"jobs": list_jobs(status), "queue_depth": queue_depth()}
+
+
+@router.get("/build-jobs/{job_id}", response_model=RuleSetBuildJob, response_model_exclude_unset=True)
+async def api_get_build_job(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="build job not found")
+    return job
 
-    tar_info = (rs.get("files") or {}).get("tar") or {}
-    return RuleSetBuildResponse(
-        id=str(rs["_id"]),
-        version=rs["version"],
-        build_time=rs["build_time"].isoformat(),
-        path=tar_info.get("path", ""),
-        sha256=tar_info.get("sha256", ""),
-        item_count=rs.get("item_count", 0),
-        status=rs.get("status", "ready"),
-        active=rs.get("active", False),
-    )
 # ---------- /{version}/deploy ----------
 
 class RuleSetDeployRequest(BaseModel):
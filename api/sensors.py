@@ -3,13 +3,13 @@ from pydantic import BaseModel, Field, field_validator
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone
 from pymongo.errors import PyMongoError
-from app.database.mongo import db_ioc
+from app.database.collections import col_sensor_heartbeat
 from app.api.helpers import _check_key
 from app.models.sensor_models import Heartbeat, StatusUpdate
 import asyncio
 
 router = APIRouter(prefix="/api/v1/sensors", tags=["sensors"])
-col = db_ioc["sensor_infor"]
+col = col_sensor_heartbeat     # heartbeat / status: durability profile "heartbeat"
 
 # ===== Thresholds =====
 STATUS_INTERVAL = 60       # 1 phút -> dormant
@@ -0,0 +1,72 @@
+"""
+Đo throughput IOCIndex.lookup (lookups/s trên 1 core) với index tổng hợp, không cần Mongo.
+
+    python -m app.benchmarks.bench_ioc_lookup [--iocs 500000] [--queries 200000] [--hit-rate 0.05] [--cidrs 1000]
+"""
+import argparse, random, sys, time
+
+from app.services.ioc_index import IOCIndex
+
+
+def _ioc(i: int) -> dict:
+    a, b, c = (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF
+    k = i % 3
+    if k == 0:
+        return {"uuid": f"u{i}", "type": "ip-dst", "value": f"10.{a}.{b}.{c}", "event_id": i, "to_ids": True,
+                "norm": {"type_family": "network", "ip": f"10.{a}.{b}.{c}"}}
+    if k == 1:
+        return {"uuid": f"u{i}", "type": "domain", "value": f"evil{i}.example.com", "event_id": i, "to_ids": True,
+                "norm": {"type_family": "network", "host": f"evil{i}.example.com"}}
+    return {"uuid": f"u{i}", "type": "sha256", "value": f"{i:064x}", "event_id": i, "to_ids": True,
+            "norm": {"type_family": "file"}}
+
+
+def _queries(n: int, n_iocs: int, hit_rate: float):
+    rnd = random.Random(7)
+    out = []
+    for q in range(n):
+        if rnd.random() < hit_rate:
+            d = _ioc(rnd.randrange(n_iocs))
+            out.append(d["value"].upper() if d["type"] == "sha256" else d["value"])
+        else:
+            k = q % 3
+            out.append(f"192.0.{(q >> 8) & 0xFF}.{q & 0xFF}" if k == 0
+                       else f"www.clean{q}.example.org" if k == 1 else f"{q + 10**9:064x}")
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iocs", type=int, default=500_000)
+    ap.add_argument("--queries", type=int, default=200_000)
+    ap.add_argument("--hit-rate", type=float, default=0.05)
+    ap.add_argument("--cidrs", type=int, default=0, help="số IOC dạng CIDR /16../28 thêm vào")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    idx = IOCIndex()
+    t0 = time.perf_counter()
+    idx._load(_ioc(i) for i in range(args.iocs))
+    rnd = random.Random(1)
+    idx._load({"uuid": f"c{i}", "type": "ip-dst", "value": f"172.{16 + i % 16}.{i % 256}.0/{rnd.choice((16, 20, 24, 28))}",
+               "event_id": 0, "to_ids": True, "norm": {"type_family": "network", "ip": f"172.{16 + i % 16}.{i % 256}.0/24"}}
+              for i in range(args.cidrs))
+    build = time.perf_counter() - t0
+    print(f"index: iocs={args.iocs + args.cidrs} keys={len(idx.exact)} build={build:.2f}s "
+          f"({(args.iocs + args.cidrs) / build:,.0f} iocs/s)")
+
+    qs = _queries(args.queries, args.iocs, args.hit_rate)
+    print(f"{'mode':22s} {'lookups/s':>12s} {'hits':>8s}")
+    for name, kw in (("exact", dict(cidr=False, parents=False)),
+                     ("exact+cidr+parents", dict(cidr=True, parents=True))):
+        best, hits = float("inf"), 0
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            hits = len(idx.lookup(qs, **kw))
+            best = min(best, time.perf_counter() - t0)
+        print(f"{name:22s} {len(qs) / best:12,.0f} {hits:8d}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
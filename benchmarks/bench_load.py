@@ -0,0 +1,437 @@
+"""
+Load test end-to-end: app FastAPI thật (uvicorn, process riêng) + sensor giả lập + MISP giả lập (fake_misp).
+
+Scenario (--scenarios, chạy theo thứ tự):
+  ingest : --sensors sensor, mỗi sensor gửi heartbeat mỗi --hb-interval s, status mỗi --status-interval s,
+           /alerts/push --alert-rate alert/s theo batch --batch, trong --duration giây
+  rules  : --cycles vòng MISP pull -> convert -> build (wait=true) -> deploy -> download .tgz;
+           mỗi vòng MISP giả lập có thêm --events event mới (--attrs attribute / event)
+
+Mongo (--backend):
+  mongod : MONGO_URI (mặc định mongodb://localhost:27017); app dùng DB riêng --db-prefix_ioc / _sec
+           (MONGO_DB_IOC / MONGO_DB_SEC), drop trước khi chạy
+  memory : mongomock trong process server (cần `pip install mongomock`) -> đo phần app, không đo Mongo
+
+Latency tính từ thời điểm request lẽ ra được gửi theo lịch (open-loop): client quá tải / server chậm
+vẫn hiện ra ở p99 thay vì bị che (coordinated omission). RSS của process server lấy từ /proc (Linux).
+
+Kết quả JSON (--out, mặc định bench_results/load-<git rev>-<thời gian>.json); --compare <json cũ> in
+chênh lệch p50/p99/throughput, --fail-on-regression -> exit 1 nếu tệ hơn --threshold.
+
+    python -m app.benchmarks.bench_load --backend mongod --sensors 20 --duration 30 \\
+        [--scenarios ingest,rules] [--cycles 5 --events 50 --attrs 20] [--compare bench_results/old.json]
+
+Server chạy từ thư mục cha của package (main.py mount ./app/static, ./app/templates; thiếu static -> tạo rỗng).
+"""
+import argparse, heapq, http.client, json, os, platform, random, shutil, socket, statistics, subprocess
+import sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ADMIN_KEY = "bench-admin"
+MISP_KEY = "bench-key"
+_PKG = Path(os.path.abspath(__file__)).parent.parent        # .../app (không resolve symlink)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pct(xs: List[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(int(len(xs) * p), len(xs) - 1)] if xs else 0.0
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_PKG, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+# ---- server (process con)
+def serve(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, required=True)
+    ap.add_argument("--backend", choices=("mongod", "memory"), default="mongod")
+    args = ap.parse_args(argv)
+    if args.backend == "memory":
+        import mongomock, pymongo
+        pymongo.MongoClient = mongomock.MongoClient     # trước khi import app.database
+    os.chdir(_PKG.parent)
+    (_PKG / "static").mkdir(exist_ok=True)
+    import uvicorn
+    from app.main import app
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+    return 0
+
+
+class Server:
+    def __init__(self, args, env: Dict[str, str]):
+        self.port = _free_port()
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "app.benchmarks.bench_load", "serve", "--port", str(self.port),
+             "--backend", args.backend],
+            cwd=_PKG.parent, env={**os.environ, **env}, stdout=subprocess.DEVNULL)
+        for _ in range(300):
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {self.proc.returncode}")
+            try:
+                if _request(self.port, "GET", "/ping")[0] == 200:
+                    return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("server did not start")
+
+    def rss_mb(self) -> Dict[str, Optional[float]]:
+        """VmRSS hiện tại / VmHWM (đỉnh từ lúc start) của process server."""
+        out: Dict[str, Optional[float]] = {"rss": None, "hwm": None}
+        try:
+            for line in Path(f"/proc/{self.proc.pid}/status").read_text().splitlines():
+                k, _, v = line.partition(":")
+                if k in ("VmRSS", "VmHWM"):
+                    out["rss" if k == "VmRSS" else "hwm"] = round(int(v.split()[0]) / 1024, 1)
+        except OSError:
+            pass
+        return out
+
+    def stop(self) -> None:
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+# ---- HTTP client (1 connection keep-alive / thread)
+_local = threading.local()
+
+
+def _request(port: int, method: str, path: str, body: Any = None,
+             headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+    h = {"Content-Type": "application/json", **(headers or {})}
+    data = json.dumps(body).encode() if body is not None else None
+    for attempt in (0, 1):
+        conn = getattr(_local, "conn", None)
+        reused = conn is not None and getattr(_local, "port", None) == port
+        if not reused:
+            conn = _local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            _local.port = port
+        try:
+            conn.request(method, path, body=data, headers=h)
+            r = conn.getresponse()
+            return r.status, r.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            _local.conn = None
+            if not reused or attempt:      # keep-alive bị server đóng khi rảnh -> thử lại 1 lần
+                raise
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lat: Dict[str, List[float]] = {}
+        self.err: Dict[str, int] = {}
+        self.units: Dict[str, int] = {}          # alert / event / rule ... theo loại request
+
+    def add(self, kind: str, ms: float, ok: bool, units: int = 0) -> None:
+        with self.lock:
+            self.lat.setdefault(kind, []).append(ms)
+            self.err[kind] = self.err.get(kind, 0) + (not ok)
+            self.units[kind] = self.units.get(kind, 0) + (units if ok else 0)
+
+    def summary(self, seconds: float) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for kind, xs in self.lat.items():
+            out[kind] = {"requests": len(xs), "errors": self.err.get(kind, 0),
+                         "p50_ms": round(_pct(xs, .5), 2), "p99_ms": round(_pct(xs, .99), 2),
+                         "mean_ms": round(statistics.mean(xs), 2), "max_ms": round(max(xs), 2),
+                         "req_per_sec": round(len(xs) / seconds, 1) if seconds else None}
+            if self.units.get(kind):
+                out[kind]["units_per_sec"] = round(self.units[kind] / seconds, 1) if seconds else None
+        return out
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, server: Server, every: float = 0.5):
+        super().__init__(daemon=True)
+        self.server, self.every = server, every
+        self.stop_ev = threading.Event()
+        self.start_mb = server.rss_mb()["rss"]
+        self.peak_mb = self.start_mb or 0.0
+
+    def run(self):
+        while not self.stop_ev.wait(self.every):
+            self.peak_mb = max(self.peak_mb, self.server.rss_mb()["rss"] or 0.0)
+
+    def finish(self) -> Dict[str, Optional[float]]:
+        self.stop_ev.set(); self.join()
+        end = self.server.rss_mb()["rss"]
+        return {"start_mb": self.start_mb, "end_mb": end, "peak_mb": max(self.peak_mb, end or 0.0) or None}
+
+
+# ---- payload sensor giả lập
+def _sensor_id(i: int) -> str:
+    return f"bench-{i}"
+
+
+def _heartbeat(sid: str, rnd: random.Random) -> dict:
+    return {"sensor_id": sid, "hostname": f"{sid}.bench.local", "roles": ["ids"], "ifaces": ["eth1"],
+            "engine_versions": {"snort": "3.1.0"}, "last_heartbeat": datetime.now(timezone.utc).isoformat(),
+            "cpu_pct": round(rnd.uniform(5, 90), 1), "mem_pct": round(rnd.uniform(20, 80), 1),
+            "disk_free_gb": round(rnd.uniform(10, 500), 1),
+            "traffic": {"eth1": {"rx_pps": rnd.randrange(10_000), "tx_pps": rnd.randrange(10_000)}}}
+
+
+def _status(sid: str) -> dict:
+    return {"sensor_id": sid, "status": "active", "rule_versions": []}
+
+
+def _alerts(sid: str, n: int, rnd: random.Random, args, payloads: List[str]) -> List[dict]:
+    now = datetime.now(timezone.utc).strftime("%m/%d-%H:%M:%S.%f")
+    out = []
+    for _ in range(n):
+        dup = rnd.random() < args.dup_rate            # cùng flow -> suppression / aggregate
+        a = {"timestamp": now, "sensor_id": sid, "rule": f"1:{3_000_000 + rnd.randrange(args.rules)}:1",
+             "class": "trojan-activity", "priority": 1, "msg": "bench alert", "proto": "TCP",
+             "src_addr": "10.0.0.1" if dup else f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}",
+             "src_port": 40000 if dup else rnd.randrange(1024, 65535),
+             "dst_addr": "192.0.2.10", "dst_port": 443}
+        if payloads:
+            a["b64_data"] = rnd.choice(payloads)
+        out.append(a)
+    return out
+
+
+# ---- scenario: ingest
+def run_ingest(server: Server, args) -> dict:
+    import base64
+    rnd = random.Random(7)
+    payloads = [base64.b64encode(rnd.randbytes(args.payload_bytes)).decode() for _ in range(64)] \
+        if args.payload_bytes else []
+    keys = {_sensor_id(i): f"key-{i}" for i in range(args.sensors)}
+    rec = Recorder()
+    push_every = args.batch / args.alert_rate if args.alert_rate > 0 else None
+
+    # lịch open-loop: (thời điểm, loại, sensor); lệch pha ngẫu nhiên giữa các sensor
+    t0 = time.perf_counter() + 0.5
+    heap: List[Tuple[float, str, str]] = []
+    for sid in keys:
+        heap.append((t0 + rnd.uniform(0, args.hb_interval), "heartbeat", sid))
+        heap.append((t0 + rnd.uniform(0, args.status_interval), "status", sid))
+        if push_every:
+            heap.append((t0 + rnd.uniform(0, push_every), "push", sid))
+    heapq.heapify(heap)
+    every = {"heartbeat": args.hb_interval, "status": args.status_interval, "push": push_every}
+    end = t0 + args.duration
+
+    def send(kind: str, sid: str, due: float, wrnd: random.Random):
+        h = {"x-api-key": keys[sid]}
+        try:
+            if kind == "heartbeat":
+                st, _ = _request(server.port, "PUT", "/api/v1/sensors/heartbeat", _heartbeat(sid, wrnd), h)
+                units = 0
+            elif kind == "status":
+                st, _ = _request(server.port, "PUT", "/api/v1/sensors/status", _status(sid), h)
+                units = 0
+            else:
+                st, _ = _request(server.port, "POST", "/api/v1/alerts/push",
+                                 _alerts(sid, args.batch, wrnd, args, payloads), h)
+                units = args.batch
+            ok = st < 400
+        except OSError:
+            ok, units = False, 0
+        rec.add(kind, (time.perf_counter() - due) * 1000, ok, units)
+
+    rss = RssSampler(server); rss.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        while heap and heap[0][0] < end:
+            due, kind, sid = heapq.heappop(heap)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            ex.submit(send, kind, sid, due, random.Random(hash((sid, due))))
+            heapq.heappush(heap, (due + every[kind], kind, sid))
+    secs = time.perf_counter() - t0
+    return {"duration_s": round(secs, 2), "sensors": args.sensors, "requests": rec.summary(secs),
+            "rss_mb": rss.finish()}
+
+
+# ---- scenario: MISP -> rules -> sensor
+def run_rules(server: Server, misp, args) -> dict:
+    rec = Recorder()
+    adm = {"x-admin-key": ADMIN_KEY}
+    sensors = [_sensor_id(i) for i in range(args.sensors)]
+    rnd = random.Random(11)
+    for i, sid in enumerate(sensors):          # sensor phải tồn tại để deploy khớp
+        _request(server.port, "PUT", "/api/v1/sensors/heartbeat", _heartbeat(sid, rnd), {"x-api-key": f"key-{i}"})
+
+    def timed(kind: str, method: str, path: str, body=None, units_of=None):
+        t = time.perf_counter()
+        try:
+            st, data = _request(server.port, method, path, body, adm)
+        except OSError:
+            st, data = 599, b""
+        ok = st < 400
+        res = json.loads(data) if ok and data and kind != "download" else {}
+        units = units_of(res, data) if ok and units_of else 0
+        rec.add(kind, (time.perf_counter() - t) * 1000, ok, units)
+        return res if ok else None
+
+    totals = {"events": 0, "iocs": 0, "rules": 0, "rule_sets": 0, "bytes": 0}
+    rss = RssSampler(server); rss.start()
+    t0 = time.perf_counter()
+    for _ in range(args.cycles):
+        with misp.lock:
+            misp.n_events += args.events        # MISP có thêm event mới cho vòng này
+        r = timed("misp_pull", "POST", f"/api/v1/misp/pull?since=24h&page_size={args.page_size}",
+                  units_of=lambda res, _: res.get("iocs_upserted", 0))
+        if r:
+            totals["events"] += r.get("events_upserted", 0); totals["iocs"] += r.get("iocs_upserted", 0)
+        r = timed("convert", "POST", "/api/v1/rules/convert",
+                  units_of=lambda res, _: sum(x.get("count", 0) for x in res.get("results", [])))
+        versions = [x["version"] for x in (r or {}).get("results", []) if x.get("version")]
+        totals["rules"] += sum(x.get("count", 0) for x in (r or {}).get("results", []))
+        totals["rule_sets"] += len(versions)
+        for v in versions:
+            timed("build", "POST", f"/api/v1/rules/{v}/build?wait=true")
+            timed("deploy", "POST", f"/api/v1/rules/{v}/deploy", {"target": "list", "sensors": sensors})
+            timed("download", "GET", f"/api/v1/rules/{v}/file", units_of=lambda _, data: len(data))
+    secs = time.perf_counter() - t0
+    totals["bytes"] = rec.units.get("download", 0)
+    return {"duration_s": round(secs, 2), "cycles": args.cycles, "events_per_cycle": args.events,
+            "attrs_per_event": args.attrs, "totals": totals, "requests": rec.summary(secs),
+            "throughput": {"iocs_per_sec": round(totals["iocs"] / secs, 1) if secs else None,
+                           "rules_per_sec": round(totals["rules"] / secs, 1) if secs else None},
+            "rss_mb": rss.finish()}
+
+
+# ---- so sánh với lần chạy trước
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """In chênh lệch theo scenario / loại request; trả danh sách dòng bị coi là regression."""
+    bad = []
+    print(f"\ncompare: {old.get('meta', {}).get('git_rev')} -> {new['meta']['git_rev']} (threshold {threshold:.0%})")
+    diff = sorted(k for k, v in new["meta"]["args"].items() if old.get("meta", {}).get("args", {}).get(k) != v)
+    if diff or old.get("meta", {}).get("backend") != new["meta"]["backend"]:
+        print(f"warning: args/backend khác lần chạy cũ ({', '.join(diff) or 'backend'}) -> số liệu không cùng điều kiện")
+    print(f"{'scenario/request':28s} {'metric':>13s} {'old':>10s} {'new':>10s} {'delta':>8s}")
+    for sc, res in new["scenarios"].items():
+        old_req = (old.get("scenarios", {}).get(sc) or {}).get("requests", {})
+        for kind, st in res.get("requests", {}).items():
+            o = old_req.get(kind)
+            if not o:
+                continue
+            for m, higher_is_worse in (("p50_ms", True), ("p99_ms", True), ("units_per_sec", False), ("req_per_sec", False)):
+                if not o.get(m) or st.get(m) is None:
+                    continue
+                d = (st[m] - o[m]) / o[m]
+                worse = d > threshold if higher_is_worse else -d > threshold
+                # req/s của ingest đi theo lịch cố định -> chỉ coi là regression khi lịch bị trễ (units/s cũng giảm)
+                flag = " !" if worse and m != "req_per_sec" else ""
+                print(f"{sc + '/' + kind:28s} {m:>13s} {o[m]:10,.1f} {st[m]:10,.1f} {d:+8.1%}{flag}")
+                if flag:
+                    bad.append(f"{sc}/{kind} {m}")
+    return bad
+
+
+def _print(res: dict) -> None:
+    for sc, r in res["scenarios"].items():
+        rss = r.get("rss_mb") or {}
+        print(f"\n[{sc}] {r['duration_s']} s  rss start={rss.get('start_mb')} end={rss.get('end_mb')} "
+              f"peak={rss.get('peak_mb')} MB")
+        if r.get("throughput"):
+            print("  " + "  ".join(f"{k}={v}" for k, v in r["throughput"].items()))
+        print(f"  {'request':12s} {'n':>7s} {'err':>5s} {'p50 ms':>9s} {'p99 ms':>9s} {'req/s':>8s} {'units/s':>10s}")
+        for kind, s in r["requests"].items():
+            print(f"  {kind:12s} {s['requests']:7d} {s['errors']:5d} {s['p50_ms']:9.2f} {s['p99_ms']:9.2f} "
+                  f"{s['req_per_sec'] or 0:8.1f} {s.get('units_per_sec') or 0:10,.1f}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["serve"]:
+        return serve(argv[1:])
+    ap = argparse.ArgumentParser(description="Load test end-to-end với sensor + MISP giả lập")
+    ap.add_argument("--scenarios", default="ingest,rules")
+    ap.add_argument("--backend", choices=("mongod", "memory"), default="mongod")
+    ap.add_argument("--db-prefix", default="bench_load")
+    ap.add_argument("--sensors", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=30, help="giây, scenario ingest")
+    ap.add_argument("--hb-interval", type=float, default=10, help="giây giữa 2 heartbeat / sensor")
+    ap.add_argument("--status-interval", type=float, default=60, help="giây giữa 2 status / sensor")
+    ap.add_argument("--alert-rate", type=float, default=50, help="alert/s / sensor (0 = không push)")
+    ap.add_argument("--batch", type=int, default=50, help="alert / push")
+    ap.add_argument("--rules", type=int, default=500, help="số sid khác nhau trong alert")
+    ap.add_argument("--dup-rate", type=float, default=0.2, help="tỉ lệ alert cùng flow")
+    ap.add_argument("--payload-bytes", type=int, default=256, help="b64_data / alert (0 = không gửi)")
+    ap.add_argument("--concurrency", type=int, default=32, help="số kết nối client song song")
+    ap.add_argument("--cycles", type=int, default=5, help="scenario rules: số vòng pull -> download")
+    ap.add_argument("--events", type=int, default=50, help="event MISP mới / vòng")
+    ap.add_argument("--attrs", type=int, default=20, help="attribute / event")
+    ap.add_argument("--page-size", type=int, default=100)
+    ap.add_argument("--out", help="file JSON kết quả")
+    ap.add_argument("--compare", help="JSON của lần chạy trước")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    ap.add_argument("--fail-on-regression", action="store_true")
+    args = ap.parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    for s in scenarios:
+        if s not in ("ingest", "rules"):
+            ap.error(f"unknown scenario: {s}")
+
+    from app.benchmarks.fake_misp import FakeMISP, serve as serve_misp
+    misp = FakeMISP(0, args.attrs, base_ts=int(time.time()) - 3600, key=MISP_KEY)
+    misp_srv = serve_misp(misp)
+    work = Path(tempfile.mkdtemp(prefix="bench_load-"))
+    db_ioc, db_sec = f"{args.db_prefix}_ioc", f"{args.db_prefix}_sec"
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    if args.backend == "mongod":
+        from pymongo import MongoClient
+        with MongoClient(mongo_uri, serverSelectionTimeoutMS=5000) as c:
+            c.drop_database(db_ioc); c.drop_database(db_sec)
+    env = {
+        "MONGO_URI": mongo_uri, "MONGO_DB_IOC": db_ioc, "MONGO_DB_SEC": db_sec,
+        "API_KEYS": ",".join(f"{_sensor_id(i)}=key-{i}" for i in range(args.sensors)),
+        "CONSOLE_ADMIN_KEY": ADMIN_KEY, "MISP_URL": f"http://127.0.0.1:{misp_srv.server_address[1]}",
+        "MISP_KEY": MISP_KEY, "MISP_VERIFY_SSL": "false", "MISP_SYNC_INTERVAL_MIN": "0",
+        "RULE_BASE_DIR": str(work / "rules"), "SPOOL_DIR": str(work / "spool"), "ARCHIVE_DIR": str(work / "archive"),
+        "PROFILE_DIR": "",
+    }
+    out: Dict[str, Any] = {"meta": {
+        "git_rev": _git_rev(), "started_at": datetime.now(timezone.utc).isoformat(), "backend": args.backend,
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+    }, "scenarios": {}}
+
+    server = Server(args, env)
+    try:
+        for sc in scenarios:
+            print(f"running {sc} ...", file=sys.stderr)
+            out["scenarios"][sc] = run_ingest(server, args) if sc == "ingest" else run_rules(server, misp, args)
+    finally:
+        server.stop()
+        misp_srv.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    path = Path(args.out or f"bench_results/load-{out['meta']['git_rev']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(out, indent=2))
+    _print(out)
+    print(f"\nresults: {path}")
+    if args.compare:
+        bad = compare(json.loads(Path(args.compare).read_text()), out, args.threshold)
+        if bad and args.fail_on_regression:
+            print(f"regressions: {', '.join(bad)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
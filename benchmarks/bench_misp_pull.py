@@ -0,0 +1,150 @@
+"""
+Đo throughput MISPService.pull với MISP giả lập (benchmarks/fake_misp chạy ở process riêng):
+  end-to-end : events/s, attributes/s, peak RSS của process pull
+  phases     : search (restSearch theo trang), transform (_event_docs), bulk_write, tagging
+
+    MONGO_URI=mongodb://localhost:27017 python -m app.benchmarks.bench_misp_pull \\
+        [--events 5000] [--attrs 20] [--page-size 100] [--prefetch 2] [--latency-ms 0] [--db bench_misp_pull]
+
+Ghi vào database riêng (--db, bị drop trước mỗi lần chạy), không đụng misp_ioc.
+"""
+import argparse, json, os, resource, socket, subprocess, sys, time
+from datetime import datetime, timezone
+import urllib.request
+from typing import Tuple
+
+from pymongo import UpdateOne
+
+from app.database.mongo import db_ioc
+
+BENCH_KEY = "bench-key"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake(args) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    proc = subprocess.Popen([
+        sys.executable, "-m", "app.benchmarks.fake_misp", "--port", str(port),
+        "--events", str(args.events), "--attrs", str(args.attrs), "--key", BENCH_KEY,
+        "--latency-ms", str(args.latency_ms), "--tag-fail-rate", str(args.tag_fail_rate),
+    ], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/servers/getVersion", timeout=1).read()
+            return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("fake MISP did not start")
+
+
+def _reset(db):
+    for name in ("events", "iocs", "sync_state", "tag_failures"):
+        db[name].drop()
+    db["events"].create_index("uuid", unique=True)
+    db["iocs"].create_index("uuid", unique=True)
+
+
+def _timed(fn):
+    t0 = time.perf_counter()
+    res = fn()
+    return res, time.perf_counter() - t0
+
+
+def run_phases(svc, args) -> dict:
+    """Chạy từng pha tách biệt trên cùng dữ liệu (giữ toàn bộ trang trong RAM — chỉ để đo)."""
+    from app.services.misp_service import _event_docs, _ChunkedBulk, MISP_BULK_CHUNK
+
+    misp = svc._client()
+    now = datetime.now(timezone.utc)
+    flt = {"controller": "events", "last": "1970-01-02 00:00:00", "published": None}
+
+    pages, t_search = _timed(lambda: list(svc._iter_pages(misp, flt, args.page_size, args.prefetch, "bench")))
+    events = [e["Event"] for p in pages for e in p]
+    docs, t_transform = _timed(lambda: [_event_docs(E, now, svc.url) for E in events])
+
+    _reset(svc.db)
+
+    def write():
+        ev_w = _ChunkedBulk(svc.col_events, MISP_BULK_CHUNK)
+        ioc_w = _ChunkedBulk(svc.col_iocs, MISP_BULK_CHUNK)
+        for ev_doc, iocs in docs:
+            ev_w.add(UpdateOne({"uuid": ev_doc["uuid"]}, {"$set": ev_doc}, upsert=True))
+            for A in iocs:
+                ioc_w.add(UpdateOne({"uuid": A["uuid"]}, {"$set": A}, upsert=True))
+        ev_w.flush(); ioc_w.flush()
+        return ev_w.flushes + ioc_w.flushes
+    flushes, t_write = _timed(write)
+
+    tg, t_tag = _timed(lambda: svc._tag_imported([E["uuid"] for E in events], "bench"))
+
+    n_attr = sum(len(i) for _, i in docs)
+    return {
+        "events": len(events), "attributes": n_attr, "pages": len(pages), "flushes": flushes,
+        "search_s": t_search, "transform_s": t_transform, "bulk_write_s": t_write, "tagging_s": t_tag,
+        "tag_failed": tg["failed"],
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=5000)
+    ap.add_argument("--attrs", type=int, default=20, help="attribute / event")
+    ap.add_argument("--page-size", type=int, default=100)
+    ap.add_argument("--prefetch", type=int, default=2)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="độ trễ giả lập mỗi request MISP")
+    ap.add_argument("--tag-fail-rate", type=float, default=0.0)
+    ap.add_argument("--db", default="bench_misp_pull")
+    ap.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = ap.parse_args(argv)
+
+    proc, url = _start_fake(args)
+    try:
+        os.environ.update({"MISP_URL": url, "MISP_KEY": BENCH_KEY, "MISP_VERIFY_SSL": "false"})
+        from app.services.misp_service import MISPService
+
+        db = db_ioc.client[args.db]
+        _reset(db)
+        svc = MISPService(db, hooks=False)       # không refresh ioc_index / retro-hunt trên DB của app
+
+        rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        res, secs = _timed(lambda: svc.pull(since="3650d", request_id="bench",
+                                            page_size=args.page_size, prefetch=args.prefetch))
+        rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss    # KB (Linux)
+        e2e = {
+            "events": res["events_upserted"], "attributes": res["iocs_upserted"], "seconds": round(secs, 3),
+            "events_per_sec": round(res["events_upserted"] / secs, 1),
+            "attributes_per_sec": round(res["iocs_upserted"] / secs, 1),
+            "tagged": res["events_tagged"], "tag_failed": res["tag_failed"],
+            "peak_rss_mb": round(rss1 / 1024, 1), "rss_growth_mb": round((rss1 - rss0) / 1024, 1),
+        }
+        ph = run_phases(svc, args)
+    finally:
+        proc.terminate(); proc.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps({"end_to_end": e2e, "phases": ph}, indent=2))
+        return 0
+
+    print(f"fake MISP: events={args.events} attrs/event={args.attrs} page_size={args.page_size} "
+          f"prefetch={args.prefetch} latency_ms={args.latency_ms}")
+    print(f"end-to-end  {e2e['seconds']:8.2f} s  {e2e['events_per_sec']:10,.0f} ev/s  "
+          f"{e2e['attributes_per_sec']:12,.0f} attr/s  peak_rss={e2e['peak_rss_mb']} MB "
+          f"(+{e2e['rss_growth_mb']} MB)  tag_failed={e2e['tag_failed']}")
+    total = sum(ph[k] for k in ("search_s", "transform_s", "bulk_write_s", "tagging_s")) or 1
+    print(f"{'phase':11s} {'s':>8s} {'share':>7s} {'attr/s':>12s}")
+    for k in ("search_s", "transform_s", "bulk_write_s", "tagging_s"):
+        rate = ph["attributes"] / ph[k] if ph[k] and k != "tagging_s" else ph["events"] / ph[k] if ph[k] else 0
+        unit = "ev/s" if k == "tagging_s" else ""
+        print(f"{k[:-2]:11s} {ph[k]:8.2f} {ph[k] / total:7.1%} {rate:12,.0f} {unit}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
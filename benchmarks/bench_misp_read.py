@@ -0,0 +1,65 @@
+"""
+So sánh latency các read endpoint MISP (/stats, /events, /iocs):
+  per_request : cách cũ — mỗi request dựng MISPService + chạy lại 9 create_index của _ensure_indexes() cũ
+  shared      : instance dùng chung, index tạo 1 lần lúc khởi động
+
+    MONGO_URI=mongodb://localhost:27017 python -m app.benchmarks.bench_misp_read [--n 200]
+"""
+import argparse, statistics, sys, time
+
+from app.database.mongo import db_ioc
+from app.database.collections import ensure_indexes
+from app.services.misp_service import MISPService, get_misp_service
+
+
+def _old_ensure_indexes(svc: MISPService) -> None:
+    # đúng 9 index MISPService._ensure_indexes() cũ tạo mỗi lần dựng service (không phải toàn bộ ensure_indexes())
+    svc.col_events.create_index("uuid", unique=True)
+    svc.col_events.create_index([("published", 1), ("timestamp", -1)])
+    svc.col_events.create_index([("tags", 1)])
+    svc.col_iocs.create_index("uuid", unique=True)
+    svc.col_iocs.create_index([("type", 1), ("value", 1)])
+    svc.col_iocs.create_index("event_uuid")
+    svc.col_iocs.create_index([("to_ids", 1), ("timestamp", -1)])
+    svc.col_iocs.create_index("norm.host")
+    svc.col_iocs.create_index("norm.ip")
+
+
+def _old_svc() -> MISPService:
+    svc = MISPService(db_ioc)
+    _old_ensure_indexes(svc)    # __init__ cũ gọi _ensure_indexes() mỗi lần
+    return svc
+
+
+READS = {
+    "stats": lambda svc: svc.stats(),
+    "events": lambda svc: svc.query_events({}, limit=50),
+    "iocs": lambda svc: svc.query_iocs({}, limit=100),
+}
+
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(int(len(xs) * p), len(xs) - 1)]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    args = ap.parse_args(argv)
+
+    ensure_indexes()
+    print(f"{'endpoint':8s} {'mode':12s} {'p50 ms':>8s} {'p99 ms':>8s} {'mean ms':>8s}")
+    for name, read in READS.items():
+        for mode, factory in (("per_request", _old_svc), ("shared", get_misp_service)):
+            lat = []
+            for _ in range(args.n):
+                t0 = time.perf_counter()
+                read(factory())
+                lat.append((time.perf_counter() - t0) * 1000)
+            print(f"{name:8s} {mode:12s} {_pct(lat, .5):8.2f} {_pct(lat, .99):8.2f} {statistics.mean(lat):8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
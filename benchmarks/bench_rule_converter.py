@@ -0,0 +1,58 @@
+"""
+Đo throughput của rule_converter (rules/s) theo từng loại IOC.
+
+    python -m app.benchmarks.bench_rule_converter [--n 50000] [--repeat 3]
+"""
+import argparse, sys, time
+from typing import Dict, Any, List
+
+from app.services.rule_converter import iocs_to_rules
+
+
+def _sample(t: str, i: int) -> str:
+    a, b = (i >> 8) & 0xFF, i & 0xFF
+    return {
+        "domain": f"evil{i}.example.com",
+        "hostname": f"c2-{i}.bad.net",
+        "domain|ip": f"evil{i}.example.com|10.{a}.{b}.1",
+        "ip-dst": f"10.{a}.{b}.1",
+        "ip-src": f"172.16.{a}.{b}",
+        "ip-dst|port": f"10.{a}.{b}.1|443",
+        "ip-src|port": f"192.168.{a}.{b}:8080",
+        "url": f"http://evil{i}.example.com/gate.php?id={i}",
+        "md5": f"{i:032x}",
+        "snort": (f'alert tcp $HOME_NET any -> $EXTERNAL_NET 80 (msg:"bench {i}"; flow:to_server,established; '
+                  f'http_uri; content:"/gate{i}.php", fast_pattern; classtype:trojan-activity; sid:{9_000_000 + i}; rev:1;)'),
+    }[t]
+
+IOC_TYPES = ["domain", "hostname", "domain|ip", "ip-dst", "ip-src", "ip-dst|port", "ip-src|port", "url", "md5", "snort"]
+
+
+def make_iocs(t: str, n: int) -> List[Dict[str, Any]]:
+    return [
+        {"type": t, "value": _sample(t, i), "event_id": 1, "attr_id": i, "event_uuid": "bench-event"}
+        for i in range(n)
+    ]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    sids = list(range(3_000_000, 3_000_000 + args.n))
+    print(f"{'type':14s} {'rules/s':>12s} {'us/rule':>9s}")
+    for t in IOC_TYPES:
+        iocs = make_iocs(t, args.n)
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            iocs_to_rules(iocs, sids)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{t:14s} {args.n / best:12,.0f} {best / args.n * 1e6:9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
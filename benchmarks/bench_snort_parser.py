@@ -0,0 +1,84 @@
+"""
+So sánh tokenizer IR (snort_parser.parse_rule) với đường regex cũ của build_rule_for_snort.
+
+    python -m app.benchmarks.bench_snort_parser snort3-community.rules [--repeat 5]
+
+Corpus: file .rules (vd. snort3-community-rules) hoặc .tar.gz chứa các file *.rules.
+"""
+import argparse, re, sys, tarfile, time
+from typing import List
+
+from app.services.snort_parser import parse_rule, SnortParseError
+
+
+# ---- đường cũ (trước IR): 1 regex DOTALL cho cả rule + 2 re.search ----
+def _legacy_normalize_options_block(opts: str) -> str:
+    parts = [p.strip().rstrip(';') for p in opts.split(';') if p.strip()]
+    return '; '.join(parts) + ';' if parts else ''
+
+def legacy_split(rule_line: str):
+    m = re.match(
+        r'^\s*alert\s+(\w+)\s+([^\s]+)\s+([^\s]+)\s*->\s*([^\s]+)\s+([^\s]+)\s*\((.*)\)\s*$',
+        rule_line, re.IGNORECASE | re.DOTALL
+    )
+    if not m:
+        raise ValueError("Invalid Snort rule format")
+    proto, src, sport, dst, dport, opts = m.groups()
+    opts_norm = _legacy_normalize_options_block(opts)
+    msg_match = re.search(r'msg\s*:\s*"([^"]*)"', opts_norm, re.IGNORECASE)
+    sid_match = re.search(r'\bsid\s*:\s*(\d+)\s*;', opts_norm, re.IGNORECASE)
+    return msg_match, sid_match
+
+
+def load_rules(path: str) -> List[str]:
+    def _lines(text: str):
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("alert "):
+                yield line
+
+    if path.endswith((".tgz", ".tar.gz")):
+        out: List[str] = []
+        with tarfile.open(path) as tar:
+            for m in tar.getmembers():
+                if m.isfile() and m.name.endswith(".rules"):
+                    out.extend(_lines(tar.extractfile(m).read().decode("utf-8", "replace")))
+        return out
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return list(_lines(f.read()))
+
+
+def _bench(fn, rules: List[str], repeat: int):
+    best, errors = float("inf"), 0
+    for _ in range(repeat):
+        errors = 0
+        t0 = time.perf_counter()
+        for r in rules:
+            try:
+                fn(r)
+            except (ValueError, SnortParseError):
+                errors += 1
+        best = min(best, time.perf_counter() - t0)
+    return best, errors
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("corpus")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    rules = load_rules(args.corpus)
+    if not rules:
+        print("no rules found", file=sys.stderr)
+        return 1
+
+    print(f"corpus: {len(rules)} rules")
+    for name, fn in (("legacy_regex", legacy_split), ("ir_tokenizer", parse_rule)):
+        secs, errors = _bench(fn, rules, args.repeat)
+        print(f"{name:14s} {secs * 1000:9.1f} ms  {len(rules) / secs:12,.0f} rules/s  errors={errors}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
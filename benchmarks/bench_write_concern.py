@@ -0,0 +1,87 @@
+"""
+Throughput ingest alert theo durability profile (fast / balanced / durable) với mongod local:
+mỗi profile insert_many --alerts alert theo batch --batch, --threads luồng song song.
+
+    MONGO_URI=mongodb://localhost:27017 python -m app.benchmarks.bench_write_concern \\
+        [--alerts 200000] [--batch 500] [--threads 4] [--profiles fast,balanced,durable] [--db bench_write_concern]
+
+Ghi vào database riêng (--db, collection bị drop trước mỗi profile). Pool: MONGO_MAX_POOL_SIZE, ...
+(database/mongo.py) — nên >= --threads.
+"""
+import argparse, json, statistics, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+
+from app.database.mongo import db_sec
+from app.database.collections import DURABILITY_PROFILES
+
+
+def _alerts(n: int, seed: int):
+    now = datetime.utcnow().isoformat()
+    return [{
+        "_id": ObjectId(), "ts": now, "sensor_id": f"sensor-{i % 4}", "rule_id": f"1:{3000000 + i % 500}:1",
+        "priority": 2, "classification": "trojan-activity", "action": "allow", "msg": "bench alert",
+        "proto": "TCP", "src": {"ip": f"10.{seed % 255}.{i // 256 % 256}.{i % 256}", "port": 40000 + i % 20000},
+        "dst": {"ip": "192.0.2.10", "port": 443}, "ingested_at": now,
+    } for i in range(n)]
+
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(int(len(xs) * p), len(xs) - 1)]
+
+
+def run_profile(col, args) -> dict:
+    batches = args.alerts // args.batch
+    lat = []
+
+    def work(i):
+        docs = _alerts(args.batch, i)
+        t0 = time.perf_counter()
+        col.insert_many(docs, ordered=False)
+        lat.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as ex:
+        list(ex.map(work, range(batches)))
+    secs = time.perf_counter() - t0
+    n = batches * args.batch
+    return {"alerts": n, "seconds": round(secs, 3), "alerts_per_sec": round(n / secs, 1),
+            "batch_p50_ms": round(_pct(lat, .5), 2), "batch_p99_ms": round(_pct(lat, .99), 2),
+            "batch_mean_ms": round(statistics.mean(lat), 2)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--alerts", type=int, default=200_000)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--profiles", default=",".join(DURABILITY_PROFILES))
+    ap.add_argument("--db", default="bench_write_concern")
+    ap.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = ap.parse_args(argv)
+
+    db = db_sec.client[args.db]
+    out = {}
+    for name in [p.strip() for p in args.profiles.split(",") if p.strip()]:
+        wc = DURABILITY_PROFILES[name]
+        db["ids_alerts"].drop()
+        out[name] = {"write_concern": wc.document,
+                     **run_profile(db["ids_alerts"].with_options(write_concern=wc), args)}
+    db["ids_alerts"].drop()
+
+    if args.json:
+        print(json.dumps(out, indent=2))
+        return 0
+    print(f"alerts={args.alerts} batch={args.batch} threads={args.threads}")
+    print(f"{'profile':9s} {'write concern':46s} {'alerts/s':>10s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for name, r in out.items():
+        print(f"{name:9s} {json.dumps(r['write_concern']):46s} {r['alerts_per_sec']:10,.0f} "
+              f"{r['batch_p50_ms']:8.2f} {r['batch_p99_ms']:8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+MISP giả lập (stdlib, không cần MISP thật) để test/bench MISPService.pull / sync / tag_event / ping.
+
+Endpoint:
+  GET  /servers/getVersion, /attributes/describeTypes.json   (PyMISP gọi lúc init)
+  GET  /users/view/me
+  POST /events/restSearch, /attributes/restSearch    (limit/page, timestamp, last, published, tags "!x")
+  POST /tags/attachTagToObject, /tags/removeTagFromObject
+
+Event được sinh tất định theo index (không giữ toàn bộ trong RAM), chỉ tag được lưu.
+
+    python -m app.benchmarks.fake_misp --events 20000 --attrs 50 [--port 8089] [--latency-ms 20] [--tag-fail-rate 0.01]
+"""
+import argparse, json, random, sys, threading, time, uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set
+
+VERSION = "2.4.190"
+_ATTR_TYPES = ["ip-dst", "domain", "url", "md5", "sha256", "hostname", "ip-src|port", "email-src"]
+
+
+def _uuid(kind: int, i: int, j: int = 0) -> str:
+    return str(uuid.UUID(int=(kind << 120) | (i << 32) | j))
+
+
+def _value(t: str, i: int, j: int) -> str:
+    a, b = (i >> 8) & 0xFF, i & 0xFF
+    return {
+        "ip-dst": f"10.{a}.{b}.{j & 0xFF}",
+        "domain": f"evil{i}-{j}.example.com",
+        "url": f"http://evil{i}.example.com/p/{j}.php",
+        "md5": f"{i:016x}{j:016x}",
+        "sha256": f"{i:032x}{j:032x}",
+        "hostname": f"c2-{i}-{j}.bad.net",
+        "ip-src|port": f"172.16.{a}.{b}|{1024 + j}",
+        "email-src": f"u{j}@evil{i}.example.com",
+    }[t]
+
+
+class FakeMISP:
+    def __init__(self, events: int, attrs: int, base_ts: Optional[int] = None,
+                 key: Optional[str] = None, latency_ms: float = 0.0, tag_fail_rate: float = 0.0):
+        self.n_events, self.n_attrs = events, attrs
+        self.base_ts = base_ts or int(time.time()) - events     # event i: timestamp = base_ts + i
+        self.key = key
+        self.latency = latency_ms / 1000.0
+        self.tag_fail_rate = tag_fail_rate
+        self.tags: Dict[int, Set[str]] = {}
+        self.lock = threading.Lock()
+        self.counters = {"search": 0, "tag": 0, "untag": 0, "tag_failed": 0}
+
+    # ---- dữ liệu tổng hợp
+    def _index_of(self, event_uuid: str) -> Optional[int]:
+        try:
+            n = uuid.UUID(event_uuid).int
+        except ValueError:
+            return None
+        i = (n >> 32) & ((1 << 88) - 1)
+        return i if n >> 120 == 1 and i < self.n_events else None
+
+    def _attr(self, i: int, j: int, ts: int) -> Dict[str, Any]:
+        t = _ATTR_TYPES[j % len(_ATTR_TYPES)]
+        return {"id": str(i * self.n_attrs + j + 1), "uuid": _uuid(2, i, j), "event_id": str(i + 1),
+                "type": t, "category": "Network activity", "value": _value(t, i, j),
+                "to_ids": j % 4 != 3, "timestamp": str(ts), "Tag": []}
+
+    def event(self, i: int) -> Dict[str, Any]:
+        ts = self.base_ts + i
+        with self.lock:
+            tags = sorted(self.tags.get(i, ()))
+        return {"Event": {
+            "id": str(i + 1), "uuid": _uuid(1, i), "info": f"synthetic event {i}",
+            "published": i % 2 == 0, "timestamp": str(ts), "attribute_count": str(self.n_attrs),
+            "Orgc": {"name": "FAKE-ORG"}, "Org": {"name": "FAKE-ORG"},
+            "Tag": [{"name": "tlp:green"}] + [{"name": t} for t in tags],
+            "Galaxy": [],
+            "Attribute": [self._attr(i, j, ts) for j in range(self.n_attrs)],
+        }}
+
+    # ---- restSearch
+    def _matches(self, i: int, q: Dict[str, Any], since: int) -> bool:
+        if self.base_ts + i < since:
+            return False
+        pub = q.get("published")
+        if pub is not None and bool(int(pub)) != (i % 2 == 0):
+            return False
+        tags = q.get("tags") or []
+        if isinstance(tags, str):
+            tags = [tags]
+        with self.lock:
+            have = self.tags.get(i, set())
+        for t in tags:
+            if t.startswith("!"):
+                if t[1:] in have:
+                    return False
+            elif t not in have and t != "tlp:green":
+                return False
+        return True
+
+    def _since(self, q: Dict[str, Any]) -> int:
+        since = 0
+        if q.get("timestamp"):
+            since = int(q["timestamp"])
+        if q.get("last"):
+            last = str(q["last"])
+            since = max(since, int(datetime.strptime(last, "%Y-%m-%d %H:%M:%S")
+                                   .replace(tzinfo=timezone.utc).timestamp()) if " " in last else 0)
+        return since
+
+    def search(self, controller: str, q: Dict[str, Any]):
+        with self.lock:
+            self.counters["search"] += 1
+        since = self._since(q)
+        limit = int(q.get("limit") or 0)
+        page = max(int(q.get("page") or 1), 1)
+        first = max(since - self.base_ts, 0)
+
+        if controller == "attributes":
+            # phân trang theo attribute, mỗi event n_attrs attribute liên tiếp
+            total = max(self.n_events - first, 0) * self.n_attrs
+            lo = (page - 1) * limit if limit else 0
+            hi = min(lo + limit, total) if limit else total
+            out = []
+            for k in range(lo, hi):
+                i, j = first + k // self.n_attrs, k % self.n_attrs
+                a = self._attr(i, j, self.base_ts + i)
+                a["Event"] = {"id": str(i + 1), "uuid": _uuid(1, i)}
+                out.append(a)
+            return {"response": {"Attribute": out}}
+
+        # events: duyệt theo index, bỏ qua `skip` event khớp rồi lấy `limit`
+        skip = (page - 1) * limit if limit else 0
+        out: List[Dict[str, Any]] = []
+        for i in range(first, self.n_events):
+            if not self._matches(i, q, since):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            out.append(self.event(i))
+            if limit and len(out) >= limit:
+                break
+        return out
+
+    # ---- tag
+    def tag(self, event_uuid: str, tag: str, add: bool) -> Optional[str]:
+        i = self._index_of(event_uuid)
+        if i is None:
+            return "Invalid Target."
+        with self.lock:
+            if add and self.tag_fail_rate and random.random() < self.tag_fail_rate:
+                self.counters["tag_failed"] += 1
+                return "simulated failure"
+            if add:
+                self.tags.setdefault(i, set()).add(tag)
+            else:
+                self.tags.get(i, set()).discard(tag)
+            self.counters["tag" if add else "untag"] += 1
+        return None
+
+
+def _describe_types() -> Dict[str, Any]:
+    # dùng bản local của PyMISP nếu có, tránh PyMISP log lỗi lúc init
+    try:
+        import pymisp
+        with open(Path(pymisp.__file__).parent / "data" / "describeTypes.json") as f:
+            return json.load(f)
+    except Exception:
+        return {"result": {"categories": [], "types": [], "category_type_mappings": {}, "sane_defaults": {}}}
+
+
+def make_handler(misp: FakeMISP):
+    describe = _describe_types()
+    me = {"User": {"id": "1", "email": "admin@fake.local", "org_id": "1", "role_id": "1"},
+          "Role": {"id": "1", "name": "admin", "perm_admin": True, "perm_tag_editor": True},
+          "UserSetting": {}, "Organisation": {"id": "1", "name": "FAKE-ORG"}}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"    # keep-alive cho session pool phía client
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: Any):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> Dict[str, Any]:
+            n = int(self.headers.get("Content-Length") or 0)
+            if not n:
+                return {}
+            try:
+                return json.loads(self.rfile.read(n))
+            except ValueError:
+                return {}
+
+        def _authorized(self) -> bool:
+            if misp.key and self.headers.get("Authorization") != misp.key:
+                self._send(403, {"name": "Authentication failed.", "message": "Authentication failed.", "url": self.path})
+                return False
+            return True
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/servers/getVersion":
+                return self._send(200, {"version": VERSION, "pymisp_recommended_version": VERSION, "perm_sync": True})
+            if path == "/attributes/describeTypes.json":
+                return self._send(200, describe)
+            if not self._authorized():
+                return
+            if path == "/users/view/me":
+                return self._send(200, me)
+            if path == "/fake/stats":
+                return self._send(200, {**misp.counters, "events": misp.n_events, "attrs_per_event": misp.n_attrs})
+            self._send(404, {"name": "Not Found", "message": "Not Found", "url": self.path})
+
+        def do_POST(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            body = self._body()
+            if not self._authorized():
+                return
+            if misp.latency:
+                time.sleep(misp.latency)
+            if path in ("/events/restSearch", "/attributes/restSearch"):
+                return self._send(200, misp.search(path.split("/")[1], body))
+            if path in ("/tags/attachTagToObject", "/tags/removeTagFromObject"):
+                add = path.endswith("attachTagToObject")
+                err = misp.tag(body.get("uuid", ""), body.get("tag", ""), add)
+                if err:
+                    return self._send(200 if err == "Invalid Target." else 500, {"errors": err})
+                return self._send(200, {"saved": True, "success": "Tag attached." if add else "Tag removed."})
+            self._send(404, {"name": "Not Found", "message": "Not Found", "url": self.path})
+
+    return Handler
+
+
+def serve(misp: FakeMISP, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Chạy server ở thread nền; port=0 -> tự chọn. URL: f"http://{host}:{srv.server_address[1]}"."""
+    srv = ThreadingHTTPServer((host, port), make_handler(misp))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="fake-misp", daemon=True).start()
+    return srv
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local fake MISP server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--events", type=int, default=1000)
+    ap.add_argument("--attrs", type=int, default=20, help="attribute / event")
+    ap.add_argument("--key", default=None, help="nếu set, yêu cầu header Authorization khớp")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="độ trễ thêm cho mỗi POST")
+    ap.add_argument("--tag-fail-rate", type=float, default=0.0, help="tỉ lệ attachTag trả 500")
+    args = ap.parse_args(argv)
+
+    misp = FakeMISP(args.events, args.attrs, key=args.key,
+                    latency_ms=args.latency_ms, tag_fail_rate=args.tag_fail_rate)
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(misp))
+    srv.daemon_threads = True
+    print(f"fake MISP on http://{args.host}:{srv.server_address[1]} events={args.events} attrs/event={args.attrs}", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
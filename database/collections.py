@@ -1,15 +1,119 @@
-from pymongo import ASCENDING, ReturnDocument
+import os, socket, logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, PyMongoError
+from pymongo.write_concern import WriteConcern
 from .mongo import db_ioc
 from  .mongo import db_sec
 
-col_iocs           = db_ioc["iocs"]
-col_events         = db_ioc["events"]
-col_rule_items     = db_ioc["rule_items"]
-col_rule_sets      = db_ioc["rule_sets"]
-col_rule_set_items = db_ioc["rule_set_items"]
-col_counters       = db_ioc["counters"]
-col_sensor_infor   = db_ioc["sensor_infor"]
-col_processor = db_sec["processor_alerts"]
+log = logging.getLogger("database.indexes")
+
+# ===== Durability profiles -> write concern =====
+# fast     : primary ack, không chờ journal (mất được vài trăm ms dữ liệu nếu mongod crash)
+# balanced : primary ack + journal
+# durable  : majority + journal (replica set; standalone = balanced)
+MONGO_WTIMEOUT_MS = int(os.getenv("MONGO_WTIMEOUT_MS", "5000"))
+DURABILITY_PROFILES = {
+    "fast": WriteConcern(w=1, j=False),
+    "balanced": WriteConcern(w=1, j=True),
+    "durable": WriteConcern(w="majority", j=True, wtimeout=MONGO_WTIMEOUT_MS),
+}
+# data class -> profile (env DURABILITY_<CLASS>)
+DURABILITY = {
+    "alerts": os.getenv("DURABILITY_ALERTS", "fast"),          # khối lượng lớn, chịu mất mát (có spool)
+    "heartbeat": os.getenv("DURABILITY_HEARTBEAT", "fast"),    # ghi đè liên tục, tạm thời
+    "misp": os.getenv("DURABILITY_MISP", "balanced"),          # pull lại được từ MISP
+    "jobs": os.getenv("DURABILITY_JOBS", "balanced"),          # retro-hunt, sync_state, tag_failures
+    "rules": os.getenv("DURABILITY_RULES", "durable"),         # rule_items / sets / counters (sid): không được mất
+}
+for _cls, _p in DURABILITY.items():
+    if _p not in DURABILITY_PROFILES:
+        raise ValueError(f"DURABILITY_{_cls.upper()}={_p!r}: must be one of {', '.join(DURABILITY_PROFILES)}")
+
+def write_concern_for(data_class: str) -> WriteConcern:
+    return DURABILITY_PROFILES[DURABILITY[data_class]]
+
+def _with_profile(col, data_class: str):
+    return col.with_options(write_concern=write_concern_for(data_class))
+
+col_iocs           = _with_profile(db_ioc["iocs"], "misp")
+col_events         = _with_profile(db_ioc["events"], "misp")
+col_rule_items     = _with_profile(db_ioc["rule_items"], "rules")
+col_rule_sets      = _with_profile(db_ioc["rule_sets"], "rules")
+col_rule_set_items = _with_profile(db_ioc["rule_set_items"], "rules")
+col_counters       = _with_profile(db_ioc["counters"], "rules")
+col_sensor_infor   = _with_profile(db_ioc["sensor_infor"], "rules")        # deploy state
+col_sensor_heartbeat = _with_profile(db_ioc["sensor_infor"], "heartbeat")  # cùng collection, heartbeat/status
+col_processor = _with_profile(db_sec["processor_alerts"], "alerts")
+col_sync_state     = _with_profile(db_ioc["sync_state"], "jobs")
+col_tag_failures   = _with_profile(db_ioc["tag_failures"], "jobs")
+col_ids_alerts     = _with_profile(db_sec["ids_alerts"], "alerts")
+col_alert_payloads = _with_profile(db_sec["alert_payloads"], "alerts")
+col_retro_hits     = _with_profile(db_ioc["retro_hits"], "jobs")
+col_retro_jobs     = _with_profile(db_ioc["retro_jobs"], "jobs")
+col_leases         = _with_profile(db_ioc["leases"], "jobs")
+
+# (collection, keys, options) — tạo từng index riêng trong ensure_indexes()
+_INDEXES = [
+    # MISP
+    (col_events, "uuid", {"unique": True}),
+    (col_events, [("published", ASCENDING), ("timestamp", DESCENDING)], {}),
+    (col_events, [("tags", ASCENDING)], {}),
+    (col_events, "event_id", {}),
+    (col_events, [("timestamp", DESCENDING), ("_id", DESCENDING)], {}),      # last_event_ts + keyset browse
+    (col_iocs, "uuid", {"unique": True}),
+    (col_iocs, [("type", ASCENDING), ("value", ASCENDING)], {}),
+    (col_iocs, "event_uuid", {}),
+    (col_iocs, [("to_ids", ASCENDING), ("timestamp", DESCENDING)], {}),
+    (col_iocs, "norm.host", {}),
+    (col_iocs, "norm.ip", {}),
+    (col_iocs, [("event_id", ASCENDING), ("tags", ASCENDING)], {}),         # build_rules_for_event
+    # browse /iocs: sort keyset (timestamp,_id) desc, kèm filter phổ biến làm tiền tố
+    (col_iocs, [("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    (col_iocs, [("type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    (col_iocs, [("norm.type_family", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    (col_iocs, "value", {}),                                                # value_prefix (regex neo ^)
+    (col_iocs, "source.pulled_at", {}),                                     # refresh tăng dần ioc_index
+    (col_iocs, "attr_id", {}),                                              # alert_enrichment (rule -> IOC)
+    (col_tag_failures, "tag", {}),
+    # rules
+    (col_rule_items, "rule_hash", {}),
+    (col_rule_items, "sid", {}),
+    (col_rule_items, [("doc_type", ASCENDING), ("sid", ASCENDING)], {}),
+    (col_rule_items, "metadata.attr_id", {}),
+    (col_rule_sets, "version", {"unique": True}),
+    (col_rule_set_items, "set_version", {}),
+    (col_rule_set_items, "sid", {}),
+    # sensors
+    (col_sensor_infor, "sensor_id", {"unique": True}),
+    # alerts + retro-hunt ($in theo ip trong cửa sổ ingest = _id)
+    (col_ids_alerts, [("src.ip", ASCENDING), ("_id", DESCENDING)], {}),
+    (col_ids_alerts, [("dst.ip", ASCENDING), ("_id", DESCENDING)], {}),
+    (col_ids_alerts, [("ts", DESCENDING)], {}),
+    (col_ids_alerts, "payload.sha256", {"sparse": True}),                   # payload -> các alert dùng nó
+    (col_retro_hits, [("event_id", ASCENDING), ("alert_ts", DESCENDING)], {}),
+    (col_retro_hits, "job_id", {}),
+    (col_retro_jobs, [("status", ASCENDING), ("lease_until", ASCENDING)], {}),
+]
+
+def ensure_indexes() -> List[Dict[str, Any]]:
+    """
+    Tạo index cho mọi collection — gọi 1 lần lúc app khởi động (lifespan),
+    không chạy lại ở mỗi request. create_index là idempotent.
+    Mỗi index tạo riêng: index lỗi (vd. unique trên dữ liệu đang trùng, trùng tên khác option) được log
+    và trả về [{collection, keys, error}], các index sau vẫn được tạo. Mất kết nối -> raise (dừng luôn).
+    """
+    failed = []
+    for col, keys, opts in _INDEXES:
+        try:
+            col.create_index(keys, **opts)
+        except ConnectionFailure:
+            raise
+        except PyMongoError as e:
+            failed.append({"collection": col.name, "keys": keys, "error": str(e)})
+            log.warning("indexes:create.failed col=%s keys=%s err=%s", col.name, keys, e)
+    return failed
 
 def next_sid() -> int:
     # First, try to increment if document exists
@@ -37,6 +141,46 @@ def next_sid() -> int:
         return_document=ReturnDocument.AFTER,
     )
     return int(doc["value"])
+
+def next_sids(n: int) -> list:
+    """Cấp 1 block n sid liên tiếp bằng 1 lệnh $inc (thay vì n lần next_sid())."""
+    if n <= 0:
+        return []
+    doc = col_counters.find_one_and_update(
+        {"_id": "sid"},
+        {"$inc": {"value": n}},
+        upsert=False,
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        # counter chưa có -> khởi tạo giống next_sid()
+        return [next_sid()] + next_sids(n - 1)
+    last = int(doc["value"])
+    return list(range(last - n + 1, last + 1))
+
+# ===== Lease: job định kỳ chỉ chạy ở 1 worker / host tại 1 thời điểm =====
+def lease_owner() -> str:
+    # tính lúc gọi (không lúc import): worker fork từ cùng master vẫn khác pid
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def acquire_lease(name: str, ttl_sec: int, owner: str | None = None) -> bool:
+    """Giữ lease `name` trong ttl_sec; gọi lại khi đang giữ -> gia hạn. False nếu owner khác đang giữ."""
+    now = datetime.now(timezone.utc)
+    owner = owner or lease_owner()
+    try:
+        col_leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_sec), "renewed_at": now}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # doc đã có nhưng không khớp filter (owner khác, chưa hết hạn) -> upsert đụng _id
+        return False
+
+def release_lease(name: str, owner: str | None = None) -> None:
+    col_leases.delete_one({"_id": name, "owner": owner or lease_owner()})
+
 def seed_sid_counter(default_start=3_000_000) -> int:
     # lấy sid lớn nhất hiện có (an toàn khi collection rỗng)
     max_doc = col_rule_items.find_one(
@@ -59,5 +203,9 @@ def seed_sid_counter(default_start=3_000_000) -> int:
 # tiện cho các module khác import *
 __all__ = [
     "col_iocs","col_events","col_rule_items","col_rule_sets",
-    "col_rule_set_items","col_counters","next_sid", "col_sensor_infor", "col_processor"
+    "col_rule_set_items","col_counters","next_sid", "next_sids", "col_sensor_infor", "col_sensor_heartbeat",
+    "col_processor",
+    "col_sync_state", "col_tag_failures", "col_ids_alerts", "col_alert_payloads", "col_retro_hits", "col_retro_jobs", "ensure_indexes",
+    "col_leases", "acquire_lease", "release_lease",
+    "DURABILITY", "DURABILITY_PROFILES", "write_concern_for"
 ]
\ No newline at end of file
@@ -1,14 +1,32 @@
 from pymongo import MongoClient, ASCENDING, TEXT
 import os, dotenv
 
+from app.services.metrics import mongo_listeners
+
 # MongoDB connection with authentication
 dotenv.load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-_client = MongoClient(MONGO_URI)
+
+# Connection pool (env trống -> mặc định của pymongo)
+_POOL_ENV = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+}
+POOL_OPTIONS = {k: int(os.environ[e]) for k, e in _POOL_ENV.items() if os.getenv(e)}
+if os.getenv("MONGO_APPNAME"):
+    POOL_OPTIONS["appname"] = os.environ["MONGO_APPNAME"]
+
+# listener metric (command / pool) -> /metrics; METRICS_ENABLED=false -> không gắn
+_client = MongoClient(MONGO_URI, event_listeners=mongo_listeners(), **POOL_OPTIONS)
 # Expose DB handles (dùng chung toàn app)
-db_ioc = _client["misp_ioc"] 
-db_sec = _client["sec_events"]
+# tên DB đổi được qua env (benchmark / môi trường test dùng DB riêng)
+db_ioc = _client[os.getenv("MONGO_DB_IOC", "misp_ioc")]
+db_sec = _client[os.getenv("MONGO_DB_SEC", "sec_events")]
 
 def ping() -> bool:
     _client.admin.command("ping")
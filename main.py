@@ -2,20 +2,152 @@ from fastapi import FastAPI, Request
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi.templating import Jinja2Templates
 from app.database.mongo import db_sec, db_ioc
-from app.database.collections import seed_sid_counter
+from app.database.collections import seed_sid_counter, ensure_indexes, acquire_lease, release_lease
 from fastapi.staticfiles import StaticFiles
 from fastapi import Request, Response
 from datetime import datetime, timezone
-from app.api import alerts, health, misp, rules, sensors
-app = FastAPI()
+from contextlib import asynccontextmanager
+from pymongo.errors import PyMongoError
+from app.api import alerts, health, metrics, misp, profiling, rules, sensors
+from app.services.metrics import MetricsMiddleware, METRICS_ENABLED
+from app.services.profiling import ProfilingMiddleware, PROFILING_ENABLED
+from app.services.rule_build_queue import shutdown_build_queue
+from app.services.retro_hunt import resume_pending as resume_retro_hunts, shutdown_retro_hunt
+from app.services.misp_service import get_misp_service, MISP_SYNC_INTERVAL_MIN
+from app.services.misp_stats import reconcile as reconcile_stats, STATS_RECONCILE_MIN
+from app.services.ioc_index import get_ioc_index, refresh_ioc_index, IOC_INDEX_ENABLED, IOC_INDEX_REBUILD_MIN
+from app.services.alert_enrichment import warm as warm_enrichment
+from app.services.alert_spool import start_spool, shutdown_spool
+from app.services.alert_archive import archive as archive_alerts, ARCHIVE_AVAILABLE, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL_MIN
+import logging, os
+
+log = logging.getLogger("console.app")
+scheduler = AsyncIOScheduler(timezone="UTC")
+
+# job định kỳ chạy trên mọi worker -> lease Mongo để chỉ 1 worker chạy / lượt (release khi xong;
+# TTL chỉ để worker chết giữa chừng không giữ lease mãi -> đặt > thời gian chạy dài nhất của job)
+SCHEDULER_LEASE_SEC = int(os.getenv("SCHEDULER_LEASE_SEC", "3600"))
+
+
+def _leased(name: str, fn) -> bool:
+    """Chạy fn() nếu giành được lease `name`; worker khác đang giữ -> bỏ lượt này."""
+    if not acquire_lease(name, SCHEDULER_LEASE_SEC):
+        log.debug("scheduler:skip job=%s (lease held by another worker)", name)
+        return False
+    try:
+        fn()
+    finally:
+        release_lease(name)
+    return True
+
+
+def _misp_sync_job():
+    # AsyncIOScheduler chạy job sync (không phải coroutine) trên thread pool -> không block event loop
+    try:
+        if not _leased("misp-sync", lambda: get_misp_service().sync(request_id="scheduler")):
+            refresh_ioc_index()     # worker khác sync -> chỉ nạp IOC mới vào index RAM của worker này
+    except Exception as e:
+        logging.getLogger("misp.service").warning("sync:scheduled.failed err=%s", e)
+
+
+def _stats_reconcile_job():
+    # sửa drift của bộ đếm dashboard (doc counters "misp_stats")
+    try:
+        _leased("stats-reconcile", reconcile_stats)
+    except Exception as e:
+        logging.getLogger("misp.stats").warning("stats:reconcile.failed err=%s", e)
+
+
+def _enrich_warm_job():
+    # nạp sẵn cache sid -> event/IOC cho ingest alert (không chặn startup)
+    try:
+        warm_enrichment()
+    except Exception as e:
+        logging.getLogger("alerts.enrich").warning("enrich:warm.failed err=%s", e)
+
+
+def _alert_archive_job():
+    # alert cũ hơn ARCHIVE_AFTER_DAYS -> Parquet (cold), xoá khỏi ids_alerts
+    try:
+        archive_alerts()
+    except Exception as e:
+        logging.getLogger("alerts.archive").warning("archive:failed err=%s", e)
+
+
+def _ioc_index_rebuild_job():
+    # rebuild đầy đủ định kỳ: gỡ IOC đã xoá / đổi value mà refresh tăng dần không thấy
+    try:
+        get_ioc_index().rebuild()
+    except Exception as e:
+        logging.getLogger("misp.ioc_index").warning("ioc_index:rebuild.failed err=%s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # --- startup: index 1 lần cho mọi collection, service dùng chung, scheduler ---
+    try:
+        failed = ensure_indexes()       # index lỗi đã log từng cái; các index còn lại vẫn được tạo
+        if failed:
+            log.warning("startup:ensure_indexes failed=%d: %s", len(failed),
+                        ", ".join(f"{f['collection']}.{f['keys']}" for f in failed))
+    except PyMongoError as e:
+        log.warning("startup:ensure_indexes.failed err=%s", e)
+    app.state.misp_svc = get_misp_service()
+    start_spool()                   # spool alert local + replayer (drain phần còn lại từ lần chạy trước)
+    try:
+        resume_retro_hunts()        # job retro-hunt bị ngắt lần chạy trước -> chạy tiếp từ batch đã lưu
+    except PyMongoError as e:
+        log.warning("startup:retro_hunt.resume.failed err=%s", e)
+    if MISP_SYNC_INTERVAL_MIN > 0:
+        scheduler.add_job(
+            _misp_sync_job, "interval", minutes=MISP_SYNC_INTERVAL_MIN,
+            id="misp-sync", max_instances=1, coalesce=True, replace_existing=True,
+        )
+    if STATS_RECONCILE_MIN > 0:
+        scheduler.add_job(
+            _stats_reconcile_job, "interval", minutes=STATS_RECONCILE_MIN,
+            id="stats-reconcile", max_instances=1, coalesce=True, replace_existing=True,
+        )
+    scheduler.add_job(_enrich_warm_job, id="enrich-warm", replace_existing=True)
+    if ARCHIVE_AVAILABLE and ARCHIVE_AFTER_DAYS > 0 and ARCHIVE_INTERVAL_MIN > 0:
+        scheduler.add_job(
+            _alert_archive_job, "interval", minutes=ARCHIVE_INTERVAL_MIN,
+            id="alert-archive", max_instances=1, coalesce=True, replace_existing=True,
+        )
+    if IOC_INDEX_ENABLED:
+        # dựng lần đầu ngay khi scheduler chạy (không chặn startup), sau đó định kỳ
+        scheduler.add_job(_ioc_index_rebuild_job, id="ioc-index-initial", replace_existing=True)
+        if IOC_INDEX_REBUILD_MIN > 0:
+            scheduler.add_job(
+                _ioc_index_rebuild_job, "interval", minutes=IOC_INDEX_REBUILD_MIN,
+                id="ioc-index-rebuild", max_instances=1, coalesce=True, replace_existing=True,
+            )
+    scheduler.start()
+    yield
+    # --- shutdown ---
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    shutdown_build_queue()
+    shutdown_retro_hunt()
+    shutdown_spool()
+
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="./app/templates")
 app.mount("/static", StaticFiles(directory="./app/static"), name="static")
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)      # latency theo router / route -> /metrics
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)    # profile request tới path admin đã arm (/api/v1/profile)
 
 app.include_router(sensors.router)
 app.include_router(rules.router)
 app.include_router(alerts.router)
 app.include_router(health.router)
 app.include_router(misp.router)
+app.include_router(metrics.router)
+if PROFILING_ENABLED:
+    app.include_router(profiling.router)
 
 @app.post("/admin/seed-sid")
 def admin_seed_sid():
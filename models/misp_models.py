@@ -48,3 +48,9 @@ class IocOut(BaseModel):
     timestamp: datetime
     tags: List[str] = Field(default_factory=list)
     norm: dict
+
+class IocLookupRequest(BaseModel):
+    values: List[str] = Field(..., min_length=1)   # IP / domain / hash / url ...
+    cidr: bool = True                              # IP khớp IOC dạng CIDR
+    parents: bool = True                           # a.b.evil.com khớp IOC evil.com
+    to_ids_only: bool = False
@@ -3,6 +3,13 @@ from pydantic import BaseModel, Field
 from datetime import datetime
 
 # ===== Mongo docs =====
+class SuppressPolicy(BaseModel):
+    """Chống bão alert lúc ingest cho 1 sid (xem services/alert_suppression)."""
+    mode: Literal["off", "suppress", "aggregate", "threshold"] = "aggregate"
+    window: int = Field(60, ge=1, le=86400)       # giây
+    count: int = Field(1, ge=1)                   # threshold: lưu alert khi đủ count lần trong window
+    track: Literal["by_flow", "by_src", "by_dst", "by_rule"] = "by_flow"
+
 class RuleItem(BaseModel):
     doc_type: Literal["item"] = "item"
     gid: int = 1
@@ -18,11 +25,16 @@ class RuleItem(BaseModel):
     dst_sel: str
     buffers: List[Dict[str, Any]] = Field(default_factory=list)
     keywords: List[str] = Field(default_factory=list)
+    options: List[Dict[str, Any]] = Field(default_factory=list)    # IR: [{name, arg}] theo thứ tự
+    contents: List[Dict[str, Any]] = Field(default_factory=list)   # IR: [{value, buffer, negated, modifiers, fast_pattern}]
     flow: Dict[str, Any] = Field(default_factory=dict)
     flowbits: Dict[str, Any] = Field(default_factory=dict)
     references: List[Dict[str, str]] = Field(default_factory=list)
     metadata: Dict[str, Any] = Field(default_factory=dict)
     mitre: List[Dict[str, Any]] = Field(default_factory=list)
+    cost: Dict[str, Any] = Field(default_factory=dict)        # kết quả rule_linter.lint_rule
+    status: Literal["active","quarantined"] = "active"
+    suppress: Optional[SuppressPolicy] = None
 
 class RuleSet(BaseModel):
     name: str                      # ví dụ: f"misp-event-{event_id}"
@@ -33,6 +45,8 @@ class RuleSet(BaseModel):
     item_count: int
     status: Literal["draft","ready","disabled"] = "draft"
     notes: Optional[str] = None
+    cost_total: int = 0
+    cost_max: int = 0
 
 class RuleSetItem(BaseModel):
     set_id: str      # ObjectId as str (của rule_sets)
@@ -47,4 +61,17 @@ class RuleSetBuildResponse(BaseModel):
     sha256: str
     item_count: int
     status: str
-    active: bool
\ No newline at end of file
+    active: bool
+    cost_total: int = 0
+    cost_max: int = 0
+    cost_over_budget: int = 0
+class RuleSetBuildJob(BaseModel):
+    """Job build trong hàng đợi (services/rule_build_queue); result = RuleSetBuildResponse khi done."""
+    job_id: str
+    version: str
+    status: Literal["queued", "running", "done", "failed"]
+    submitted_at: str
+    finished_at: Optional[str] = None
+    result: Optional[RuleSetBuildResponse] = None
+    error: Optional[str] = None
+    deduplicated: Optional[bool] = None      # chỉ có ở response submit: version đang có job -> trả job cũ
@@ -0,0 +1,265 @@
+"""
+Cold archive: alert cũ hơn ARCHIVE_AFTER_DAYS ngày chuyển từ ids_alerts sang file Parquet nén (zstd)
+chia theo ngày + sensor, rồi xoá khỏi Mongo.
+
+  ARCHIVE_DIR/day=YYYY-MM-DD/sensor=<id>/part-<oid>.parquet
+  ARCHIVE_DIR/manifest.json   : [{path, day, sensor_id, rows, ts_min, ts_max, bytes, created_at}]
+
+- chọn alert theo _id (ObjectId gán lúc ingest) < now - days: `ts` do sensor gửi, không tin được là ISO
+- mỗi vòng: đọc ARCHIVE_BATCH alert cũ nhất (index _id) -> ghi segment theo (day, sensor), sort theo ts,
+  row group ARCHIVE_ROW_GROUP dòng (min/max ts, ip... trong footer) -> ghi manifest (tmp + replace) -> delete_many
+- query_archive(): chọn segment qua manifest (day / sensor / ts_min..ts_max), đọc bằng pyarrow.dataset
+  (mmap, chỉ cột cần, filter đẩy xuống row group theo ts, sensor_id, rule_id, src_ip/dst_ip)
+
+pyarrow là dependency tuỳ chọn (requirements-optional.txt): chỉ import khi archive / query; thiếu -> ArchiveUnavailable.
+Nhiều worker / host: lease Mongo "alert-archive" (gia hạn mỗi batch) -> chỉ 1 nơi archive + ghi manifest.
+Nếu process chết giữa lúc ghi manifest và delete_many, batch đó có thể bị archive 2 lần ở vòng sau.
+"""
+import os, json, threading, time, logging
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional
+from importlib.util import find_spec
+
+from bson import ObjectId
+
+from app.database.collections import col_ids_alerts, acquire_lease, release_lease
+
+log = logging.getLogger("alerts.archive")
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "./data/archive"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))          # 0 = tắt job định kỳ
+ARCHIVE_INTERVAL_MIN = int(os.getenv("ARCHIVE_INTERVAL_MIN", "360"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "50000"))                 # alert / vòng đọc Mongo
+ARCHIVE_ROW_GROUP = int(os.getenv("ARCHIVE_ROW_GROUP", "10000"))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+ARCHIVE_LEASE_SEC = int(os.getenv("ARCHIVE_LEASE_SEC", "900"))           # > thời gian 1 batch
+ARCHIVE_AVAILABLE = find_spec("pyarrow") is not None
+_LEASE = "alert-archive"
+
+# cột cố định (giá trị lồng / ít gặp -> cột extra dạng JSON)
+_STR_COLS = ("_id", "day", "sensor_id", "rule_id", "classification", "action", "msg", "proto", "dir",
+             "src_ip", "dst_ip", "mitre", "payload_sha256", "b64_data", "extra")
+_INT_COLS = ("gid", "sid", "rev", "priority", "src_port", "dst_port", "count", "misp_event_id")
+_TS_COLS = ("ts", "first_seen", "last_seen")
+COLUMNS = _STR_COLS + _INT_COLS + _TS_COLS
+_KNOWN = {"_id", "ts", "sensor_id", "rule_id", "gid", "sid", "rev", "priority", "classification", "action",
+          "msg", "proto", "dir", "src", "dst", "count", "first_seen", "last_seen", "mitre", "payload",
+          "b64_data", "misp"}
+
+_lock = threading.Lock()      # 1 lượt archive / process; manifest ghi tuần tự
+
+
+class ArchiveUnavailable(RuntimeError):
+    pass
+
+
+def _pa():
+    if not ARCHIVE_AVAILABLE:
+        raise ArchiveUnavailable("pyarrow is not installed (pip install pyarrow)")
+    import pyarrow, pyarrow.parquet, pyarrow.dataset, pyarrow.compute, pyarrow.fs
+    return pyarrow
+
+
+def alert_id_range(since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Điều kiện _id cho khoảng [since, until) theo thời điểm ingest (archive / export / retro-hunt).
+    ids_alerts.ts là chuỗi sensor gửi (Snort 'MM/DD-...' hoặc ISO) -> không so sánh khoảng được.
+    """
+    cond: Dict[str, Any] = {}
+    if since:
+        cond["$gte"] = ObjectId.from_datetime(since)
+    if until:
+        cond["$lt"] = ObjectId.from_datetime(until)
+    return cond
+
+
+def _ts(v: Any) -> Optional[datetime]:
+    if isinstance(v, datetime):
+        return v.astimezone(timezone.utc).replace(tzinfo=None) if v.tzinfo else v
+    if not isinstance(v, str) or not v:
+        return None
+    try:
+        dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt.tzinfo else dt
+
+
+def _int(v: Any) -> Optional[int]:
+    try:
+        return int(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def alert_row(a: Dict[str, Any]) -> Dict[str, Any]:
+    src, dst = a.get("src") or {}, a.get("dst") or {}
+    ts = _ts(a.get("ts")) or _ts(a.get("ingested_at"))
+    extra = {k: v for k, v in a.items() if k not in _KNOWN}
+    if a.get("misp"):
+        extra["misp"] = a["misp"]
+    return {
+        "_id": str(a["_id"]), "ts": ts, "day": ts.strftime("%Y-%m-%d") if ts else "unknown",
+        "sensor_id": a.get("sensor_id"), "rule_id": a.get("rule_id"),
+        "gid": _int(a.get("gid")), "sid": _int(a.get("sid")), "rev": _int(a.get("rev")),
+        "priority": _int(a.get("priority")), "classification": a.get("classification"),
+        "action": a.get("action"), "msg": a.get("msg"), "proto": a.get("proto"), "dir": a.get("dir"),
+        "src_ip": src.get("ip"), "src_port": _int(src.get("port")),
+        "dst_ip": dst.get("ip"), "dst_port": _int(dst.get("port")),
+        "count": _int(a.get("count")), "first_seen": _ts(a.get("first_seen")), "last_seen": _ts(a.get("last_seen")),
+        "misp_event_id": _int((a.get("misp") or {}).get("event_id")),
+        "mitre": a.get("mitre") if isinstance(a.get("mitre"), str) else None,
+        "payload_sha256": (a.get("payload") or {}).get("sha256"),
+        "b64_data": a.get("b64_data") if isinstance(a.get("b64_data"), str) else None,
+        "extra": json.dumps(extra, default=str, separators=(",", ":")) if extra else None,
+    }
+
+
+def alert_schema(pa, columns: Optional[List[str]] = None):
+    """Schema cột phẳng của alert (archive / export); columns -> chỉ các cột đó theo thứ tự."""
+    types = {**{c: pa.string() for c in _STR_COLS}, **{c: pa.int64() for c in _INT_COLS},
+             **{c: pa.timestamp("us") for c in _TS_COLS}}
+    return pa.schema([(c, types[c]) for c in (columns or COLUMNS)])
+
+
+# ---- manifest
+def _manifest_path() -> Path:
+    return ARCHIVE_DIR / "manifest.json"
+
+def load_manifest() -> List[Dict[str, Any]]:
+    p = _manifest_path()
+    if not p.exists():
+        return []
+    with open(p, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_manifest(segments: List[Dict[str, Any]]) -> None:
+    p = _manifest_path()
+    tmp = p.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(segments, f, separators=(",", ":"))
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, p)
+
+
+# ---- ghi
+def _write_segment(pa, rows: List[Dict[str, Any]], day: str, sensor: str) -> Dict[str, Any]:
+    rows.sort(key=lambda r: (r["ts"] is None, r["ts"] or datetime.min))
+    table = pa.Table.from_pylist(rows, schema=alert_schema(pa))
+    rel = Path(f"day={day}") / f"sensor={sensor}" / f"part-{ObjectId()}.parquet"
+    path = ARCHIVE_DIR / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pa.parquet.write_table(table, path, compression=ARCHIVE_COMPRESSION, row_group_size=ARCHIVE_ROW_GROUP)
+    tss = [r["ts"] for r in rows if r["ts"]]
+    return {
+        "path": str(rel), "day": day, "sensor_id": sensor, "rows": len(rows),
+        "ts_min": min(tss).isoformat() if tss else None, "ts_max": max(tss).isoformat() if tss else None,
+        "bytes": path.stat().st_size, "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def archive(days: Optional[int] = None, max_batches: Optional[int] = None) -> Dict[str, Any]:
+    """Chuyển alert ingest trước now - days sang Parquet; trả {alerts, segments, bytes, duration_ms}."""
+    pa = _pa()
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    q = {"_id": alert_id_range(until=cutoff)}
+    t0 = time.perf_counter()
+    moved = written = nbytes = batches = 0
+    skipped = None
+    with _lock:
+        if not acquire_lease(_LEASE, ARCHIVE_LEASE_SEC):
+            skipped = "lease held by another worker"
+        else:
+            try:
+                segments = load_manifest()      # đọc sau khi giữ lease -> thấy segment worker trước đã ghi
+                while max_batches is None or batches < max_batches:
+                    # gia hạn mỗi batch; mất lease (batch chạy quá ARCHIVE_LEASE_SEC) -> dừng
+                    if batches and not acquire_lease(_LEASE, ARCHIVE_LEASE_SEC):
+                        skipped = "lease lost"
+                        break
+                    docs = list(col_ids_alerts.find(q).sort("_id", 1).limit(ARCHIVE_BATCH))
+                    if not docs:
+                        break
+                    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+                    for a in docs:
+                        r = alert_row(a)
+                        groups.setdefault((r["day"], str(r["sensor_id"] or "unknown")), []).append(r)
+                    new = [_write_segment(pa, rows, day, sensor) for (day, sensor), rows in sorted(groups.items())]
+                    segments.extend(new)
+                    _save_manifest(segments)
+                    # chỉ xoá sau khi file + manifest đã ghi xong
+                    col_ids_alerts.delete_many({"_id": {"$in": [a["_id"] for a in docs]}})
+                    moved += len(docs); written += len(new); nbytes += sum(s["bytes"] for s in new)
+                    batches += 1
+            finally:
+                release_lease(_LEASE)
+    ms = int((time.perf_counter() - t0) * 1000)
+    if moved:
+        log.info("archive:done alerts=%d segments=%d bytes=%d ms=%d", moved, written, nbytes, ms)
+    if skipped:
+        log.info("archive:skip reason=%s", skipped)
+    return {"alerts": moved, "segments": written, "bytes": nbytes, "cutoff": cutoff.isoformat(),
+            "duration_ms": ms, **({"skipped": skipped} if skipped else {})}
+
+
+# ---- đọc
+def _select(segments: List[Dict[str, Any]], since: Optional[datetime], until: Optional[datetime],
+            sensor_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Lọc segment theo manifest (không mở file)."""
+    out = []
+    s_iso = since.isoformat() if since else None
+    u_iso = until.isoformat() if until else None
+    for s in segments:
+        if sensor_id and s["sensor_id"] != sensor_id:
+            continue
+        if s_iso and s["ts_max"] and s["ts_max"] < s_iso:
+            continue
+        if u_iso and s["ts_min"] and s["ts_min"] >= u_iso:
+            continue
+        out.append(s)
+    return out
+
+
+def query_archive(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  sensor_id: Optional[str] = None, rule_id: Optional[str] = None, ip: Optional[str] = None,
+                  columns: Optional[List[str]] = None, limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Yield alert (dict theo cột) từ segment Parquet; filter đẩy xuống row group."""
+    pa = _pa()
+    ds, pc = pa.dataset, pa.compute
+    since, until = _ts(since), _ts(until)
+    bad = [c for c in columns or [] if c not in COLUMNS]
+    if bad:
+        raise ValueError(f"invalid column: {bad[0]}")
+    segs = _select(load_manifest(), since, until, sensor_id)
+    if not segs:
+        return
+    expr = None
+    def _and(e):
+        nonlocal expr
+        expr = e if expr is None else expr & e
+    if since: _and(pc.field("ts") >= pa.scalar(since, pa.timestamp("us")))
+    if until: _and(pc.field("ts") < pa.scalar(until, pa.timestamp("us")))
+    if sensor_id: _and(pc.field("sensor_id") == sensor_id)
+    if rule_id: _and(pc.field("rule_id") == rule_id)
+    if ip: _and((pc.field("src_ip") == ip) | (pc.field("dst_ip") == ip))
+
+    dataset = ds.dataset([str(ARCHIVE_DIR / s["path"]) for s in segs], schema=alert_schema(pa), format="parquet",
+                         filesystem=pa.fs.LocalFileSystem(use_mmap=True))
+    n = 0
+    for batch in dataset.to_batches(columns=columns or None, filter=expr):
+        for row in batch.to_pylist():
+            yield row
+            n += 1
+            if limit and n >= limit:
+                return
+
+
+def archive_status() -> Dict[str, Any]:
+    segs = load_manifest() if ARCHIVE_DIR.exists() else []
+    return {
+        "available": ARCHIVE_AVAILABLE, "dir": str(ARCHIVE_DIR), "after_days": ARCHIVE_AFTER_DAYS,
+        "segments": len(segs), "rows": sum(s["rows"] for s in segs), "bytes": sum(s["bytes"] for s in segs),
+        "day_min": min((s["day"] for s in segs), default=None), "day_max": max((s["day"] for s in segs), default=None),
+    }
@@ -0,0 +1,267 @@
+"""
+Làm giàu alert lúc ingest: rule_id "gid:sid:rev" -> rule_items (metadata.event_id / attr_id / members)
+-> IOC + event MISP (info, MITRE từ galaxies / tags).
+
+- 2 LRU có giới hạn trong process: sid -> enrichment rule, event_id -> enrichment event
+  (cache cả "không tìm thấy" -> sid ngoài dải console không query lại mỗi alert)
+- enrich_many(): gom sid/event chưa có trong cache của cả batch -> tối đa 3 query $in / batch,
+  batch toàn cache hit thì không đụng Mongo
+- warm(): nạp sẵn ALERT_ENRICH_WARM rule mới nhất lúc khởi động
+- invalidate(): gọi sau khi convert (rules_service) -> sid mới / negative cache cũ bị bỏ
+- query cache miss trên đường ingest: trong ngân sách SPOOL_LATENCY_BUDGET_MS (pymongo.timeout);
+  spool đang degraded (Mongo lỗi / chậm) -> bỏ qua, alert đi tiếp không làm giàu (không cache "không tìm thấy")
+
+Rule nhóm IP (metadata.members): chọn member có ip trùng src.ip / dst.ip của alert.
+"""
+import os, re, threading, logging
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import pymongo
+
+from app.database.collections import col_rule_items, col_events, col_iocs
+
+log = logging.getLogger("alerts.enrich")
+
+ALERT_ENRICH_ENABLED = os.getenv("ALERT_ENRICH_ENABLED", "true").lower() == "true"
+ALERT_ENRICH_CACHE = int(os.getenv("ALERT_ENRICH_CACHE", "50000"))     # số entry tối đa / LRU
+ALERT_ENRICH_WARM = int(os.getenv("ALERT_ENRICH_WARM", "10000"))       # rule mới nhất nạp lúc startup
+
+_MISS = object()                                  # sentinel: chưa có trong cache (khác None = không tìm thấy)
+_TECH_RE = re.compile(r"\b(T\d{4}(?:\.\d{3})?)\b")
+_RULE_PROJ = {"_id": 0, "sid": 1, "gid": 1, "current_rev": 1, "msg": 1, "metadata": 1, "suppress": 1}
+_EVENT_PROJ = {"_id": 0, "event_id": 1, "uuid": 1, "info": 1, "tags": 1,
+               "galaxies.galaxy_type": 1, "galaxies.cluster_value": 1, "galaxies.tag": 1}
+_IOC_PROJ = {"_id": 0, "attr_id": 1, "uuid": 1, "type": 1, "value": 1, "tags": 1}
+
+
+class _LRU:
+    """OrderedDict có giới hạn; get() đẩy entry lên cuối, set() bỏ entry cũ nhất khi đầy."""
+    def __init__(self, size: int):
+        self.size = max(size, 1)
+        self.data: "OrderedDict[Any, Any]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            v = self.data.get(key, _MISS)
+            if v is _MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.data.move_to_end(key)
+            return v
+
+    def peek(self, key):
+        # đọc không tính hit/miss (ngay sau khi vừa nạp)
+        with self.lock:
+            v = self.data.get(key)
+            return None if v is _MISS else v
+
+    def set(self, key, value) -> None:
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+    def status(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self.data), "max": self.size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None}
+
+
+_rules = _LRU(ALERT_ENRICH_CACHE)
+_events = _LRU(ALERT_ENRICH_CACHE)
+
+
+def parse_rule_id(rule_id: Any) -> Optional[Tuple[int, int, int]]:
+    """"1:3000123:1" -> (gid, sid, rev); "3000123" -> (1, 3000123, 0); sai định dạng -> None."""
+    if rule_id is None:
+        return None
+    parts = str(rule_id).strip().split(":")
+    try:
+        if len(parts) == 3:
+            return int(parts[0]), int(parts[1]), int(parts[2])
+        if len(parts) == 1 and parts[0]:
+            return 1, int(parts[0]), 0
+    except ValueError:
+        pass
+    return None
+
+
+def _mitre(tags: Iterable[str], galaxies: Iterable[dict] = ()) -> List[str]:
+    """Technique ID (T1059, T1566.001) từ galaxy mitre-* và tag misp-galaxy:mitre-* / mitre-attack:*."""
+    out: List[str] = []
+    texts = [g.get("cluster_value") or g.get("tag") or "" for g in galaxies
+             if str(g.get("galaxy_type") or "").startswith("mitre-")]
+    texts += [t for t in tags if "mitre" in t.lower()]
+    for s in texts:
+        for t in _TECH_RE.findall(s):
+            if t not in out:
+                out.append(t)
+    return out
+
+
+# ---- nạp cache
+def _rule_entry(doc: dict) -> dict:
+    meta = doc.get("metadata") or {}
+    members = meta.get("members") or []
+    return {
+        "event_id": meta.get("event_id"), "attr_id": meta.get("attr_id"), "ioc_type": meta.get("ioc_type"),
+        "suppress": doc.get("suppress"),          # policy chống bão alert (alert_suppression)
+        # rule nhóm IP: ip -> member đầu tiên (đủ để trỏ về 1 event / attribute)
+        "members": {m["ip"]: {"event_id": m.get("event_id"), "attr_id": m.get("attr_id"),
+                              "ioc_uuid": m.get("uuid")} for m in reversed(members) if m.get("ip")},
+    }
+
+def _load_rules(sids: List[int]) -> None:
+    found = set()
+    attr_ids = set()
+    entries = {}
+    for doc in col_rule_items.find({"sid": {"$in": sids}}, _RULE_PROJ):
+        e = _rule_entry(doc)
+        entries[doc["sid"]] = e
+        if e["attr_id"] is not None:
+            attr_ids.add(e["attr_id"])
+    # IOC của rule đơn: lấy value/type 1 lần cho cả batch
+    iocs = {d["attr_id"]: d for d in col_iocs.find({"attr_id": {"$in": list(attr_ids)}}, _IOC_PROJ)} if attr_ids else {}
+    for sid, e in entries.items():
+        d = iocs.get(e["attr_id"]) or {}
+        e.update(ioc_uuid=d.get("uuid"), ioc_value=d.get("value"), ioc_type=d.get("type") or e["ioc_type"],
+                 ioc_mitre=_mitre(d.get("tags") or []))
+        _rules.set(sid, e)
+        found.add(sid)
+    for sid in set(sids) - found:
+        _rules.set(sid, None)
+
+def _load_events(event_ids: List[int]) -> None:
+    found = set()
+    for doc in col_events.find({"event_id": {"$in": event_ids}}, _EVENT_PROJ):
+        _events.set(doc["event_id"], {
+            "event_uuid": doc.get("uuid"), "event_info": doc.get("info"),
+            "mitre": _mitre(doc.get("tags") or [], doc.get("galaxies") or []),
+        })
+        found.add(doc["event_id"])
+    for eid in set(event_ids) - found:
+        _events.set(eid, None)
+
+
+def _mongo_degraded() -> bool:
+    # import muộn: alert_spool -> alert_suppression -> alert_enrichment
+    from app.services.alert_spool import get_spool
+    sp = get_spool()
+    return bool(sp and sp.degraded)
+
+
+def _link(rule: dict, a: dict) -> dict:
+    """(event_id, attr_id, ioc_*) cho alert; rule nhóm IP -> member khớp src/dst ip."""
+    if rule["members"]:
+        for side in ("src", "dst"):
+            ip = (a.get(side) or {}).get("ip")
+            if ip in rule["members"]:
+                return {**rule["members"][ip], "ioc_type": rule["ioc_type"], "ioc_value": ip}
+    return rule
+
+
+def enrich_many(alerts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gắn gid/sid/rev + a["misp"] = {event_id, event_uuid, attr_id, ioc_*, event_info, mitre} (in-place)."""
+    if not ALERT_ENRICH_ENABLED or not alerts:
+        return alerts
+    rules: List[Any] = []
+    for a in alerts:
+        p = parse_rule_id(a.get("rule_id"))
+        if p:
+            a["gid"], a["sid"], a["rev"] = p
+        rules.append(_rules.get(p[1]) if p else None)
+    try:
+        from app.services.alert_spool import SPOOL_LATENCY_BUDGET_MS
+        load = not _mongo_degraded()
+        with pymongo.timeout(SPOOL_LATENCY_BUDGET_MS / 1000):
+            missing = {a["sid"] for a, r in zip(alerts, rules) if r is _MISS}
+            if missing:
+                if load:
+                    _load_rules(list(missing))
+                rules = [_rules.peek(a["sid"]) if r is _MISS else r for a, r in zip(alerts, rules)]
+            links = [_link(r, a) if r else None for a, r in zip(alerts, rules)]
+            events = {}
+            for link in links:
+                eid = link.get("event_id") if link else None
+                if eid is not None and eid not in events:
+                    events[eid] = _events.get(eid)
+            ev_missing = [eid for eid, ev in events.items() if ev is _MISS]
+            if ev_missing:
+                if load:
+                    _load_events(ev_missing)
+                events.update({eid: _events.peek(eid) for eid in ev_missing})
+    except Exception as e:
+        # enrichment không được làm mất alert -> insert bản chưa làm giàu
+        log.warning("enrich:failed err=%s", e)
+        return alerts
+
+    for a, rule, link in zip(alerts, rules, links):
+        if not link:
+            continue
+        ev = events.get(link.get("event_id")) or {}
+        mitre = list(ev.get("mitre") or [])
+        mitre += [t for t in rule.get("ioc_mitre") or [] if t not in mitre]
+        a["misp"] = {
+            "event_id": link.get("event_id"), "event_uuid": ev.get("event_uuid"), "event_info": ev.get("event_info"),
+            "attr_id": link.get("attr_id"), "ioc_uuid": link.get("ioc_uuid"),
+            "ioc_type": link.get("ioc_type"), "ioc_value": link.get("ioc_value"),
+            "mitre": mitre,
+        }
+        if mitre and not a.get("mitre"):
+            a["mitre"] = ",".join(mitre)
+    return alerts
+
+
+def rule_suppress_policy(sid: int) -> Optional[dict]:
+    """Policy suppress của sid từ cache (đã nạp bởi enrich_many cùng batch); không có -> None."""
+    rule = _rules.peek(sid)
+    return rule.get("suppress") if rule else None
+
+
+def warm(n: Optional[int] = None) -> int:
+    """Nạp sẵn n rule (sid lớn nhất = mới nhất) + event của chúng; trả số rule đã nạp."""
+    n = ALERT_ENRICH_WARM if n is None else n
+    if not ALERT_ENRICH_ENABLED or n <= 0:
+        return 0
+    sids = [d["sid"] for d in col_rule_items.find({"sid": {"$type": "number"}}, {"_id": 0, "sid": 1})
+            .sort("sid", -1).limit(min(n, ALERT_ENRICH_CACHE))]
+    if not sids:
+        return 0
+    _load_rules(sids)
+    eids = set()
+    for sid in sids:
+        rule = _rules.peek(sid)
+        if rule:
+            eids.update(m["event_id"] for m in [rule, *rule["members"].values()] if m.get("event_id") is not None)
+    if eids:
+        _load_events(list(eids)[:ALERT_ENRICH_CACHE])
+    log.info("enrich:warm rules=%d events=%d", len(sids), len(eids))
+    return len(sids)
+
+
+def invalidate(sids: Optional[Iterable[int]] = None, event_ids: Optional[Iterable[int]] = None) -> None:
+    """Bỏ entry theo sid / event_id; không truyền gì -> xoá toàn bộ cache."""
+    if sids is None and event_ids is None:
+        _rules.clear(); _events.clear()
+        return
+    for s in sids or ():
+        _rules.pop(int(s))
+    for e in event_ids or ():
+        _events.pop(int(e))
+
+
+def enrich_status() -> Dict[str, Any]:
+    return {"enabled": ALERT_ENRICH_ENABLED, "rules": _rules.status(), "events": _events.status()}
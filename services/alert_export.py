@@ -0,0 +1,240 @@
+"""
+Export alert (ids_alerts) theo khoảng thời gian ingest (_id) / sensor ra NDJSON, CSV hoặc Parquet — stream, bộ nhớ cố định.
+
+- cursor Mongo sort _id tăng dần (hint _id_), batch_size EXPORT_BATCH -> encoder ghi từng batch, không gom list
+- resume: after=<_id cuối đã nhận> -> {_id > after}; mọi format đều có cột/field _id
+- ndjson : doc Mongo (projection fields=dotted path), CSV / Parquet: cột phẳng như archive (src_ip, dst_ip, ...)
+- Parquet: 1 row group / batch, ghi qua sink trong RAM và xả ngay sau mỗi batch
+
+    python -m app.services.alert_export --format parquet --since 2025-01-01 --sensor s1 --out alerts.parquet
+    python -m app.services.alert_export --format ndjson --out alerts.ndjson --resume   # đọc alerts.ndjson.cursor
+
+CLI lưu _id cuối vào <out>.cursor sau mỗi batch (ndjson/csv: --resume nối tiếp file; parquet: cursor
+ghi khi file hoàn tất, --resume ghi file mới <out>-after-<id>.parquet -> dùng cho export tăng dần).
+"""
+import argparse, csv, io, json, logging, os, sys, time
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.database.collections import col_ids_alerts
+from app.services.alert_archive import alert_row, alert_schema, alert_id_range, COLUMNS, _pa, ArchiveUnavailable
+
+log = logging.getLogger("alerts.export")
+
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "5000"))
+FORMATS = ("ndjson", "csv", "parquet")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv",
+               "parquet": "application/vnd.apache.parquet"}
+# CSV / Parquet mặc định: bỏ payload inline + extra (lớn, ít dùng cho analytics)
+DEFAULT_COLUMNS = [c for c in COLUMNS if c not in ("b64_data", "extra")]
+
+
+def export_filter(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  sensor_id: Optional[List[str]] = None, rule_id: Optional[str] = None,
+                  after: Optional[str] = None) -> dict:
+    q: Dict[str, Any] = {}
+    # khoảng thời gian theo thời điểm ingest (_id), không theo `ts` sensor gửi (xem alert_id_range)
+    id_cond = alert_id_range(since, until)
+    if sensor_id:
+        q["sensor_id"] = sensor_id[0] if len(sensor_id) == 1 else {"$in": sensor_id}
+    if rule_id:
+        q["rule_id"] = rule_id
+    if after:
+        try:
+            id_cond["$gt"] = ObjectId(after)
+        except InvalidId:
+            raise ValueError(f"invalid after cursor: {after}")
+    if id_cond:
+        q["_id"] = id_cond
+    return q
+
+
+def _columns(fmt: str, fields: Optional[List[str]]) -> Optional[List[str]]:
+    if fmt == "ndjson":
+        return fields
+    cols = list(fields or DEFAULT_COLUMNS)
+    bad = [c for c in cols if c not in COLUMNS]
+    if bad:
+        raise ValueError(f"invalid column: {bad[0]} (có: {', '.join(COLUMNS)})")
+    if "_id" not in cols:
+        cols.insert(0, "_id")       # cần cho resume
+    return cols
+
+
+def _projection(fmt: str, fields: Optional[List[str]], cols: Optional[List[str]]) -> Optional[dict]:
+    if fmt == "ndjson":
+        return {f: 1 for f in fields} if fields else None
+    # cột phẳng dựng từ doc đầy đủ; chỉ bỏ blob khi không cần
+    drop = {}
+    if "b64_data" not in cols:
+        drop["b64_data"] = 0
+    return drop or None
+
+
+def _batches(q: dict, proj: Optional[dict], batch: int) -> Iterator[List[dict]]:
+    cur = col_ids_alerts.find(q, proj).sort("_id", 1).hint([("_id", 1)]).batch_size(batch)
+    buf: List[dict] = []
+    for d in cur:
+        buf.append(d)
+        if len(buf) >= batch:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+# ---- encoders: batch doc -> bytes
+class _Sink(io.RawIOBase):
+    """File-like cho ParquetWriter: gom byte đã ghi, drain() lấy ra để stream."""
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.pos = 0
+    def writable(self):
+        return True
+    def write(self, b):
+        self.chunks.append(bytes(b)); self.pos += len(b)
+        return len(b)
+    def tell(self):
+        return self.pos
+    def drain(self) -> bytes:
+        out, self.chunks = b"".join(self.chunks), []
+        return out
+
+
+def _ndjson(batches: Iterator[List[dict]]) -> Iterator[bytes]:
+    for docs in batches:
+        yield "".join(json.dumps(d, default=str, separators=(",", ":")) + "\n" for d in docs).encode()
+
+
+def _csv(batches: Iterator[List[dict]], cols: List[str], header: bool = True) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=cols, extrasaction="ignore")
+    if header:
+        w.writeheader()
+    for docs in batches:
+        for d in docs:
+            w.writerow(alert_row(d))
+        yield buf.getvalue().encode()
+        buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def _parquet(batches: Iterator[List[dict]], cols: List[str]) -> Iterator[bytes]:
+    pa = _pa()
+    schema = alert_schema(pa, cols)
+    sink = _Sink()
+    writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for docs in batches:
+            rows = [alert_row(d) for d in docs]
+            writer.write_table(pa.Table.from_pylist([{c: r[c] for c in cols} for r in rows], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_stream(fmt: str, q: dict, fields: Optional[List[str]] = None, batch: Optional[int] = None,
+                  stats: Optional[dict] = None, header: bool = True) -> Iterator[bytes]:
+    """
+    Stream byte của file export. stats (dict) được cập nhật liên tục: rows, bytes, last_id, seconds, rows_per_sec.
+    Gọi validate_export() trước nếu cần báo lỗi tham số trước khi bắt đầu stream.
+    """
+    cols = _columns(fmt, fields)
+    batch = batch or EXPORT_BATCH
+    stats = stats if stats is not None else {}
+    stats.update(rows=0, bytes=0, last_id=None)
+    t0 = time.perf_counter()
+
+    def counted() -> Iterator[List[dict]]:
+        for docs in _batches(q, _projection(fmt, fields, cols), batch):
+            # cập nhật trước khi encode -> chunk của batch này yield ra kèm last_id đúng
+            stats["rows"] += len(docs)
+            stats["last_id"] = str(docs[-1]["_id"])
+            yield docs
+
+    enc = _ndjson(counted()) if fmt == "ndjson" else _csv(counted(), cols, header) if fmt == "csv" else _parquet(counted(), cols)
+    for chunk in enc:
+        stats["bytes"] += len(chunk)
+        stats["seconds"] = round(time.perf_counter() - t0, 3)
+        stats["rows_per_sec"] = round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] else None
+        if chunk:
+            yield chunk
+    log.info("export:done fmt=%s rows=%d bytes=%d s=%.2f rows/s=%s last_id=%s", fmt, stats["rows"],
+             stats["bytes"], stats.get("seconds", 0), stats.get("rows_per_sec"), stats["last_id"])
+
+
+def validate_export(fmt: str, fields: Optional[List[str]]) -> None:
+    if fmt not in FORMATS:
+        raise ValueError(f"invalid format: {fmt}")
+    _columns(fmt, fields)
+    if fmt == "parquet":
+        _pa()
+
+
+# ---- CLI
+def _save_cursor(path: str, last_id: str) -> None:
+    with open(path + ".tmp", "w") as c:
+        c.write(last_id)
+    os.replace(path + ".tmp", path)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export ids_alerts (stream, resume theo _id)")
+    ap.add_argument("--format", choices=FORMATS, default="ndjson")
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--since", type=datetime.fromisoformat, help="thời điểm ingest (ISO, UTC nếu không có tz)")
+    ap.add_argument("--until", type=datetime.fromisoformat)
+    ap.add_argument("--sensor", action="append", help="lặp lại cho nhiều sensor")
+    ap.add_argument("--rule-id")
+    ap.add_argument("--fields", help="ndjson: dotted path; csv/parquet: cột phẳng (vd. ts,sensor_id,src_ip)")
+    ap.add_argument("--batch", type=int, default=EXPORT_BATCH)
+    ap.add_argument("--after", help="_id cuối đã export (resume)")
+    ap.add_argument("--resume", action="store_true", help="đọc _id từ <out>.cursor")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()] if args.fields else None
+    cursor_file = args.out + ".cursor"
+    after = args.after
+    if args.resume and os.path.exists(cursor_file):
+        with open(cursor_file) as f:
+            after = f.read().strip() or None
+    try:
+        validate_export(args.format, fields)
+        q = export_filter(args.since, args.until, args.sensor, args.rule_id, after)
+    except (ValueError, ArchiveUnavailable) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    out = args.out
+    if after and args.format == "parquet":
+        # Parquet không nối thêm được -> file mới cho phần tiếp theo
+        root, ext = os.path.splitext(args.out)
+        out = f"{root}-after-{after}{ext}"
+    append = bool(after) and args.format != "parquet" and os.path.exists(out)
+    stats: Dict[str, Any] = {}
+    report = time.perf_counter()
+    with open(out, "ab" if append else "wb") as f:
+        for chunk in export_stream(args.format, q, fields, args.batch, stats, header=not append):
+            f.write(chunk)
+            f.flush()
+            # parquet chỉ đọc được khi đã có footer -> cursor ghi lúc xong file (bên dưới)
+            if args.format != "parquet" and stats.get("last_id"):
+                _save_cursor(cursor_file, stats["last_id"])
+            if time.perf_counter() - report >= 5:
+                print(f"{stats['rows']:,} rows  {stats['bytes'] / 1e6:,.1f} MB  {stats.get('rows_per_sec') or 0:,.0f} rows/s",
+                      file=sys.stderr)
+                report = time.perf_counter()
+    if stats.get("last_id"):
+        _save_cursor(cursor_file, stats["last_id"])
+    print(json.dumps({"out": out, **stats}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Payload gói tin của alert lưu theo nội dung (content-addressed) thay vì b64_data inline mỗi alert.
+
+- decode base64 -> sha256(raw) -> alert chỉ giữ payload = {sha256, size}
+- alert_payloads {_id: sha256, size, enc: raw|zlib, data, refs, first_seen, last_seen}:
+  payload lặp lại (host scan gửi cùng gói) chỉ lưu 1 lần, refs đếm số alert trỏ tới
+- nén zlib khi >= PAYLOAD_COMPRESS_MIN byte và thực sự nhỏ hơn; >= PAYLOAD_GRIDFS_MIN -> GridFS
+- đọc lazy: get_payload(sha256) chỉ khi analyst mở alert
+
+b64_data không decode được -> giữ nguyên inline (không mất dữ liệu sensor gửi).
+"""
+import os, base64, binascii, hashlib, zlib, logging
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+import gridfs
+from bson import Binary
+from pymongo import UpdateOne
+
+from app.database.mongo import db_sec
+from app.database.collections import col_alert_payloads, col_ids_alerts
+
+log = logging.getLogger("alerts.payloads")
+
+PAYLOAD_STORE_ENABLED = os.getenv("PAYLOAD_STORE_ENABLED", "true").lower() == "true"
+PAYLOAD_COMPRESS_MIN = int(os.getenv("PAYLOAD_COMPRESS_MIN", "256"))            # byte
+PAYLOAD_GRIDFS_MIN = int(os.getenv("PAYLOAD_GRIDFS_MIN", str(1024 * 1024)))      # byte
+PAYLOAD_ZLIB_LEVEL = int(os.getenv("PAYLOAD_ZLIB_LEVEL", "6"))
+
+_fs: Optional[gridfs.GridFS] = None
+
+
+def _gridfs() -> gridfs.GridFS:
+    global _fs
+    if _fs is None:
+        _fs = gridfs.GridFS(db_sec, collection="alert_payloads_fs")
+    return _fs
+
+
+def _decode(b64: Any) -> Optional[bytes]:
+    if not isinstance(b64, str) or not b64:
+        return None
+    try:
+        return base64.b64decode(b64, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _encode(raw: bytes) -> Dict[str, Any]:
+    """raw -> field lưu trong alert_payloads (nén nếu có lợi)."""
+    if len(raw) >= PAYLOAD_COMPRESS_MIN:
+        z = zlib.compress(raw, PAYLOAD_ZLIB_LEVEL)
+        if len(z) < len(raw):
+            return {"enc": "zlib", "data": Binary(z), "stored": len(z)}
+    return {"enc": "raw", "data": Binary(raw), "stored": len(raw)}
+
+
+def store_payloads(docs: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    In-place: b64_data -> payload {sha256, size}; upsert payload mới (1 bulk_write / batch).
+    Trả {alerts, unique} để log / đo.
+    """
+    if not PAYLOAD_STORE_ENABLED:
+        return {"alerts": 0, "unique": 0}
+    uniq: Dict[str, bytes] = {}
+    refs: Dict[str, int] = {}
+    hits = []
+    for d in docs:
+        raw = _decode(d.get("b64_data"))
+        if raw is None:
+            continue
+        h = hashlib.sha256(raw).hexdigest()
+        uniq.setdefault(h, raw)
+        refs[h] = refs.get(h, 0) + 1
+        hits.append((d, h, len(raw)))
+    if not uniq:
+        return {"alerts": 0, "unique": 0}
+
+    now = datetime.now(timezone.utc)
+    ops = []
+    for h, raw in uniq.items():
+        body: Dict[str, Any] = {"size": len(raw), "first_seen": now}
+        if len(raw) >= PAYLOAD_GRIDFS_MIN:
+            body.update(enc="gridfs", gridfs_id=_put_gridfs(h, raw))
+        else:
+            body.update(_encode(raw))
+        ops.append(UpdateOne({"_id": h}, {"$setOnInsert": body, "$inc": {"refs": refs[h]},
+                                         "$max": {"last_seen": now}}, upsert=True))
+    col_alert_payloads.bulk_write(ops, ordered=False)
+    # chỉ thay b64_data bằng ref sau khi payload đã ghi (lỗi -> doc còn nguyên để spool / thử lại)
+    for d, h, size in hits:
+        d.pop("b64_data")
+        d["payload"] = {"sha256": h, "size": size}
+    return {"alerts": len(hits), "unique": len(uniq)}
+
+
+def _put_gridfs(h: str, raw: bytes):
+    fs = _gridfs()
+    f = fs.find_one({"filename": h})
+    if f is not None:
+        return f._id
+    return fs.put(raw, filename=h)
+
+
+def get_payload(sha256: str) -> Optional[bytes]:
+    d = col_alert_payloads.find_one({"_id": sha256})
+    if d is None:
+        return None
+    if d.get("enc") == "gridfs":
+        return _gridfs().get(d["gridfs_id"]).read()
+    data = bytes(d["data"])
+    return zlib.decompress(data) if d.get("enc") == "zlib" else data
+
+
+def alert_payload(alert: Dict[str, Any]) -> Optional[bytes]:
+    """Payload của 1 alert: bản content-addressed hoặc b64_data inline cũ."""
+    ref = alert.get("payload") or {}
+    if ref.get("sha256"):
+        return get_payload(ref["sha256"])
+    return _decode(alert.get("b64_data"))
+
+
+def migrate_inline(batch: int = 1000, limit: Optional[int] = None) -> Dict[str, int]:
+    """Chuyển alert cũ còn b64_data inline sang alert_payloads (chạy lại được, theo batch)."""
+    moved = unique = 0
+    while limit is None or moved < limit:
+        n = batch if limit is None else min(batch, limit - moved)
+        docs = list(col_ids_alerts.find({"b64_data": {"$type": "string"}, "payload": {"$exists": False}},
+                                        {"b64_data": 1}).limit(n))
+        if not docs:
+            break
+        res = store_payloads(docs)
+        ops = [UpdateOne({"_id": d["_id"]}, {"$set": {"payload": d["payload"]}, "$unset": {"b64_data": ""}})
+               for d in docs if "payload" in d]
+        if ops:
+            col_ids_alerts.bulk_write(ops, ordered=False)
+        moved += res["alerts"]; unique += res["unique"]
+        if len(ops) < len(docs):
+            # còn doc b64 hỏng -> đánh dấu để vòng sau không lấy lại mãi
+            bad = [d["_id"] for d in docs if "payload" not in d]
+            col_ids_alerts.update_many({"_id": {"$in": bad}}, {"$set": {"payload": None}})
+    log.info("payloads:migrate alerts=%d unique=%d", moved, unique)
+    return {"alerts": moved, "unique": unique}
+
+
+def payload_stats() -> Dict[str, Any]:
+    g = next(col_alert_payloads.aggregate([{"$group": {
+        "_id": None, "payloads": {"$sum": 1}, "refs": {"$sum": "$refs"},
+        "raw_bytes": {"$sum": "$size"}, "stored_bytes": {"$sum": {"$ifNull": ["$stored", "$size"]}},
+    }}]), None) or {}
+    g.pop("_id", None)
+    return {"payloads": 0, "refs": 0, "raw_bytes": 0, "stored_bytes": 0, **g}
@@ -1,5 +1,5 @@
-from app.database.mongo import db_sec
+from app.database.collections import col_ids_alerts
 from app.models.alert_models import Alert
 
 async def create_alert(alert: Alert):
-    db_sec.ids_alerts.insert_one(alert.dict())  # Insert alert vào MongoDB
+    col_ids_alerts.insert_one(alert.dict())  # Insert alert vào MongoDB
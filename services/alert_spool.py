@@ -0,0 +1,415 @@
+"""
+Spool ghi trước (write-ahead) cho ingest alert khi Mongo chậm / mất kết nối.
+
+ingest(docs, folds):
+- bình thường: ghi thẳng Mongo trong ngân sách SPOOL_LATENCY_BUDGET_MS (pymongo.timeout)
+- lỗi / quá ngân sách -> chuyển sang chế độ degraded: batch này và các batch sau append vào spool,
+  trả về ngay (không thử Mongo mỗi request -> không retry-storm, sensor không phải chờ timeout)
+- replayer nền: khi Mongo ping được, đọc spool theo thứ tự, ghi lại với tốc độ <= SPOOL_REPLAY_RATE alert/s;
+  rỗng -> tắt degraded, ingest ghi thẳng trở lại
+
+Spool: SPOOL_DIR/seg-<seq>.log, append-only, record = [len u32][crc32 u32][BSON {docs, folds}],
+segment mới khi > SPOOL_SEGMENT_BYTES. fsync theo nhóm mỗi SPOOL_FSYNC_MS (thread flusher), không mỗi record.
+Tiến độ replay (segment, offset) lưu ở SPOOL_DIR/replay.pos; segment đọc xong bị xoá.
+
+Alert có _id gán trước khi ghi -> replay lặp lại (crash giữa chừng) bỏ qua lỗi duplicate key;
+fold ($inc count) của record đang replay dở có thể bị cộng 2 lần.
+
+Record lỗi không phải do kết nối / timeout (vd. BulkWriteError validation) SPOOL_MAX_ATTEMPTS lần liên tiếp
+-> chuyển sang <slot>/dead-letter.log (cùng format record, kèm error) rồi replay tiếp, không kẹt degraded mãi.
+
+Nhiều worker: mỗi process giữ 1 slot SPOOL_DIR/w<N> (flock .lock tới khi thoát). Slot không ai giữ nhưng còn
+segment (worker đã thoát / giảm số worker, hoặc spool cũ nằm thẳng trong SPOOL_DIR) được replayer adopt và drain.
+"""
+import os, fcntl, struct, threading, time, zlib, logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import bson
+import pymongo
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, PyMongoError, WTimeoutError
+
+from app.database.mongo import ping
+from app.database.collections import col_ids_alerts
+from app.services.alert_payloads import store_payloads
+from app.services.alert_suppression import fold_ops
+from app.services.metrics import Counter, gauge_fn
+
+log = logging.getLogger("alerts.spool")
+
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+SPOOL_DIR = Path(os.getenv("SPOOL_DIR", "./data/spool"))
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+SPOOL_FSYNC_MS = int(os.getenv("SPOOL_FSYNC_MS", "50"))
+SPOOL_LATENCY_BUDGET_MS = int(os.getenv("SPOOL_LATENCY_BUDGET_MS", "1000"))     # ghi Mongo trực tiếp tối đa
+SPOOL_REPLAY_RATE = int(os.getenv("SPOOL_REPLAY_RATE", "5000"))                 # alert/s khi drain
+SPOOL_RETRY_SEC = float(os.getenv("SPOOL_RETRY_SEC", "2"))
+SPOOL_MAX_ATTEMPTS = int(os.getenv("SPOOL_MAX_ATTEMPTS", "3"))                  # lỗi dữ liệu -> dead-letter
+SPOOL_SLOTS = int(os.getenv("SPOOL_SLOTS", "64"))                               # slot w0..w<N-1> / worker
+SPOOL_ADOPT_SEC = float(os.getenv("SPOOL_ADOPT_SEC", "60"))                     # chu kỳ tìm slot mồ côi
+
+_HDR = struct.Struct("<II")     # len, crc32
+
+SPOOL_REPLAYED = Counter("alert_spool_replayed_total", "Alert replay từ spool vào Mongo")
+SPOOL_DEAD_LETTERED = Counter("alert_spool_dead_lettered_total", "Alert replay lỗi dữ liệu -> dead-letter")
+
+
+class SpoolError(RuntimeError):
+    pass
+
+
+def write_alerts(docs: List[Dict[str, Any]], folds: List[Dict[str, Any]]) -> int:
+    """Ghi 1 batch vào Mongo (payload -> alerts -> fold); lặp lại an toàn với alert đã có (_id trùng)."""
+    inserted = 0
+    if docs:
+        store_payloads(docs)
+        try:
+            inserted = len(col_ids_alerts.insert_many(docs, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            errs = e.details.get("writeErrors", [])
+            if any(w.get("code") != 11000 for w in errs):
+                raise
+            inserted = e.details.get("nInserted", 0)     # replay: phần đã ghi trước đó bị bỏ qua
+    if folds:
+        col_ids_alerts.bulk_write(fold_ops(folds), ordered=False)
+    return inserted
+
+
+def _transient(e: PyMongoError) -> bool:
+    """Lỗi kết nối / timeout: chờ Mongo hồi phục, không tính là record hỏng."""
+    return isinstance(e, (ConnectionFailure, ExecutionTimeout, WTimeoutError)) or bool(getattr(e, "timeout", False))
+
+
+def _try_lock(d: Path) -> Optional[int]:
+    """flock không chờ trên d/.lock -> fd (giữ để giữ lock) hoặc None nếu process khác đang giữ."""
+    d.mkdir(parents=True, exist_ok=True)
+    fd = os.open(d / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+def _unlock(fd: int) -> None:
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _claim_slot(base: Path) -> Tuple[Path, int]:
+    """Slot spool riêng của process: base/w<N> đầu tiên lock được."""
+    for n in range(SPOOL_SLOTS):
+        fd = _try_lock(base / f"w{n}")
+        if fd is not None:
+            return base / f"w{n}", fd
+    raise SpoolError(f"no free spool slot in {base} (SPOOL_SLOTS={SPOOL_SLOTS})")
+
+
+class AlertSpool:
+    def __init__(self, root: Path, base: Optional[Path] = None):
+        self.root = root
+        self.base = base                       # SPOOL_DIR chứa các slot (None: không adopt slot khác)
+        self.lock_fd: Optional[int] = None
+        self.lock = threading.Lock()           # append / rotate / đổi trạng thái degraded
+        self.f = None
+        self.seq = 0
+        self.size = 0
+        self.dirty = False
+        self.bad = False
+        self.degraded = False
+        self.stop = threading.Event()
+        self.wake = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.fail_at: Optional[Tuple[int, int]] = None     # record đang lỗi (seq, offset sau record)
+        self.fail_n = 0
+        self.stats = {"spooled_batches": 0, "spooled_alerts": 0, "replayed_batches": 0,
+                      "replayed_alerts": 0, "corrupt": 0, "dead_lettered": 0, "adopted_alerts": 0,
+                      "last_error": None}
+
+    # ---- segment
+    def _segments(self) -> List[Path]:
+        return sorted(self.root.glob("seg-*.log"))
+
+    def _seq_of(self, p: Path) -> int:
+        return int(p.stem.split("-")[1])
+
+    def _open_new(self) -> None:
+        if self.f:
+            self.f.flush(); os.fsync(self.f.fileno()); self.f.close()
+        self.seq += 1
+        self.f = open(self.root / f"seg-{self.seq:012d}.log", "ab")
+        self.size = 0
+
+    def open(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        segs = self._segments()
+        self.seq = self._seq_of(segs[-1]) if segs else 0
+        self._open_new()                       # không ghi nối vào segment cũ (đuôi có thể hỏng)
+        if self.pending_bytes():
+            self.degraded = True               # còn dữ liệu từ lần chạy trước -> drain trước đã
+            log.warning("spool:startup pending segments=%d -> degraded", len(segs))
+
+    def append(self, docs: List[Dict[str, Any]], folds: List[Dict[str, Any]]) -> None:
+        data = bson.encode({"docs": docs, "folds": folds})
+        rec = _HDR.pack(len(data), zlib.crc32(data)) + data
+        with self.lock:
+            if self.size and self.size + len(rec) > SPOOL_SEGMENT_BYTES:
+                self._open_new()
+            self.f.write(rec)
+            self.f.flush()                     # vào page cache ngay; fsync gom nhóm ở flusher
+            self.size += len(rec)
+            self.dirty = True
+            self.degraded = True               # spool còn dữ liệu <=> degraded (replayer sẽ drain)
+            self.stats["spooled_batches"] += 1
+            self.stats["spooled_alerts"] += len(docs)
+        self.wake.set()
+
+    def _flusher(self) -> None:
+        while not self.stop.wait(SPOOL_FSYNC_MS / 1000):
+            with self.lock:
+                if self.dirty and self.f:
+                    os.fsync(self.f.fileno())
+                    self.dirty = False
+
+    # ---- replay
+    def _pos_path(self) -> Path:
+        return self.root / "replay.pos"
+
+    def _load_pos(self) -> Tuple[int, int]:
+        try:
+            seq, off = self._pos_path().read_text().split()
+            return int(seq), int(off)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _save_pos(self, seq: int, off: int) -> None:
+        tmp = self._pos_path().with_suffix(".tmp")
+        tmp.write_text(f"{seq} {off}")
+        os.replace(tmp, self._pos_path())
+
+    def pending_bytes(self) -> int:
+        pseq, poff = self._load_pos()
+        n = 0
+        for p in self._segments():
+            s = self._seq_of(p)
+            if s >= pseq:
+                n += p.stat().st_size - (poff if s == pseq else 0)
+        return max(n, 0)
+
+    def _read(self, p: Path, off: int):
+        """Yield (record, offset sau record) từ off; dừng ở đuôi chưa ghi xong. Record hỏng -> self.bad = True."""
+        self.bad = False
+        with open(p, "rb") as f:
+            f.seek(off)
+            while True:
+                hdr = f.read(_HDR.size)
+                if len(hdr) < _HDR.size:
+                    return
+                n, crc = _HDR.unpack(hdr)
+                data = f.read(n)
+                if len(data) < n:
+                    return
+                if zlib.crc32(data) != crc:
+                    self.bad = True
+                    self.stats["corrupt"] += 1
+                    log.warning("spool:corrupt seg=%s off=%d -> skip rest of segment", p.name, off)
+                    return
+                off += _HDR.size + n
+                yield bson.decode(data), off
+
+    def _dead_letter(self, rec: Dict[str, Any], err: PyMongoError, seq: int, off: int) -> None:
+        errs = [w.get("errmsg") for w in ((getattr(err, "details", None) or {}).get("writeErrors") or [])[:10]]
+        data = bson.encode({**rec, "error": str(err), "write_errors": errs, "seg": seq, "off": off,
+                            "at": datetime.now(timezone.utc)})
+        with open(self.root / "dead-letter.log", "ab") as f:
+            f.write(_HDR.pack(len(data), zlib.crc32(data)) + data)
+            f.flush(); os.fsync(f.fileno())
+        self.stats["dead_lettered"] += len(rec["docs"])
+        SPOOL_DEAD_LETTERED.inc(len(rec["docs"]))
+        log.error("spool:dead-letter seg=%d off=%d alerts=%d attempts=%d err=%s",
+                  seq, off, len(rec["docs"]), self.fail_n, err)
+
+    def _give_up(self, seq: int, off: int, e: PyMongoError) -> bool:
+        """Đếm lần lỗi liên tiếp của record (seq, off); True khi đã đủ SPOOL_MAX_ATTEMPTS (lỗi dữ liệu)."""
+        if _transient(e):
+            return False
+        if self.fail_at == (seq, off):
+            self.fail_n += 1
+        else:
+            self.fail_at, self.fail_n = (seq, off), 1
+        return self.fail_n >= SPOOL_MAX_ATTEMPTS
+
+    def drain_once(self) -> int:
+        """
+        Replay spool theo thứ tự tới khi rỗng; trả số alert đã ghi. Lỗi Mongo -> raise (giữ vị trí);
+        record lỗi dữ liệu đủ SPOOL_MAX_ATTEMPTS lần -> dead-letter và đi tiếp.
+        """
+        done = 0
+        while not self.stop.is_set():
+            pseq, poff = self._load_pos()
+            p = next((p for p in self._segments() if self._seq_of(p) >= pseq), None)
+            if p is None:
+                return done
+            seq = self._seq_of(p)
+            off = poff if seq == pseq else 0
+            for rec, off in self._read(p, off):
+                t0 = time.perf_counter()
+                try:
+                    write_alerts(rec["docs"], rec["folds"])
+                except PyMongoError as e:
+                    if not self._give_up(seq, off, e):
+                        raise
+                    self._dead_letter(rec, e, seq, off)
+                    self._save_pos(seq, off)
+                    continue
+                self._save_pos(seq, off)
+                done += len(rec["docs"])
+                self.stats["replayed_batches"] += 1
+                self.stats["replayed_alerts"] += len(rec["docs"])
+                SPOOL_REPLAYED.inc(len(rec["docs"]))
+                # giới hạn tốc độ replay: không dồn tải lên Mongo vừa hồi phục
+                wait = (len(rec["docs"]) or 1) / max(SPOOL_REPLAY_RATE, 1) - (time.perf_counter() - t0)
+                if wait > 0 and self.stop.wait(wait):
+                    return done
+            with self.lock:
+                if seq == self.seq:
+                    if self.f.tell() > off and not self.bad:
+                        continue                   # ingest vừa append thêm -> đọc tiếp
+                    # segment đang ghi đã replay hết: sang segment mới, spool rỗng -> ghi thẳng Mongo
+                    self._open_new()
+                    self.degraded = False
+                    self._save_pos(self.seq, 0)
+                    p.unlink(missing_ok=True)
+                    return done
+            p.unlink(missing_ok=True)              # segment cũ đã replay xong
+            self._save_pos(seq + 1, 0)
+        return done
+
+    def adopt_orphans(self) -> int:
+        """Drain slot không process nào giữ mà còn segment (và spool cũ nằm thẳng trong base)."""
+        if self.base is None:
+            return 0
+        done = 0
+        for d in [self.base, *sorted(self.base.glob("w*"))]:
+            if d == self.root or not d.is_dir() or not any(p.stat().st_size for p in d.glob("seg-*.log")):
+                continue
+            fd = _try_lock(d)
+            if fd is None:
+                continue                       # worker khác đang sống / đang adopt
+            orphan = AlertSpool(d)
+            try:
+                orphan.open()
+                n = orphan.drain_once()
+                done += n
+                log.info("spool:adopted dir=%s alerts=%d", d, n)
+            finally:
+                orphan.close()
+                if not orphan.pending_bytes():
+                    for p in orphan._segments():     # segment rỗng drain_once mở lúc kết thúc
+                        p.unlink(missing_ok=True)
+                _unlock(fd)
+        self.stats["adopted_alerts"] += done
+        return done
+
+    def _replayer(self) -> None:
+        next_adopt = 0.0
+        while not self.stop.is_set():
+            if not self.degraded:
+                if time.monotonic() >= next_adopt:
+                    next_adopt = time.monotonic() + SPOOL_ADOPT_SEC
+                    try:
+                        self.adopt_orphans()
+                    except (PyMongoError, OSError) as e:
+                        self.stats["last_error"] = str(e)
+                        log.warning("spool:adopt.failed err=%s", e)
+                self.wake.wait(1.0); self.wake.clear()
+                continue
+            try:
+                with pymongo.timeout(SPOOL_LATENCY_BUDGET_MS / 1000):
+                    ping()
+                n = self.drain_once()
+                if n:
+                    log.info("spool:replayed alerts=%d degraded=%s", n, self.degraded)
+            except PyMongoError as e:
+                self.stats["last_error"] = str(e)
+                self.stop.wait(SPOOL_RETRY_SEC)
+
+    def start(self) -> None:
+        self.open()
+        for fn, name in ((self._flusher, "spool-fsync"), (self._replayer, "spool-replay")):
+            t = threading.Thread(target=fn, name=name, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def close(self) -> None:
+        self.stop.set(); self.wake.set()
+        for t in self.threads:
+            t.join(timeout=5)
+        with self.lock:
+            if self.f:
+                self.f.flush(); os.fsync(self.f.fileno()); self.f.close()
+                self.f = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"enabled": True, "degraded": self.degraded, "dir": str(self.root),
+                "segments": len(self._segments()), "pending_bytes": self.pending_bytes(), **self.stats}
+
+
+_spool: Optional[AlertSpool] = None
+
+
+def get_spool() -> Optional[AlertSpool]:
+    return _spool
+
+
+def start_spool() -> Optional[AlertSpool]:
+    global _spool
+    if SPOOL_ENABLED and _spool is None:
+        root, fd = _claim_slot(SPOOL_DIR)      # mỗi worker 1 slot: segment / replay.pos không dùng chung
+        _spool = AlertSpool(root, base=SPOOL_DIR)
+        _spool.lock_fd = fd
+        _spool.start()
+    return _spool
+
+
+def shutdown_spool() -> None:
+    global _spool
+    if _spool is not None:
+        _spool.close()
+        if _spool.lock_fd is not None:
+            _unlock(_spool.lock_fd)
+        _spool = None
+
+
+def ingest(docs: List[Dict[str, Any]], folds: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Ghi batch alert: thẳng Mongo trong ngân sách, không được -> spool. -> {inserted, spooled}."""
+    for d in docs:
+        d.setdefault("_id", ObjectId())       # _id cố định -> replay idempotent
+    sp = _spool
+    if sp is None:
+        return {"inserted": write_alerts(docs, folds), "spooled": 0}
+    if not sp.degraded:
+        try:
+            with pymongo.timeout(SPOOL_LATENCY_BUDGET_MS / 1000):
+                return {"inserted": write_alerts(docs, folds), "spooled": 0}
+        except PyMongoError as e:
+            # insert ordered=False có thể đã ghi 1 phần -> replay bỏ qua duplicate _id
+            sp.degraded = True
+            sp.stats["last_error"] = str(e)
+            log.warning("spool:degraded err=%s", e)
+    try:
+        sp.append(docs, folds)
+    except (OSError, bson.errors.InvalidDocument) as e:
+        raise SpoolError(f"spool write failed: {e}")
+    return {"inserted": 0, "spooled": len(docs)}
+
+
+def spool_status() -> Dict[str, Any]:
+    return _spool.status() if _spool else {"enabled": False}
+
+
+gauge_fn("alert_spool_pending_bytes", "Byte trong spool chưa replay", lambda: _spool.pending_bytes() if _spool else 0)
+gauge_fn("alert_spool_degraded", "1 = ingest đang ghi vào spool thay vì Mongo", lambda: int(bool(_spool and _spool.degraded)))
@@ -0,0 +1,143 @@
+"""
+Chống bão alert lúc ingest: alert trùng (sensor, rule_id, src, dst) trong 1 cửa sổ thời gian được gộp.
+
+Mode (policy theo sid ở rule_items.suppress, mặc định ALERT_SUPPRESS_MODE / ALERT_SUPPRESS_WINDOW):
+- off       : lưu mọi alert
+- suppress  : lưu alert đầu tiên của cửa sổ, bỏ các alert trùng (không ghi gì thêm)
+- aggregate : lưu alert đầu tiên, alert trùng gộp vào nó: count += n, last_seen (1 update / key / batch)
+- threshold : chỉ lưu khi đủ `count` alert trong cửa sổ (alert thứ count, kèm first_seen), sau đó như aggregate
+
+track: by_flow (sensor, rule, src, dst) | by_src | by_dst | by_rule.
+
+Bảng key -> trạng thái cửa sổ nằm trong RAM (OrderedDict, tối đa ALERT_SUPPRESS_TABLE entry,
+bỏ entry cũ nhất / hết hạn). Restart process -> cửa sổ bắt đầu lại (tối đa thêm 1 alert / key).
+"""
+import os, threading, time, logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.services.alert_enrichment import rule_suppress_policy
+
+log = logging.getLogger("alerts.suppress")
+
+ALERT_SUPPRESS_MODE = os.getenv("ALERT_SUPPRESS_MODE", "aggregate").lower()      # mặc định cho sid không có policy
+ALERT_SUPPRESS_WINDOW = int(os.getenv("ALERT_SUPPRESS_WINDOW", "60"))           # giây
+ALERT_SUPPRESS_TABLE = int(os.getenv("ALERT_SUPPRESS_TABLE", "200000"))         # số key tối đa trong RAM
+
+MODES = ("off", "suppress", "aggregate", "threshold")
+_DEFAULT = {"mode": ALERT_SUPPRESS_MODE, "window": ALERT_SUPPRESS_WINDOW, "count": 1, "track": "by_flow"}
+
+
+class _Window:
+    __slots__ = ("start", "window", "n", "alert_id", "first_seen", "last_seen", "pending")
+
+    def __init__(self, start: float, window: int, first_seen: Any):
+        self.start, self.window = start, window
+        self.n = 0                    # số alert trong cửa sổ
+        self.alert_id = None          # _id alert đã lưu (None: chưa lưu - threshold chưa đủ)
+        self.first_seen = first_seen
+        self.last_seen = first_seen
+        self.pending = 0              # alert gộp chưa ghi vào Mongo (aggregate)
+
+
+_table: "OrderedDict[tuple, _Window]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"seen": 0, "stored": 0, "folded": 0, "dropped": 0, "evicted": 0}
+
+
+def _policy(a: Dict[str, Any]) -> Dict[str, Any]:
+    p = rule_suppress_policy(a["sid"]) if isinstance(a.get("sid"), int) else None
+    return {**_DEFAULT, **p} if p else _DEFAULT
+
+
+def _key(a: Dict[str, Any], track: str) -> tuple:
+    src = (a.get("src") or {}).get("ip")
+    dst = (a.get("dst") or {}).get("ip")
+    if track == "by_src":
+        dst = None
+    elif track == "by_dst":
+        src = None
+    elif track == "by_rule":
+        src = dst = None
+    return a.get("sensor_id"), a.get("rule_id"), src, dst
+
+
+def _evict(now: float) -> None:
+    # entry ít được chạm nhất nằm đầu OrderedDict (move_to_end khi có alert mới)
+    while _table:
+        w = next(iter(_table.values()))
+        if len(_table) <= ALERT_SUPPRESS_TABLE and now - w.start < w.window:
+            break
+        _table.popitem(last=False)
+        _stats["evicted"] += 1
+
+
+def apply(docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    -> (alert cần insert, fold {_id, count, last_seen} gộp vào alert đã lưu — xem fold_ops).
+    Alert được lưu có _id gán sẵn + count/first_seen/last_seen; áp fold SAU khi insert.
+    """
+    if not docs:
+        return docs, []
+    now = time.monotonic()
+    out: List[Dict[str, Any]] = []
+    touched: Dict[tuple, _Window] = {}
+    with _lock:
+        for a in docs:
+            _stats["seen"] += 1
+            p = _policy(a)
+            mode = p["mode"]
+            if mode == "off" or mode not in MODES:
+                out.append(a)
+                continue
+            seen_at = a.get("ts") or a.get("ingested_at")
+            k = _key(a, p["track"])
+            w = _table.get(k)
+            if w is None or now - w.start >= p["window"]:
+                w = _table[k] = _Window(now, p["window"], seen_at)
+            _table.move_to_end(k)
+            w.n += 1
+            w.last_seen = seen_at
+            need = p["count"] if mode == "threshold" else 1
+            if w.alert_id is None:
+                if w.n >= need:
+                    a["_id"] = w.alert_id = ObjectId()
+                    a.update(count=w.n, first_seen=w.first_seen, last_seen=seen_at)
+                    out.append(a)
+                    _stats["stored"] += 1
+                else:
+                    _stats["folded"] += 1         # threshold chưa đủ: chỉ đếm
+                continue
+            if mode == "suppress":
+                _stats["dropped"] += 1
+                continue
+            w.pending += 1
+            touched[k] = w
+            _stats["folded"] += 1
+        _evict(now)
+
+        folds = []
+        for w in touched.values():
+            if w.pending:
+                folds.append({"_id": w.alert_id, "count": w.pending, "last_seen": w.last_seen})
+                w.pending = 0
+    return out, folds
+
+
+def fold_ops(folds: List[Dict[str, Any]]) -> List[UpdateOne]:
+    # fold là dict thuần (ghi được vào spool), UpdateOne dựng lúc ghi Mongo
+    return [UpdateOne({"_id": f["_id"]}, {"$inc": {"count": f["count"]}, "$set": {"last_seen": f["last_seen"]}})
+            for f in folds]
+
+
+def suppression_status() -> Dict[str, Any]:
+    with _lock:
+        return {"default": _DEFAULT, "table": len(_table), "table_max": ALERT_SUPPRESS_TABLE, **_stats}
+
+
+def reset() -> None:
+    with _lock:
+        _table.clear()
@@ -1,6 +1,7 @@
 from typing import Dict, Any, List
 from app.database.collections import col_iocs, col_rule_items
 from app.models.converted_tag_models import ConvertedTagRequest, ConvertedTagScope
+from app.services.misp_stats import bump, CONVERTED_TAG
 
 def _attr_ids_from_sids(sids: List[int]) -> List[int]:
     cursor = col_rule_items.find(
@@ -56,6 +57,8 @@ def toggle_converted_tag(req: ConvertedTagRequest) -> Dict[str, Any]:
         }       
 
     res = col_iocs.update_many(q, update)
+    if tag == CONVERTED_TAG and res.modified_count:
+        bump({"converted": res.modified_count if req.action == "tag" else -res.modified_count})
 
     return {
         "ok": True,
@@ -0,0 +1,314 @@
+"""
+Index IOC trong RAM cho bulk lookup ("50k IP/domain/hash này có IOC nào không?") không query Mongo.
+
+Khoá (đã chuẩn hoá lower): norm.ip, norm.host, hash (md5/sha1/sha256/..., cả vế hash của filename|sha256),
+và value của các type khác (url, email, ...). Ngoài khớp exact:
+  - CIDR: IOC dạng 10.0.0.0/8 -> bảng theo prefixlen, IP hỏi được mask + tra từng prefixlen có mặt
+  - parent domain: a.b.evil.com khớp IOC host evil.com (dừng trước nhãn cuối / TLD)
+
+Refresh:
+  - full: build lại toàn bộ (lần đầu / job IOC_INDEX_REBUILD_MIN)
+  - incremental: sau mỗi pull/sync/import, chỉ đọc ioc có source.pulled_at >= mốc lần trước - IOC_INDEX_OVERLAP_SEC
+    (pull chạy song song có thể ghi pulled_at cũ hơn mốc sau khi refresh đã đọc xong; nạp lại trùng là idempotent)
+  - bảng đã publish không bị sửa tại chỗ: refresh/rebuild dựng bản mới rồi swap -> reader không cần khoá
+"""
+import ipaddress, os, threading, time, logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from app.database.collections import col_iocs
+
+log = logging.getLogger("misp.ioc_index")
+
+IOC_INDEX_ENABLED = os.getenv("IOC_INDEX_ENABLED", "true").lower() == "true"
+IOC_INDEX_REBUILD_MIN = int(os.getenv("IOC_INDEX_REBUILD_MIN", "360"))   # 0 = tắt rebuild định kỳ
+IOC_LOOKUP_MAX = int(os.getenv("IOC_LOOKUP_MAX", "100000"))               # value / request
+IOC_INDEX_OVERLAP_SEC = int(os.getenv("IOC_INDEX_OVERLAP_SEC", "300"))    # refresh đọc lùi khỏi watermark
+
+_IP_TYPES = {"ip-src", "ip-dst", "ip-src|port", "ip-dst|port", "domain|ip"}
+_PROJ = {"_id": 0, "uuid": 1, "type": 1, "value": 1, "event_id": 1, "to_ids": 1,
+         "norm.ip": 1, "norm.host": 1, "norm.type_family": 1, "value_parts": 1, "source.pulled_at": 1}
+
+# ref gọn cho mỗi IOC: (uuid, type, event_id, to_ids)
+Ref = Tuple[str, str, int, bool]
+
+
+def _ioc_keys(d: dict) -> List[str]:
+    """Các khoá exact của 1 ioc doc (đã lower). CIDR trả dạng 'net/len'."""
+    t = d.get("type") or ""
+    v = str(d.get("value") or "")
+    norm = d.get("norm") or {}
+    keys: List[str] = []
+    if norm.get("ip"):
+        keys.append(str(norm["ip"]).strip().lower())
+    if norm.get("host") and t not in ("url", "uri"):     # url: khoá là cả url, không phải host
+        keys.append(str(norm["host"]).strip().lower().rstrip("."))
+    if t == "domain|ip":
+        parts = d.get("value_parts") or {}
+        keys += [str(p).strip().lower() for p in (parts.get("left"), parts.get("right")) if p]
+    elif "|" in t and (d.get("value_parts") or {}).get("right") and norm.get("type_family") == "file":
+        keys.append(str(d["value_parts"]["right"]).strip().lower())     # filename|sha256 -> hash
+    if not keys:
+        keys.append(v.strip().lower())
+    return keys
+
+
+def _tail2(key: str) -> str:
+    """'a.b.evil.com' -> 'evil.com' (2 nhãn cuối) — lọc nhanh trước khi dò parent domain."""
+    return key[key.rfind(".", 0, key.rfind(".")) + 1:]
+
+def _ipv4_int(key: str) -> Optional[int]:
+    parts = key.split(".")
+    if len(parts) != 4:
+        return None
+    n = 0
+    for p in parts:
+        if not p.isdigit() or len(p) > 3:
+            return None
+        b = int(p)
+        if b > 255:
+            return None
+        n = (n << 8) | b
+    return n
+
+
+class IOCIndex:
+    # các bảng được swap nguyên khối khi rebuild
+    _TABLES = ("exact", "cidr", "cidr6", "tails", "cidr_octets", "cidr_wide")
+
+    def __init__(self):
+        self.exact: Dict[str, Dict[str, Ref]] = {}
+        self.cidr: Dict[int, Dict[int, Dict[str, Ref]]] = {}     # prefixlen -> network int -> refs (IPv4)
+        self.cidr6: Dict[int, Dict[int, Dict[str, Ref]]] = {}
+        self.tails: Set[str] = set()          # 2 nhãn cuối của mọi IOC host
+        self.cidr_octets: Set[str] = set()    # octet đầu của CIDR v4 (prefixlen >= 8)
+        self.cidr_wide = False                # có CIDR v4 /0../7 -> không lọc theo octet đầu
+        self.count = 0                        # doc đã nạp (refresh nạp lại doc bị update -> đếm lại tới lần rebuild)
+        self.built_at: Optional[datetime] = None
+        self.refreshed_at: Optional[datetime] = None
+        self.watermark: Optional[datetime] = None    # max source.pulled_at đã nạp
+        self.lock = threading.Lock()                  # 1 writer; reader đọc bảng đã publish (bất biến) không khoá
+
+    # ---- nạp
+    def _add(self, d: dict) -> None:
+        ref: Ref = (d.get("uuid"), d.get("type"), int(d.get("event_id") or 0), bool(d.get("to_ids")))
+        is_ip = d.get("type") in _IP_TYPES
+        host = ((d.get("norm") or {}).get("host") or "").lower().rstrip(".")
+        for k in _ioc_keys(d):
+            if is_ip and "/" in k:
+                try:
+                    net = ipaddress.ip_network(k, strict=False)
+                except ValueError:
+                    continue
+                if net.prefixlen < net.max_prefixlen:
+                    table = self.cidr if net.version == 4 else self.cidr6
+                    table.setdefault(net.prefixlen, {}).setdefault(int(net.network_address), {})[ref[0]] = ref
+                    if net.version == 4:
+                        if net.prefixlen >= 8: self.cidr_octets.add(str(net.network_address).split(".")[0])
+                        else: self.cidr_wide = True
+                    continue
+                k = net.network_address.compressed
+            elif is_ip and ":" in k:
+                try:
+                    k = ipaddress.ip_address(k).compressed
+                except ValueError:
+                    pass
+            elif host and k == host:
+                self.tails.add(_tail2(k))
+            self.exact.setdefault(k, {})[ref[0]] = ref
+
+    def _load(self, cur: Iterable[dict]) -> Tuple[int, Optional[datetime]]:
+        n, wm = 0, None
+        for d in cur:
+            self._add(d)
+            n += 1
+            ts = (d.get("source") or {}).get("pulled_at")
+            if ts is not None and (wm is None or ts > wm):
+                wm = ts
+        return n, wm
+
+    def rebuild(self, col=None) -> Dict[str, Any]:
+        """Dựng index mới rồi swap (reader không thấy trạng thái dở dang)."""
+        t0 = time.perf_counter()
+        fresh = IOCIndex()
+        n, wm = fresh._load((col if col is not None else col_iocs).find({}, _PROJ).batch_size(10_000))
+        with self.lock:
+            for name in self._TABLES:
+                setattr(self, name, getattr(fresh, name))
+            self.count = n
+            self.watermark = wm
+            self.built_at = self.refreshed_at = datetime.now(timezone.utc)
+        ms = int((time.perf_counter() - t0) * 1000)
+        log.info("ioc_index:rebuild iocs=%d keys=%d ms=%d", n, len(self.exact), ms)
+        return {"ok": True, "mode": "full", "loaded": n, "duration_ms": ms}
+
+    def _merged(self, delta: "IOCIndex") -> Dict[str, Any]:
+        """Bảng mới = bảng hiện tại + delta; copy mọi dict bị chạm, không sửa bảng reader đang đọc."""
+        exact = dict(self.exact)
+        for k, refs in delta.exact.items():
+            exact[k] = {**exact[k], **refs} if k in exact else refs
+        out: Dict[str, Any] = {"exact": exact}
+        for name in ("cidr", "cidr6"):
+            table = dict(getattr(self, name))
+            for plen, nets in getattr(delta, name).items():
+                merged = dict(table.get(plen) or {})
+                for net, refs in nets.items():
+                    merged[net] = {**merged[net], **refs} if net in merged else refs
+                table[plen] = merged
+            out[name] = table
+        out["tails"] = self.tails | delta.tails if delta.tails else self.tails
+        out["cidr_octets"] = self.cidr_octets | delta.cidr_octets if delta.cidr_octets else self.cidr_octets
+        out["cidr_wide"] = self.cidr_wide or delta.cidr_wide
+        return out
+
+    def refresh(self, col=None) -> Dict[str, Any]:
+        """Nạp tăng dần các ioc upsert từ watermark (lùi IOC_INDEX_OVERLAP_SEC); chưa build -> rebuild."""
+        if self.built_at is None:
+            return self.rebuild(col)
+        t0 = time.perf_counter()
+        with self.lock:
+            q = {}
+            if self.watermark:
+                q = {"source.pulled_at": {"$gte": self.watermark - timedelta(seconds=IOC_INDEX_OVERLAP_SEC)}}
+            delta = IOCIndex()
+            n, wm = delta._load((col if col is not None else col_iocs).find(q, _PROJ).batch_size(10_000))
+            if n:
+                for name, table in self._merged(delta).items():
+                    setattr(self, name, table)
+            if wm is not None and (self.watermark is None or wm > self.watermark):
+                self.watermark = wm
+            self.count += n
+            self.refreshed_at = datetime.now(timezone.utc)
+        ms = int((time.perf_counter() - t0) * 1000)
+        log.info("ioc_index:refresh loaded=%d ms=%d", n, ms)
+        return {"ok": True, "mode": "incremental", "loaded": n, "duration_ms": ms}
+
+    # ---- tra cứu
+    def _cidr_hits(self, key: str) -> List[Tuple[str, Dict[str, Ref]]]:
+        n = _ipv4_int(key)
+        if n is not None:
+            table, bits = self.cidr, 32
+        else:
+            try:
+                ip = ipaddress.ip_address(key)
+            except ValueError:
+                return []
+            table, bits, n = (self.cidr, 32, int(ip)) if ip.version == 4 else (self.cidr6, 128, int(ip))
+        out = []
+        for plen, nets in table.items():
+            net = n & (((1 << plen) - 1) << (bits - plen))
+            refs = nets.get(net)
+            if refs:
+                out.append((f"{ipaddress.ip_address(net) if bits == 128 else ipaddress.IPv4Address(net)}/{plen}", refs))
+        return out
+
+    def _parent_hits(self, key: str) -> List[Tuple[str, Dict[str, Ref]]]:
+        out = []
+        i = key.find(".")
+        while i >= 0:
+            parent = key[i + 1:]
+            if "." not in parent:          # không khớp cả TLD
+                break
+            refs = self.exact.get(parent)
+            if refs:
+                out.append((parent, refs))
+            i = key.find(".", i + 1)
+        return out
+
+    def _extra_hits(self, key: str, cidr: bool, parents: bool) -> List[Tuple[str, str, Dict[str, Ref]]]:
+        """CIDR / parent domain, có lọc rẻ (octet đầu, 2 nhãn cuối) trước khi dò thật."""
+        if not key:
+            return []
+        if key[0].isdigit() or ":" in key:
+            if ":" in key and key not in self.exact:
+                # IPv6 viết khác dạng (::ffff, 0 đầu...) -> chuẩn hoá rồi thử lại exact
+                try:
+                    k6 = ipaddress.ip_address(key).compressed
+                except ValueError:
+                    k6 = None
+                if k6 and k6 in self.exact:
+                    hits = [("exact", k6, self.exact[k6])]
+                    if cidr and self.cidr6:
+                        hits += [("cidr", k, r) for k, r in self._cidr_hits(key)]
+                    return hits
+            if cidr and (self.cidr_wide or (":" in key and self.cidr6) or key[:key.find(".")] in self.cidr_octets):
+                return [("cidr", k, r) for k, r in self._cidr_hits(key)]
+            return []
+        if parents and _tail2(key) in self.tails and key.count(".") >= 2:
+            return [("parent_domain", k, r) for k, r in self._parent_hits(key)]
+        return []
+
+    def lookup(self, values: Iterable[str], cidr: bool = True, parents: bool = True,
+               to_ids_only: bool = False) -> Dict[str, List[Dict[str, Any]]]:
+        """{value: [{uuid,type,event_id,to_ids,match,key}]} — chỉ trả value có kết quả."""
+        exact, tails, octets = self.exact, self.tails, self.cidr_octets
+        check_cidr = cidr and bool(self.cidr or self.cidr6)
+        check_parents = parents and bool(self.tails)
+        wide = check_cidr and (self.cidr_wide or bool(self.cidr6))
+        # lọc 1 lượt (list comprehension): chỉ giữ value có thể khớp -> phần lớn value sạch dừng ở đây
+        values = values if isinstance(values, list) else list(values)
+        keys = [v.strip().lower() for v in values]
+        if check_cidr or check_parents:
+            cand = [
+                i for i, k in enumerate(keys)
+                if k in exact or ":" in k
+                or (check_cidr and (wide or k[:k.find(".")] in octets))
+                or (check_parents and k[k.rfind(".", 0, k.rfind(".")) + 1:] in tails)
+            ]
+        else:
+            cand = [i for i, k in enumerate(keys) if k in exact or ":" in k]
+        out: Dict[str, List[Dict[str, Any]]] = {}
+        for i in cand:
+            v, key = values[i], keys[i]
+            refs = exact.get(key)
+            hits = [("exact", key, refs)] if refs else []
+            if check_cidr or check_parents or (refs is None and ":" in key):
+                hits += self._extra_hits(key, check_cidr, check_parents)
+            if not hits:
+                continue
+            res = [
+                {"uuid": r[0], "type": r[1], "event_id": r[2], "to_ids": r[3], "match": m, "key": k}
+                for m, k, rs in hits for r in rs.values() if r[3] or not to_ids_only
+            ]
+            if res:
+                out[v] = res
+        return out
+
+    def contains(self, key: str) -> bool:
+        """Exact membership (đã chuẩn hoá) — đường nhanh cho caller tự lọc."""
+        return key in self.exact
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": IOC_INDEX_ENABLED, "iocs": self.count, "keys": len(self.exact),
+            "cidr_prefixes": sorted(self.cidr) + sorted(self.cidr6),
+            "built_at": self.built_at, "refreshed_at": self.refreshed_at, "watermark": self.watermark,
+        }
+
+
+# 1 index dùng chung cho process (API + scheduler)
+_index = IOCIndex()
+
+_build_lock = threading.Lock()
+
+def get_ioc_index() -> IOCIndex:
+    """Index dùng chung; dựng lần đầu khi được dùng (lookup đầu tiên / job rebuild)."""
+    if _index.built_at is None and IOC_INDEX_ENABLED:
+        with _build_lock:
+            if _index.built_at is None:
+                _index.rebuild()
+    return _index
+
+def ioc_index_status() -> Dict[str, Any]:
+    """Trạng thái index (không kích hoạt build)."""
+    return _index.status()
+
+def refresh_ioc_index() -> Optional[Dict[str, Any]]:
+    """Gọi sau pull/sync/import: nạp phần mới nếu index đã được dựng (chưa dựng thì để lần lookup đầu)."""
+    if not IOC_INDEX_ENABLED or _index.built_at is None:
+        return None
+    try:
+        return _index.refresh()
+    except Exception as e:
+        log.warning("ioc_index:refresh.failed err=%s", e)
+        return None
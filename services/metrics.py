@@ -0,0 +1,336 @@
+"""
+Metric in-process kiểu Prometheus cho GET /metrics (text format 0.0.4), không cần prometheus_client.
+
+- Counter / Gauge / Histogram có label; labels(...) cache child theo tuple label -> hot path chỉ là
+  1 dict lookup + cộng số dưới lock của child (cỡ vài trăm ns), để bật thường trực ở production
+- Histogram bucket cố định (giây), observe = bisect + cộng; render cộng dồn lúc scrape
+- gauge_fn: giá trị tính lúc scrape (độ sâu queue, spool, ...) -> hot path không tốn gì
+- số series / metric giới hạn METRICS_MAX_SERIES (label lạ, vd. sensor_id giả) -> gộp vào "_other"
+- MetricsMiddleware (ASGI): latency request theo router / route template / method / status
+- MongoCommandMetrics, MongoPoolMetrics: listener PyMongo (command monitoring, connection pool)
+
+Số liệu theo process: mỗi uvicorn worker có bộ đếm riêng (scrape từng worker hoặc sum theo instance).
+"""
+import os, time, threading, logging
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Tuple
+
+from pymongo import monitoring
+
+log = logging.getLogger("console.metrics")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OVERFLOW = "_other"
+
+HTTP_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5)
+STAGE_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+JOB_BUCKETS = (.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _new(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        c = self._children.get(values)         # hot path: label đã là str -> không đổi kiểu
+        if c is None:
+            key = tuple(map(str, values))
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+            with self._lock:
+                if key not in self._children and len(self._children) >= METRICS_MAX_SERIES:
+                    key = (OVERFLOW,) * len(key)
+                c = self._children.get(key)
+                if c is None:
+                    c = self._children[key] = self._new()
+        return c
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, c in self._series():
+            out.extend(c.render(self.name, self.labelnames, key))
+        return out
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, n: float = 1) -> None:
+        with self.lock:
+            self.value += n
+
+    def dec(self, n: float = 1) -> None:
+        with self.lock:
+            self.value -= n
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+    def render(self, name, names, key) -> List[str]:
+        return [f"{name}{_labels(names, key)} {_fmt(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new(self):
+        return _Value()
+
+    def inc(self, n: float = 1) -> None:
+        self.labels().inc(n)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new(self):
+        return _Value()
+
+    def set(self, v: float) -> None:
+        self.labels().set(v)
+
+
+class _Timer:
+    __slots__ = ("h", "t0")
+
+    def __init__(self, h: "_Hist"):
+        self.h = h
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.h.observe(time.perf_counter() - self.t0)
+        return False
+
+
+class _Hist:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)      # cuối = +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, v: float) -> None:
+        i = bisect_left(self.bounds, v)             # le: v <= bound
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += v
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def render(self, name, names, key) -> List[str]:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        out, acc = [], 0
+        for b, n in zip(self.bounds + (float("inf"),), counts):
+            acc += n
+            le = 'le="%s"' % _fmt(b)
+            out.append(f"{name}_bucket{_labels(names, key, le)} {acc}")
+        out.append(f"{name}_sum{_labels(names, key)} {_fmt(total)}")
+        out.append(f"{name}_count{_labels(names, key)} {acc}")
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new(self):
+        return _Hist(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self.labels().observe(v)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+
+class _FnMetric(_Metric):
+    """Giá trị lấy lúc scrape: fn() -> số (không label) hoặc {tuple label: số}."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], labels: Tuple[str, ...] = (), kind: str = "gauge"):
+        self.fn, self.kind = fn, kind
+        super().__init__(name, help, labels)
+
+    def render(self) -> List[str]:
+        try:
+            v = self.fn()
+        except Exception as e:
+            log.debug("metrics:collect.failed name=%s err=%s", self.name, e)
+            return []
+        items = v.items() if isinstance(v, dict) else [((), v)]
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        out.extend(f"{self.name}{_labels(self.labelnames, tuple(map(str, k)))} {_fmt(float(x))}" for k, x in items)
+        return out
+
+
+def gauge_fn(name: str, help: str, fn: Callable[[], Any], labels: Tuple[str, ...] = ()) -> _FnMetric:
+    return _FnMetric(name, help, fn, labels)
+
+
+def render() -> str:
+    if not METRICS_ENABLED:
+        return ""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: List[str] = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- HTTP
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency request HTTP (tới khi gửi xong response, gồm stream)",
+    ("router", "route", "method", "status"), HTTP_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Request HTTP đang xử lý")
+
+
+def _route_labels(scope) -> Tuple[str, str]:
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "none", "unmatched"              # 404: không dùng path thật làm label (vô hạn)
+    tags = getattr(route, "tags", None)
+    return (str(tags[0]) if tags else "root"), path
+
+
+class MetricsMiddleware:
+    """ASGI middleware thuần (không BaseHTTPMiddleware -> không buffer / đổi task của StreamingResponse)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = ["500"]
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = str(msg["status"])
+            await send(msg)
+
+        HTTP_IN_FLIGHT.labels().inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            HTTP_IN_FLIGHT.labels().dec()
+            router, route = _route_labels(scope)
+            HTTP_REQUEST_SECONDS.labels(router, route, scope["method"], status[0]).observe(time.perf_counter() - t0)
+
+
+# ---- MongoDB
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_duration_seconds", "Latency command MongoDB (PyMongo command monitoring)",
+    ("db", "collection", "command"), MONGO_BUCKETS)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total", "Command MongoDB lỗi", ("db", "collection", "command"))
+MONGO_POOL_CHECKOUT_SECONDS = Histogram(
+    "mongo_pool_checkout_seconds", "Thời gian chờ lấy connection từ pool", ("address",), MONGO_BUCKETS)
+MONGO_POOL_IN_USE = Gauge("mongo_pool_connections_in_use", "Connection đang checkout", ("address",))
+MONGO_POOL_CHECKOUT_FAILED = Counter(
+    "mongo_pool_checkout_failures_total", "Checkout connection lỗi (timeout / pool đóng)", ("address", "reason"))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._coll: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+
+    def started(self, event):
+        c = event.command.get(event.command_name)
+        coll = c if isinstance(c, str) else event.command.get("collection", "")
+        # dict set / pop nguyên tử dưới GIL; succeeded/failed không mang command -> nhớ collection theo request
+        self._coll[(event.connection_id, event.request_id)] = (event.database_name, coll if isinstance(coll, str) else "")
+
+    def _labels(self, event) -> Tuple[str, str, str]:
+        db, coll = self._coll.pop((event.connection_id, event.request_id), (event.database_name, ""))
+        return db, coll, event.command_name
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.labels(*self._labels(event)).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        lb = self._labels(event)
+        MONGO_COMMAND_SECONDS.labels(*lb).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(*lb).inc()
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    @staticmethod
+    def _addr(event) -> str:
+        return "%s:%s" % event.address
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_IN_USE.labels(self._addr(event)).inc()
+        if getattr(event, "duration", None) is not None:
+            MONGO_POOL_CHECKOUT_SECONDS.labels(self._addr(event)).observe(event.duration)
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_IN_USE.labels(self._addr(event)).dec()
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILED.labels(self._addr(event), event.reason).inc()
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+
+def mongo_listeners() -> list:
+    return [MongoCommandMetrics(), MongoPoolMetrics()] if METRICS_ENABLED else []
@@ -0,0 +1,133 @@
+"""
+Duyệt events / iocs: filter + projection + phân trang keyset trên (timestamp, _id) giảm dần.
+
+Cursor = base64url("<timestamp ms>:<_id hex>") của doc cuối trang trước -> trang sau dùng
+  {timestamp < ts} OR {timestamp == ts AND _id < id}
+nên không skip() và không chậm dần khi đi sâu (index (timestamp,-1),(_id,-1) + các index theo filter).
+"""
+import base64, json, re
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING
+
+BROWSE_BATCH = 1000      # batch_size cursor Mongo khi stream
+
+# field mặc định bỏ khỏi events (blob lớn); projection rõ ràng (fields=) thì không áp dụng
+EVENT_DEFAULT_EXCLUDE = {"galaxies.meta": 0}
+_FIELD_RE = re.compile(r"^[A-Za-z_][\w.]*$")
+
+
+# ---- cursor
+def encode_cursor(doc: dict) -> str:
+    ts = doc["timestamp"]
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    raw = f"{int(ts.timestamp() * 1000)}:{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ms, oid = raw.split(":", 1)
+        return datetime.fromtimestamp(int(ms) / 1000, tz=timezone.utc), ObjectId(oid)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {e}")
+
+def _after(q: dict, cursor: Optional[str]) -> dict:
+    if not cursor:
+        return q
+    ts, oid = decode_cursor(cursor)
+    keyset = {"$or": [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": oid}}]}
+    return {"$and": [q, keyset]} if q else keyset
+
+
+# ---- filters
+def _in_or_eq(values: List[Any]):
+    return values[0] if len(values) == 1 else {"$in": values}
+
+def ioc_filter(type: Optional[List[str]] = None, type_family: Optional[List[str]] = None,
+               to_ids: Optional[bool] = None, tags: Optional[List[str]] = None,
+               event_id: Optional[int] = None, value_prefix: Optional[str] = None,
+               since: Optional[datetime] = None, until: Optional[datetime] = None) -> dict:
+    q: Dict[str, Any] = {}
+    if type: q["type"] = _in_or_eq(type)
+    if type_family: q["norm.type_family"] = _in_or_eq(type_family)
+    if to_ids is not None: q["to_ids"] = to_ids
+    if tags: q["tags"] = {"$all": tags}
+    if event_id is not None: q["event_id"] = event_id
+    # regex neo đầu, phân biệt hoa thường -> Mongo dùng được index trên value
+    if value_prefix: q["value"] = {"$regex": "^" + re.escape(value_prefix)}
+    if since or until:
+        q["timestamp"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+    return q
+
+def event_filter(published: Optional[bool] = None, tags: Optional[List[str]] = None,
+                 event_id: Optional[int] = None, orgc: Optional[str] = None,
+                 info_prefix: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None) -> dict:
+    q: Dict[str, Any] = {}
+    if published is not None: q["published"] = published
+    if tags: q["tags"] = {"$all": tags}
+    if event_id is not None: q["event_id"] = event_id
+    if orgc: q["orgc"] = orgc
+    if info_prefix: q["info"] = {"$regex": "^" + re.escape(info_prefix)}
+    if since or until:
+        q["timestamp"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+    return q
+
+def projection(fields: Optional[List[str]], default_exclude: Optional[dict] = None) -> Optional[dict]:
+    """fields=["type","value"] -> {type:1, value:1, timestamp:1} (timestamp + _id luôn có để dựng cursor)."""
+    if not fields:
+        return dict(default_exclude) if default_exclude else None
+    bad = [f for f in fields if not _FIELD_RE.match(f)]
+    if bad:
+        raise ValueError(f"invalid field: {bad[0]}")
+    proj = {f: 1 for f in fields}
+    proj["timestamp"] = 1
+    return proj
+
+
+# ---- đọc
+def browse(col, q: dict, proj: Optional[dict], after: Optional[str] = None,
+           limit: Optional[int] = None) -> Iterator[dict]:
+    """Yield doc theo (timestamp desc, _id desc) sau cursor `after`; limit=None -> tới hết."""
+    cur = col.find(_after(q, after), proj).sort([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    if limit:
+        cur = cur.limit(limit)
+    return cur.batch_size(min(limit or BROWSE_BATCH, BROWSE_BATCH))
+
+def page(col, q: dict, proj: Optional[dict], after: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """1 trang + next_cursor (None nếu đã hết). Đọc limit+1 để biết còn trang sau không."""
+    docs = list(browse(col, q, proj, after, limit + 1))
+    more = len(docs) > limit
+    docs = docs[:limit]
+    nxt = encode_cursor(docs[-1]) if more and docs else None
+    for d in docs:
+        d.pop("_id", None)
+    return docs, nxt
+
+
+# ---- serialize
+def _default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    if isinstance(o, ObjectId):
+        return str(o)
+    raise TypeError(f"not serializable: {type(o).__name__}")
+
+def ndjson_lines(docs: Iterator[dict], limit: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Stream NDJSON (1 doc / dòng). Nếu dừng vì `limit`, dòng cuối là {"next_cursor": "..."}
+    để client đi tiếp; hết dữ liệu thì không có dòng đó.
+    """
+    n, last = 0, None
+    for d in docs:
+        if limit and n >= limit:
+            yield (json.dumps({"next_cursor": encode_cursor(last)}) + "\n").encode()
+            return
+        last = {"timestamp": d["timestamp"], "_id": d.pop("_id")}
+        n += 1
+        yield (json.dumps(d, default=_default, separators=(",", ":")) + "\n").encode()
@@ -0,0 +1,153 @@
+"""
+Import offline MISP feed / JSON export vào events + iocs (không cần MISP live).
+
+Nguồn hỗ trợ:
+  - thư mục feed MISP: manifest.json + <event_uuid>.json
+  - thư mục các file export *.json
+  - 1 file export: {"Event": {...}} | [{"Event": {...}}, ...] | {"response": [...]}
+
+    python -m app.services.misp_feed_importer /data/feeds/circl [--workers 8] [--force]
+"""
+import argparse, json, logging, multiprocessing, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+log = logging.getLogger("misp.feed")
+
+FEED_IMPORT_WORKERS = int(os.getenv("FEED_IMPORT_WORKERS") or os.cpu_count() or 2)
+FEED_IMPORT_BULK = int(os.getenv("FEED_IMPORT_BULK", "5000"))       # op / bulk_write
+FEED_FILES_PER_TASK = int(os.getenv("FEED_FILES_PER_TASK", "50"))   # file / task gửi cho worker
+
+
+def _load_events(path: Path) -> Iterable[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        if "Event" in data:
+            data = [data]
+        else:
+            data = data.get("response") or []
+    for e in data:
+        E = e.get("Event") if isinstance(e, dict) else None
+        if E and E.get("uuid"):
+            yield E
+
+
+def _import_files(paths: List[str], source: str) -> Dict[str, int]:
+    """Chạy trong worker process: đọc, transform (_normalize/_galaxies), upsert unordered theo chunk."""
+    from app.database.collections import col_events, col_iocs
+    from app.services.misp_service import _event_docs, _ChunkedBulk, _new_events_counter, _new_iocs_counter
+
+    now = datetime.now(timezone.utc)
+    ev_w = _ChunkedBulk(col_events, FEED_IMPORT_BULK, on_new=_new_events_counter())
+    ioc_w = _ChunkedBulk(col_iocs, FEED_IMPORT_BULK, on_new=_new_iocs_counter())
+    errors = 0
+    for p in paths:
+        try:
+            for E in _load_events(Path(p)):
+                ev_doc, iocs = _event_docs(E, now, source)
+                ev_w.add(UpdateOne({"uuid": ev_doc["uuid"]}, {"$set": ev_doc}, upsert=True), ev_doc)
+                for A in iocs:
+                    ioc_w.add(UpdateOne({"uuid": A["uuid"]}, {"$set": A}, upsert=True), A)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            errors += 1
+            log.warning("feed:file.failed path=%s err=%s", p, e)
+    ev_w.flush(); ioc_w.flush()
+    return {"files": len(paths), "events": ev_w.total, "iocs": ioc_w.total, "errors": errors}
+
+
+def _changed_feed_files(root: Path, force: bool) -> Tuple[List[str], int]:
+    """
+    Đọc manifest.json -> chỉ giữ event có timestamp manifest > timestamp đã lưu trong events.
+    Trả (list file cần import, số event bỏ qua).
+    """
+    from app.database.collections import col_events
+
+    with open(root / "manifest.json", "rb") as f:
+        manifest: Dict[str, Dict[str, Any]] = json.load(f)
+
+    stored: Dict[str, int] = {}
+    if not force:
+        uuids = list(manifest)
+        for i in range(0, len(uuids), 10_000):
+            for d in col_events.find({"uuid": {"$in": uuids[i:i + 10_000]}}, {"uuid": 1, "timestamp": 1, "_id": 0}):
+                ts = d.get("timestamp")
+                if ts is not None:
+                    stored[d["uuid"]] = int(ts.replace(tzinfo=timezone.utc).timestamp())
+
+    files, skipped = [], 0
+    for euuid, meta in manifest.items():
+        if not force and euuid in stored and stored[euuid] >= int(meta.get("timestamp") or 0):
+            skipped += 1
+            continue
+        p = root / f"{euuid}.json"
+        if p.exists():
+            files.append(str(p))
+    return files, skipped
+
+
+def import_feed(path: str, workers: Optional[int] = None, force: bool = False) -> Dict[str, Any]:
+    """
+    Import feed/export tại `path` bằng process pool (mỗi worker tự mở MongoClient).
+    Feed có manifest.json: bỏ qua event có timestamp manifest chưa đổi so với lần import trước (trừ khi force).
+    """
+    t0 = time.perf_counter()
+    root = Path(path)
+    skipped = 0
+    if root.is_dir() and (root / "manifest.json").exists():
+        files, skipped = _changed_feed_files(root, force)
+    elif root.is_dir():
+        files = sorted(str(p) for p in root.glob("*.json"))
+    elif root.is_file():
+        files = [str(root)]
+    else:
+        raise ValueError(f"feed path not found: {path}")
+
+    source = f"feed:{root.resolve()}"
+    tasks = [files[i:i + FEED_FILES_PER_TASK] for i in range(0, len(files), FEED_FILES_PER_TASK)]
+    totals = {"files": 0, "events": 0, "iocs": 0, "errors": 0}
+    workers = max(min(workers or FEED_IMPORT_WORKERS, len(tasks)), 1)
+
+    if len(tasks) <= 1:
+        results = [_import_files(t, source) for t in tasks]
+    else:
+        # spawn: MongoClient không fork-safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+            results = list(ex.map(_import_files, tasks, [source] * len(tasks)))
+    for r in results:
+        for k in totals:
+            totals[k] += r[k]
+
+    if totals["iocs"]:
+        from app.services.ioc_index import refresh_ioc_index
+        refresh_ioc_index()
+
+    secs = time.perf_counter() - t0
+    log.info("feed:done path=%s files=%d ev=%d ioc=%d skipped=%d s=%.1f",
+             path, totals["files"], totals["events"], totals["iocs"], skipped, secs)
+    return {
+        "ok": True, "path": str(root), "workers": workers,
+        "files_imported": totals["files"], "events_upserted": totals["events"],
+        "iocs_upserted": totals["iocs"], "events_skipped_unchanged": skipped,
+        "file_errors": totals["errors"], "duration_ms": int(secs * 1000),
+        "iocs_per_sec": round(totals["iocs"] / secs, 1) if secs else 0.0,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Import MISP feed directory / JSON export")
+    ap.add_argument("path")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--force", action="store_true", help="import lại kể cả event không đổi")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(import_feed(args.path, workers=args.workers, force=args.force), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,40 @@
 #!/usr/bin/env python3
 from __future__ import annotations
-import os, re, time, logging
-from typing import Tuple, Dict, Any, List, Optional
+import os, re, time, logging, threading
+from typing import Tuple, Dict, Any, List, Optional, Callable
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 import urllib3, warnings
 from pymongo.database import Database
 from pymongo import UpdateOne
 from dateutil.parser import isoparse
 from pymisp import PyMISP
+from app.database.collections import write_concern_for
+from app.services.misp_stats import bump, ioc_delta, get_stats
+from app.services.ioc_index import refresh_ioc_index
+from app.services.retro_hunt import submit_after_pull
+from app.services.metrics import Counter, Histogram, JOB_BUCKETS
 
 log = logging.getLogger("misp.service")
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 warnings.filterwarnings("ignore", category=FutureWarning, module="pymisp")
 log.setLevel(os.getenv("MISP_LOG_LEVEL", "INFO").upper())
 
+MISP_PAGE_SIZE = int(os.getenv("MISP_PAGE_SIZE", "100"))      # event / trang search
+MISP_PREFETCH = int(os.getenv("MISP_PREFETCH", "2"))          # số trang fetch song song
+MISP_BULK_CHUNK = int(os.getenv("MISP_BULK_CHUNK", "1000"))   # op / bulk_write
+MISP_TAG_CONCURRENCY = int(os.getenv("MISP_TAG_CONCURRENCY", "8"))  # số request tag song song
+MISP_TAG_RETRIES = int(os.getenv("MISP_TAG_RETRIES", "3"))          # số lần thử / event
+MISP_TAG_BACKOFF = float(os.getenv("MISP_TAG_BACKOFF", "0.5"))      # giây, nhân đôi mỗi lần thử
+MISP_SYNC_INITIAL = os.getenv("MISP_SYNC_INITIAL", "30d")      # cửa sổ lần sync đầu (chưa có watermark)
+MISP_SYNC_TAG = os.getenv("MISP_SYNC_TAG", "false").lower() == "true"   # sync có tag console:imported không
+MISP_SYNC_INTERVAL_MIN = int(os.getenv("MISP_SYNC_INTERVAL_MIN", "0"))  # 0 = tắt job định kỳ
+
+MISP_STAGE_SECONDS = Histogram("misp_stage_seconds", "Thời gian từng bước pull/sync MISP (page = 1 search)",
+                               ("op", "stage"), JOB_BUCKETS)
+MISP_UPSERTS = Counter("misp_upserts_total", "Event / IOC upsert từ MISP", ("op", "kind"))
+
 # ---------- small helpers ----------
 def _to_dt(x) -> datetime:
     if isinstance(x, (int, float)): return datetime.fromtimestamp(int(x), tz=timezone.utc)
@@ -62,18 +83,110 @@ def _galaxies(E: dict) -> List[dict]:
             out.append(item)
     return out
 
+def _id_of(obj: dict) -> int:
+    # feed MISP (manifest + <uuid>.json) không có "id" -> id ổn định 48-bit suy ra từ uuid
+    return int(obj["id"]) if obj.get("id") else int(obj["uuid"].replace("-", "")[:12], 16)
+
+# ---- transform 1 event MISP -> (event doc, [ioc docs]); dùng chung cho pull/sync/import feed
+def _event_docs(E: dict, now: datetime, source_url: str) -> Tuple[dict, List[dict]]:
+    eid = _id_of(E)
+    ev_doc = {
+        "event_id": eid, "uuid": E["uuid"], "info": E.get("info"),
+        "orgc": (E.get("Orgc") or {}).get("name"), "org": (E.get("Org") or {}).get("name"),
+        "published": bool(E.get("published",False)),
+        "attribute_count": int(E.get("attribute_count", len(E.get("Attribute",[])))),
+        "timestamp": _to_dt(int(E["timestamp"])), "tags": [t["name"] for t in E.get("Tag", []) or []],
+        "galaxies": _galaxies(E),
+        "source": {"misp_url": source_url, "pulled_at": now}
+    }
+    iocs = [_attr_doc(a, eid, E["uuid"], now, source_url) for a in E.get("Attribute", []) or []]
+    return ev_doc, iocs
+
+def _attr_doc(a: dict, event_id: int, event_uuid: str, now: datetime, source_url: str) -> dict:
+    A = {
+        "attr_id": _id_of(a), "uuid": a["uuid"],
+        "event_id": event_id, "event_uuid": event_uuid,
+        "category": a.get("category"), "type": a.get("type"), "value": a.get("value"),
+        "to_ids": bool(int(a.get("to_ids","0"))),
+        "timestamp": _to_dt(int(a["timestamp"])),
+        "tags": [t["name"] for t in a.get("Tag", []) or []],
+        "norm": _normalize(a.get("type"), a.get("value")),
+        "source": {"misp_url": source_url, "pulled_at": now},
+    }
+    left,right=_split_pipe(a.get("value",""))
+    if left or right: A["value_parts"]={"left":left,"right":right}
+    return A
+
+class _ChunkedBulk:
+    """
+    Gom UpdateOne và bulk_write(ordered=False) mỗi `size` op -> bộ nhớ không phụ thuộc tổng số op.
+    on_new(docs): gọi sau mỗi flush với các doc được upsert MỚI (không tính update) -> bộ đếm stats.
+    """
+    def __init__(self, col, size: int, on_new: Optional[Callable[[List[dict]], None]] = None):
+        self.col, self.size = col, max(size, 1)
+        self.ops: List[UpdateOne] = []
+        self.docs: List[dict] = []
+        self.on_new = on_new
+        self.total = self.flushes = self.inserted = 0
+
+    def add(self, op: UpdateOne, doc: Optional[dict] = None):
+        self.ops.append(op)
+        if self.on_new: self.docs.append(doc)
+        if len(self.ops) >= self.size: self.flush()
+
+    def flush(self):
+        if not self.ops: return
+        res = self.col.bulk_write(self.ops, ordered=False)
+        self.total += len(self.ops); self.flushes += 1
+        new = res.upserted_ids or {}
+        self.inserted += len(new)
+        if self.on_new and new:
+            self.on_new([self.docs[i] for i in new])
+        self.ops = []; self.docs = []
+
+def _new_events_counter(db=None) -> Callable[[List[dict]], None]:
+    return lambda docs: bump({"events": len(docs)}, max(d["timestamp"] for d in docs), db=db)
+
+def _new_iocs_counter(db=None) -> Callable[[List[dict]], None]:
+    return lambda docs: bump(ioc_delta(docs), db=db)
+
 # ---------- service ----------
+# 1 instance dùng chung cho cả process (API + scheduler): giữ PyMISP client và HTTP session.
+# Index được tạo 1 lần lúc khởi động (database.collections.ensure_indexes), không ở __init__.
+_shared: Optional["MISPService"] = None
+_shared_lock = threading.Lock()
+
+def get_misp_service() -> "MISPService":
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                from app.database.mongo import db_ioc
+                _shared = MISPService(db_ioc)
+    return _shared
+
 class MISPService:
-    def __init__(self, db_ioc: Database):
+    def __init__(self, db_ioc: Database, hooks: Optional[bool] = None):
         self.db = db_ioc
+        # hook sau ingest (refresh ioc_index, retro-hunt) đọc/ghi collection toàn cục misp_ioc / sec_events
+        # -> mặc định chỉ bật khi db chính là DB của app; benchmark / db khác: tắt
+        if hooks is None:
+            from app.database.mongo import db_ioc as app_db
+            hooks = db_ioc == app_db
+        self.hooks = hooks
         self.url = (os.getenv("MISP_URL") or "http://127.0.0.1").rstrip("/")
         self.verify = (os.getenv("MISP_VERIFY_SSL", "false").lower() == "true")
         self.key = os.getenv("MISP_KEY")
         self.imported_tag = os.getenv("MISP_IMPORTED_TAG", "console:imported")
-        self.col_events = self.db["events"]
-        self.col_iocs = self.db["iocs"]
+        # db có thể khác misp_ioc (benchmark) -> áp durability profile tại đây thay vì dùng col_* dựng sẵn
+        misp_wc, jobs_wc = write_concern_for("misp"), write_concern_for("jobs")
+        self.col_events = self.db["events"].with_options(write_concern=misp_wc)
+        self.col_iocs = self.db["iocs"].with_options(write_concern=misp_wc)
+        self.col_state = self.db["sync_state"].with_options(write_concern=jobs_wc)
+        self.col_tag_failures = self.db["tag_failures"].with_options(write_concern=jobs_wc)
+        self._state_id = f"misp:{self.url}"
         self._misp = None
-        self._ensure_indexes()
+        self._session = None
 
     def _client(self):
         if not self.key: raise RuntimeError("MISP_KEY is not set")
@@ -82,86 +195,244 @@ class MISPService:
             self._misp = PyMISP(self.url, self.key, ssl=self.verify, timeout=30)    
         return self._misp
 
-    def _ensure_indexes(self):
-        self.col_events.create_index("uuid", unique=True)
-        self.col_events.create_index([("published",1),("timestamp",-1)])
-        self.col_events.create_index([("tags",1)])
-        self.col_iocs.create_index("uuid", unique=True)
-        self.col_iocs.create_index([("type",1),("value",1)])
-        self.col_iocs.create_index("event_uuid")
-        self.col_iocs.create_index([("to_ids",1),("timestamp",-1)])
-        self.col_iocs.create_index("norm.host")
-        self.col_iocs.create_index("norm.ip")
+    # ---- đọc search theo trang (limit/page), prefetch tối đa `depth` trang song song
+    # controller=attributes trả {"Attribute": [...]} -> lấy list theo key
+    def _iter_pages(self, misp, flt: dict, page_size: int, depth: int, rid: str, key: Optional[str] = None):
+        def fetch(page: int) -> List[dict]:
+            t = time.perf_counter()
+            res = misp.search(**flt, limit=page_size, page=page)
+            if isinstance(res, dict) and res.get("errors"):
+                raise RuntimeError(f"misp search error: {res['errors']}")
+            if key and isinstance(res, dict): res = res.get(key) or []
+            dt = time.perf_counter() - t
+            MISP_STAGE_SECONDS.labels(flt.get("controller", "events"), "page").observe(dt)
+            log.info("pull:page rid=%s page=%d count=%d ms=%d", rid, page, len(res), int(dt * 1000))
+            return res
+
+        depth = max(depth, 1)
+        with ThreadPoolExecutor(max_workers=depth) as ex:
+            inflight = deque(ex.submit(fetch, p) for p in range(1, depth + 1))
+            next_page = depth + 1
+            while inflight:
+                events = inflight.popleft().result()
+                if len(events) < page_size:
+                    # trang cuối -> bỏ các trang prefetch phía sau
+                    for f in inflight: f.cancel()
+                    if events: yield events
+                    return
+                yield events
+                inflight.append(ex.submit(fetch, next_page)); next_page += 1
+
+    # ---- đọc + ghi các event khớp flt; trả thống kê + watermark lớn nhất đã thấy
+    def _ingest_events(self, misp, flt: dict, now: datetime, rid: str,
+                       page_size: int, prefetch: int, collect_tag: bool) -> dict:
+        ev_writer = _ChunkedBulk(self.col_events, MISP_BULK_CHUNK, on_new=_new_events_counter(self.db))
+        ioc_writer = _ChunkedBulk(self.col_iocs, MISP_BULK_CHUNK, on_new=_new_iocs_counter(self.db))
+        to_tag: List[str] = []   # chỉ giữ uuid; tag sau khi đọc hết trang (tag giữa chừng làm lệch page khi lọc !imported)
+        pages = max_ev = max_attr = 0
+
+        for events in self._iter_pages(misp, flt, page_size, prefetch, rid):
+            pages += 1
+            for e in events:
+                E = e["Event"]
+                ev_doc, iocs = _event_docs(E, now, self.url)
+                max_ev = max(max_ev, int(E["timestamp"]))
+                ev_writer.add(UpdateOne({"uuid": ev_doc["uuid"]}, {"$set": ev_doc}, upsert=True), ev_doc)
+                for A in iocs:
+                    max_attr = max(max_attr, int(A["timestamp"].timestamp()))
+                    ioc_writer.add(UpdateOne({"uuid": A["uuid"]}, {"$set": A}, upsert=True), A)
+                if collect_tag and self.imported_tag and self.imported_tag not in ev_doc["tags"]:
+                    to_tag.append(E["uuid"])
+        ev_writer.flush(); ioc_writer.flush()
+        log.info("pull:write rid=%s pages=%d ev=%d ioc=%d flushes=%d", rid, pages,
+                 ev_writer.total, ioc_writer.total, ev_writer.flushes + ioc_writer.flushes)
+        return {"events": ev_writer.total, "iocs": ioc_writer.total, "pages": pages,
+                "max_event_ts": max_ev, "max_attr_ts": max_attr, "to_tag": to_tag}
+
+    # ---- đọc + ghi attribute thay đổi (controller=attributes) — bắt được sửa attribute lẻ
+    def _ingest_attributes(self, misp, flt: dict, now: datetime, rid: str,
+                           page_size: int, prefetch: int) -> dict:
+        ioc_writer = _ChunkedBulk(self.col_iocs, MISP_BULK_CHUNK, on_new=_new_iocs_counter(self.db))
+        pages = max_attr = 0
+        for attrs in self._iter_pages(misp, flt, page_size, prefetch, rid, key="Attribute"):
+            pages += 1
+            for a in attrs:
+                ev = a.get("Event") or {}
+                A = _attr_doc(a, int(a.get("event_id") or ev.get("id")), ev.get("uuid") or a.get("event_uuid"), now, self.url)
+                max_attr = max(max_attr, int(a["timestamp"]))
+                ioc_writer.add(UpdateOne({"uuid": A["uuid"]}, {"$set": A}, upsert=True), A)
+        ioc_writer.flush()
+        return {"iocs": ioc_writer.total, "pages": pages, "max_attr_ts": max_attr}
+
+    # ---- tag imported: song song (MISP_TAG_CONCURRENCY) trên session pool, retry + backoff từng event
+    def _tag_imported(self, uuids: List[str], rid: str) -> dict:
+        """
+        Tag console:imported cho list event uuid. Lỗi của 1 event không dừng các event khác;
+        event lỗi (sau MISP_TAG_RETRIES lần) được ghi vào tag_failures để retry_failed_tags() chạy lại.
+        """
+        t = time.perf_counter()
+        ok: List[str] = []; failed: Dict[str, str] = {}
+        if uuids:
+            with ThreadPoolExecutor(max_workers=max(MISP_TAG_CONCURRENCY, 1)) as ex:
+                for euuid, err in zip(uuids, ex.map(self._attach_tag_retry, uuids)):
+                    if err: failed[euuid] = err
+                    else: ok.append(euuid)
+            self._record_tag_results(ok, failed)
+        ms = int((time.perf_counter()-t)*1000)
+        MISP_STAGE_SECONDS.labels("tag", "tag").observe(ms / 1000)
+        if failed:
+            log.warning("pull:tagging.failed rid=%s failed=%d first_err=%s", rid, len(failed), next(iter(failed.values())))
+        return {"tagged": len(ok), "failed": len(failed), "ms": ms,
+                "per_sec": round(len(ok) / (ms / 1000), 1) if ms else float(len(ok))}
+
+    def _http(self):
+        # session dùng chung, pool = số luồng tag -> tái sử dụng kết nối keep-alive
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(MISP_TAG_CONCURRENCY, 1))
+            sess.mount("https://", adapter); sess.mount("http://", adapter)
+            sess.headers.update({"Authorization": self.key or "", "Accept": "application/json",
+                                 "Content-Type": "application/json"})
+            sess.verify = self.verify if self.url.startswith("https://") else False
+            self._session = sess
+        return self._session
+
+    def _attach_tag(self, event_uuid: str, tag: str, local: bool = True) -> None:
+        r = self._http().post(f"{self.url}/tags/attachTagToObject",
+                              json={"uuid": event_uuid, "tag": tag, "local": local}, timeout=30)
+        if r.status_code != 200:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        body = r.json() if r.content else {}
+        if isinstance(body, dict) and body.get("errors"):
+            raise RuntimeError(str(body["errors"])[:200])
+
+    def _attach_tag_retry(self, event_uuid: str) -> Optional[str]:
+        """None nếu ok, ngược lại là lỗi cuối cùng."""
+        err = None
+        for attempt in range(max(MISP_TAG_RETRIES, 1)):
+            if attempt: time.sleep(MISP_TAG_BACKOFF * (2 ** (attempt - 1)))
+            try:
+                self._attach_tag(event_uuid, self.imported_tag, local=True)
+                return None
+            except Exception as e:
+                err = str(e)
+        return err
+
+    def _record_tag_results(self, ok: List[str], failed: Dict[str, str]) -> None:
+        now = datetime.now(timezone.utc)
+        if ok:
+            self.col_events.update_many({"uuid": {"$in": ok}}, {"$addToSet": {"tags": self.imported_tag}})
+            self.col_tag_failures.delete_many({"_id": {"$in": ok}})
+        if failed:
+            self.col_tag_failures.bulk_write([
+                UpdateOne({"_id": u}, {"$set": {"tag": self.imported_tag, "error": err, "last_attempt_at": now},
+                                       "$inc": {"attempts": 1}}, upsert=True)
+                for u, err in failed.items()
+            ], ordered=False)
+
+    def retry_failed_tags(self, request_id: Optional[str] = None, limit: int = 10000) -> dict:
+        """Chạy lại các event tag lỗi từ những lần pull/sync trước."""
+        uuids = [d["_id"] for d in self.col_tag_failures.find({"tag": self.imported_tag}, {"_id": 1}).limit(limit)]
+        res = self._tag_imported(uuids, request_id or "-")
+        return {"ok": True, "pending": len(uuids), **res}
 
     # ---- MAIN pull (default 24h, exclude_imported=True)
     def pull(self, since: str = "24h", published: Optional[bool] = None,
-             exclude_imported: bool = True, request_id: Optional[str] = None) -> dict:
+             exclude_imported: bool = True, request_id: Optional[str] = None,
+             page_size: Optional[int] = None, prefetch: Optional[int] = None) -> dict:
+        """
+        Pull theo trang: mỗi trang transform rồi flush bulk_write theo chunk MISP_BULK_CHUNK,
+        peak memory ~ page_size * prefetch thay vì toàn bộ kết quả search.
+        """
         rid = request_id or "-"
+        page_size = page_size or MISP_PAGE_SIZE
+        prefetch = prefetch or MISP_PREFETCH
         t0 = time.perf_counter(); now = datetime.now(timezone.utc)
         last = _since_to_dt(since, now).strftime("%Y-%m-%d %H:%M:%S")
         flt = {"controller":"events","last":last,"published":published}
         if exclude_imported and self.imported_tag: flt["tags"]=[f"!{self.imported_tag}"]
 
         misp = self._client()
-        t1=time.perf_counter(); events = misp.search(**flt)
-        log.info("pull:search rid=%s count=%d ms=%d", rid, len(events), int((time.perf_counter()-t1)*1000))
-
-        ev_ops: List[UpdateOne]=[]; ioc_ops: List[UpdateOne]=[]
-        for e in events:
-            E=e["Event"]; ts=_to_dt(int(E["timestamp"]))
-            ev_doc = {
-                "event_id": int(E["id"]), "uuid": E["uuid"], "info": E.get("info"),
-                "orgc": E.get("Orgc",{}).get("name"), "org": E.get("Org",{}).get("name"),
-                "published": bool(E.get("published",False)),
-                "attribute_count": int(E.get("attribute_count", len(E.get("Attribute",[])))),
-                "timestamp": ts, "tags": [t["name"] for t in E.get("Tag", [])],
-                "galaxies": _galaxies(E),
-                "source": {"misp_url": self.url, "pulled_at": now}
-            }
-            ev_ops.append(UpdateOne({"uuid": ev_doc["uuid"]}, {"$set": ev_doc}, upsert=True))
-
-            for a in E.get("Attribute", []) or []:
-                A = {
-                    "attr_id": int(a["id"]), "uuid": a["uuid"],
-                    "event_id": int(E["id"]), "event_uuid": E["uuid"],
-                    "category": a.get("category"), "type": a.get("type"), "value": a.get("value"),
-                    "to_ids": bool(int(a.get("to_ids","0"))),
-                    "timestamp": _to_dt(int(a["timestamp"])),
-                    "tags": [t["name"] for t in a.get("Tag", [])],
-                    "norm": _normalize(a.get("type"), a.get("value")),
-                    "source": {"misp_url": self.url, "pulled_at": now},
-                }
-                left,right=_split_pipe(a.get("value","")); 
-                if left or right: A["value_parts"]={"left":left,"right":right}
-                ioc_ops.append(UpdateOne({"uuid": A["uuid"]}, {"$set": A}, upsert=True))
-
-        if ev_ops: self.col_events.bulk_write(ev_ops, ordered=False)
-        if ioc_ops: self.col_iocs.bulk_write(ioc_ops, ordered=False)
+        st = self._ingest_events(misp, flt, now, rid, page_size, prefetch, collect_tag=True)
+
+        if st["iocs"] and self.hooks:
+            refresh_ioc_index()                 # index lookup trong RAM nạp phần mới
+            submit_after_pull(now)              # retro-hunt IOC mới trên alert cũ (chạy nền)
 
         # tag imported để lần sau tránh trùng
-        tagged=0
-        if self.imported_tag and events:
-            try:
-                for e in events:
-                    euuid=e["Event"]["uuid"]
-                    if not any(t.get("name")==self.imported_tag for t in e["Event"].get("Tag",[]) or []):
-                        misp.tag(euuid, self.imported_tag, local=True); tagged += 1
-            except Exception as te:
-                log.warning("pull:tagging.failed rid=%s err=%s", rid, te)
+        tg = self._tag_imported(st["to_tag"], rid)
 
         dur = int((time.perf_counter()-t0)*1000)
-        log.info("pull:done rid=%s ev=%d ioc=%d tagged=%d ms=%d", rid, len(ev_ops), len(ioc_ops), tagged, dur)
-        return {"ok": True, "since": since, "events_upserted": len(ev_ops), "iocs_upserted": len(ioc_ops),
-                "events_tagged": tagged, "duration_ms": dur, "pulled_at": now.isoformat()}
+        MISP_STAGE_SECONDS.labels("pull", "total").observe(dur / 1000)
+        MISP_UPSERTS.labels("pull", "events").inc(st["events"]); MISP_UPSERTS.labels("pull", "iocs").inc(st["iocs"])
+        log.info("pull:done rid=%s ev=%d ioc=%d tagged=%d tag_failed=%d tag_ms=%d ms=%d",
+                 rid, st["events"], st["iocs"], tg["tagged"], tg["failed"], tg["ms"], dur)
+        return {"ok": True, "since": since, "events_upserted": st["events"], "iocs_upserted": st["iocs"],
+                "events_tagged": tg["tagged"], "tag_failed": tg["failed"], "tag_ms": tg["ms"], "tag_per_sec": tg["per_sec"],
+                "pages": st["pages"], "duration_ms": dur, "pulled_at": now.isoformat()}
 
-    # ---- simple readers for dashboard
-    def stats(self) -> dict:
-        return {
-            "events": self.col_events.estimated_document_count(),
-            "iocs": self.col_iocs.estimated_document_count(),
-            "iocs_to_ids": self.col_iocs.count_documents({"to_ids": True}),
-            "last_event_ts": next(self.col_events.find().sort("timestamp",-1).limit(1), {}).get("timestamp")
+    # ---- incremental sync theo watermark (timestamp event/attribute lớn nhất đã thấy)
+    def sync_state(self) -> dict:
+        doc = self.col_state.find_one({"_id": self._state_id}) or {}
+        doc.pop("_id", None)
+        return doc
+
+    def sync(self, request_id: Optional[str] = None, tag_imported: Optional[bool] = None,
+             page_size: Optional[int] = None, prefetch: Optional[int] = None) -> dict:
+        """
+        Chỉ lấy những gì thay đổi kể từ watermark lưu trong sync_state:
+        - events có timestamp >= event_ts  (controller=events)
+        - attributes có timestamp >= attr_ts (controller=attributes) — attribute sửa lẻ
+        Lần đầu (chưa có watermark) dùng MISP_SYNC_INITIAL (vd. "30d").
+        Không cần tag console:imported (tag_imported mặc định theo MISP_SYNC_TAG).
+        """
+        rid = request_id or "-"
+        page_size = page_size or MISP_PAGE_SIZE
+        prefetch = prefetch or MISP_PREFETCH
+        tag_imported = MISP_SYNC_TAG if tag_imported is None else tag_imported
+        t0 = time.perf_counter(); now = datetime.now(timezone.utc)
+
+        state = self.sync_state()
+        initial = int(_since_to_dt(MISP_SYNC_INITIAL, now).timestamp())
+        ev_ts = int(state.get("event_ts") or initial)
+        attr_ts = int(state.get("attr_ts") or initial)
+
+        misp = self._client()
+        ev = self._ingest_events(misp, {"controller": "events", "timestamp": ev_ts}, now, rid,
+                                 page_size, prefetch, collect_tag=tag_imported)
+        at = self._ingest_attributes(misp, {"controller": "attributes", "timestamp": attr_ts}, now, rid,
+                                     page_size * 10, prefetch)
+        if (ev["iocs"] or at["iocs"]) and self.hooks:
+            refresh_ioc_index()
+            submit_after_pull(now)
+        tg = self._tag_imported(ev["to_tag"], rid) if tag_imported else {"tagged": 0, "failed": 0}
+        tagged = tg["tagged"]
+
+        # timestamp MISP tính theo giây và filter là >= -> giữ nguyên max (upsert idempotent)
+        new_state = {
+            "event_ts": max(ev_ts, ev["max_event_ts"]),
+            "attr_ts": max(attr_ts, ev["max_attr_ts"], at["max_attr_ts"]),
+            "misp_url": self.url,
+            "last_sync_at": now,
+            "last_sync_counts": {"events": ev["events"], "iocs": ev["iocs"] + at["iocs"]},
         }
+        self.col_state.update_one({"_id": self._state_id}, {"$set": new_state}, upsert=True)
+
+        dur = int((time.perf_counter()-t0)*1000)
+        MISP_STAGE_SECONDS.labels("sync", "total").observe(dur / 1000)
+        MISP_UPSERTS.labels("sync", "events").inc(ev["events"]); MISP_UPSERTS.labels("sync", "iocs").inc(ev["iocs"] + at["iocs"])
+        log.info("sync:done rid=%s ev=%d ioc=%d attr=%d tagged=%d ms=%d", rid, ev["events"], ev["iocs"], at["iocs"], tagged, dur)
+        return {"ok": True, "from": {"event_ts": ev_ts, "attr_ts": attr_ts},
+                "to": {"event_ts": new_state["event_ts"], "attr_ts": new_state["attr_ts"]},
+                "events_upserted": ev["events"], "iocs_upserted": ev["iocs"], "attributes_upserted": at["iocs"],
+                "events_tagged": tagged, "tag_failed": tg["failed"], "duration_ms": dur, "synced_at": now.isoformat()}
+
+    # ---- simple readers for dashboard
+    def stats(self, fresh: bool = False) -> dict:
+        # bộ đếm tăng dần + cache TTL (misp_stats), không count_documents mỗi request
+        return get_stats(fresh=fresh)
 
     def query_events(self, q: dict, limit: int = 50) -> List[dict]:
         return list(self.col_events.find(q).sort("timestamp",-1).limit(limit))
@@ -0,0 +1,124 @@
+"""
+Bộ đếm dashboard MISP (events, iocs, to_ids, theo type_family, converted) lưu ở 1 doc counters
+{_id: "misp_stats"}, cập nhật tăng dần ($inc) khi pull/sync/import/convert thay vì count mỗi request.
+
+- get_stats(): đọc doc counters qua cache TTL trong process (STATS_CACHE_TTL giây)
+- reconcile(): đếm lại toàn bộ bằng aggregate -> sửa drift (job định kỳ STATS_RECONCILE_MIN phút)
+
+Drift có thể xảy ra khi doc đã tồn tại bị sửa (to_ids/type đổi) hoặc xoá ngoài luồng pull -> reconcile sửa.
+"""
+import os, threading, time, logging
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterable, Optional
+
+from app.database.collections import col_counters, col_events, col_iocs
+
+log = logging.getLogger("misp.stats")
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "10"))           # giây
+STATS_RECONCILE_MIN = int(os.getenv("STATS_RECONCILE_MIN", "60"))     # 0 = tắt job định kỳ
+CONVERTED_TAG = os.getenv("CONVERTED_TAG") or "console:converted"
+
+STATS_ID = "misp_stats"
+FAMILIES = ("file", "network", "email", "other")
+
+_cache: Dict[str, Any] = {"at": 0.0, "doc": None}
+_cache_lock = threading.Lock()
+
+
+def _invalidate() -> None:
+    _cache["at"] = 0.0
+
+
+def ioc_delta(docs: Iterable[dict]) -> Dict[str, int]:
+    """ioc doc MỚI (vừa upsert) -> delta {iocs, iocs_to_ids, by_family.<fam>}."""
+    d: Dict[str, int] = {}
+    for A in docs:
+        d["iocs"] = d.get("iocs", 0) + 1
+        if A.get("to_ids"):
+            d["iocs_to_ids"] = d.get("iocs_to_ids", 0) + 1
+        fam = (A.get("norm") or {}).get("type_family") or "other"
+        k = f"by_family.{fam}"
+        d[k] = d.get(k, 0) + 1
+    return d
+
+
+def bump(delta: Dict[str, int], last_event_ts: Optional[datetime] = None, db=None) -> None:
+    """Cộng delta vào doc counters (1 lệnh update). db: Database khác misp_ioc (vd. benchmark)."""
+    inc = {k: v for k, v in delta.items() if v}
+    if not inc and last_event_ts is None:
+        return
+    upd: Dict[str, Any] = {"$set": {"updated_at": datetime.now(timezone.utc)}}
+    if inc:
+        upd["$inc"] = inc
+    if last_event_ts is not None:
+        upd["$max"] = {"last_event_ts": last_event_ts}
+    try:
+        col = db["counters"] if db is not None else col_counters
+        col.update_one({"_id": STATS_ID}, upd, upsert=True)
+    except Exception as e:
+        # counters chỉ phục vụ dashboard: không làm hỏng pull/convert, reconcile sẽ sửa
+        log.warning("stats:bump.failed err=%s", e)
+    _invalidate()
+
+
+def reconcile() -> Dict[str, Any]:
+    """Đếm lại toàn bộ và ghi đè doc counters; trả về drift so với giá trị cũ."""
+    t0 = time.perf_counter()
+    by_family = {f: 0 for f in FAMILIES}
+    iocs = to_ids = 0
+    for g in col_iocs.aggregate([
+        {"$group": {"_id": "$norm.type_family", "n": {"$sum": 1},
+                    "to_ids": {"$sum": {"$cond": ["$to_ids", 1, 0]}}}},
+    ]):
+        by_family[g["_id"] or "other"] = by_family.get(g["_id"] or "other", 0) + g["n"]
+        iocs += g["n"]; to_ids += g["to_ids"]
+    last = next(col_events.find({}, {"timestamp": 1, "_id": 0}).sort("timestamp", -1).limit(1), {})
+    now = datetime.now(timezone.utc)
+    fresh = {
+        "events": col_events.count_documents({}),
+        "iocs": iocs, "iocs_to_ids": to_ids, "by_family": by_family,
+        "converted": col_iocs.count_documents({"tags": CONVERTED_TAG}),
+        "updated_at": now, "reconciled_at": now,
+    }
+    if last.get("timestamp"):
+        fresh["last_event_ts"] = last["timestamp"]     # không ghi null -> $max ở bump() luôn so sánh được
+    old = col_counters.find_one({"_id": STATS_ID}) or {}
+    col_counters.replace_one({"_id": STATS_ID}, fresh, upsert=True)
+    _invalidate()
+
+    drift = {k: fresh[k] - int(old.get(k) or 0) for k in ("events", "iocs", "iocs_to_ids", "converted")}
+    drift.update({f"by_family.{f}": n - int((old.get("by_family") or {}).get(f) or 0) for f, n in by_family.items()})
+    drift = {k: v for k, v in drift.items() if v}
+    ms = int((time.perf_counter() - t0) * 1000)
+    log.info("stats:reconcile ms=%d drift=%s", ms, drift or "{}")
+    return {"ok": True, "duration_ms": ms, "drift": drift}
+
+
+def get_stats(fresh: bool = False) -> Dict[str, Any]:
+    """Stats dashboard từ doc counters (cache STATS_CACHE_TTL giây). Chưa có doc -> reconcile lần đầu."""
+    now = time.monotonic()
+    if not fresh and _cache["doc"] is not None and now - _cache["at"] < STATS_CACHE_TTL:
+        return _cache["doc"]
+    with _cache_lock:
+        if not fresh and _cache["doc"] is not None and time.monotonic() - _cache["at"] < STATS_CACHE_TTL:
+            return _cache["doc"]
+        doc = col_counters.find_one({"_id": STATS_ID})
+        if doc is None:
+            reconcile()
+            doc = col_counters.find_one({"_id": STATS_ID}) or {}
+        doc.pop("_id", None)
+        by_family = {f: 0 for f in FAMILIES}
+        by_family.update(doc.get("by_family") or {})
+        out = {
+            "events": int(doc.get("events") or 0),
+            "iocs": int(doc.get("iocs") or 0),
+            "iocs_to_ids": int(doc.get("iocs_to_ids") or 0),
+            "iocs_by_family": by_family,
+            "iocs_converted": int(doc.get("converted") or 0),
+            "last_event_ts": doc.get("last_event_ts"),
+            "updated_at": doc.get("updated_at"),
+            "reconciled_at": doc.get("reconciled_at"),
+        }
+        _cache.update(at=time.monotonic(), doc=out)
+        return out
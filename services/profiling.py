@@ -0,0 +1,273 @@
+"""
+Profile theo yêu cầu của admin (không tốn gì khi không bật):
+
+- arm(path, mode, count): `count` request kế tiếp tới path đó (vd. /api/v1/misp/pull) được profile
+  bởi ProfilingMiddleware; hết lượt / hết hạn / disarm -> gỡ. Không path nào arm -> middleware chỉ
+  kiểm tra 1 dict rỗng rồi chuyển thẳng request.
+    mode=sample   : thread sampler đọc stack mọi thread đang bận mỗi PROFILE_INTERVAL_MS (wall clock, gồm
+                    cả chờ Mongo / MISP; endpoint `def` chạy trên threadpool vẫn thấy). Request khác chạy
+                    song song cũng lọt vào mẫu -> stack ghi kèm tên thread.
+    mode=cprofile : cProfile (deterministic) trên thread event loop -> chính xác với endpoint `async def`
+                    (vd. /rules/convert); endpoint `def` chỉ thấy phần chờ threadpool -> dùng sample.
+- sample_process(seconds): sampling toàn process (mọi thread, bỏ thread đang rảnh) trong 1 cửa sổ thời gian.
+
+Report giữ PROFILE_KEEP bản gần nhất trong RAM; PROFILE_DIR đặt -> ghi thêm file <id>.txt / <id>.collapsed
+(collapsed stack: dùng được với flamegraph.pl / speedscope).
+"""
+import os, io, sys, time, uuid, cProfile, pstats, threading, logging
+from collections import Counter, deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+log = logging.getLogger("console.profiling")
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "120"))     # cửa sổ sampling tối đa
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+MODES = ("cprofile", "sample")
+
+# thread đứng chờ việc (pool worker, selector, Condition) -> bỏ khi sampling toàn process
+_IDLE = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+_lock = threading.Lock()
+_armed: Dict[Tuple[str, str], Dict[str, Any]] = {}       # (method, path) -> state
+_busy = threading.Lock()                                 # 1 profile tại 1 thời điểm
+_reports: deque = deque(maxlen=PROFILE_KEEP)
+
+
+class ProfileError(ValueError):
+    pass
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ---- sampler
+def _frame_label(f) -> str:
+    co = f.f_code
+    return f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})"
+
+
+def _stack(f) -> List[str]:
+    out = []
+    while f is not None:
+        out.append(_frame_label(f))
+        f = f.f_back
+    out.reverse()
+    return out
+
+
+def _idle(f) -> bool:
+    return (os.path.basename(f.f_code.co_filename), f.f_code.co_name) in _IDLE
+
+
+class _Sampler(threading.Thread):
+    """Đọc sys._current_frames() định kỳ; đếm stack (root -> leaf) theo tên thread."""
+
+    def __init__(self, interval_ms: float, thread_ids: Optional[set] = None, skip_idle: bool = False):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = max(interval_ms, 0.5) / 1000
+        self.thread_ids = thread_ids
+        self.skip_idle = skip_idle
+        self.stop = threading.Event()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        while not self.stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self.samples += 1
+            for tid, f in sys._current_frames().items():
+                if tid == me or (self.thread_ids is not None and tid not in self.thread_ids):
+                    continue
+                if self.skip_idle and _idle(f):
+                    continue
+                self.stacks[(names.get(tid, str(tid)), *_stack(f))] += 1
+
+    def finish(self) -> None:
+        self.stop.set()
+        self.join()
+
+
+def _sample_report(s: _Sampler) -> Dict[str, Any]:
+    total = sum(s.stacks.values())
+    leaf: Counter = Counter()
+    incl: Counter = Counter()
+    for st, n in s.stacks.items():
+        leaf[st[-1]] += n
+        for fr in set(st[1:]):
+            incl[fr] += n
+    top = lambda c: [{"frame": k, "samples": n, "pct": round(100 * n / max(total, 1), 1)} for k, n in c.most_common(PROFILE_TOP)]
+    collapsed = "\n".join(f"{';'.join(st)} {n}" for st, n in s.stacks.most_common())
+    text = "\n".join([f"ticks={s.samples} stacks={total} interval_ms={s.interval * 1000:g}", "", "-- self (leaf) --"]
+                     + [f"{r['pct']:6.1f}% {r['samples']:7d}  {r['frame']}" for r in top(leaf)]
+                     + ["", "-- total (inclusive) --"]
+                     + [f"{r['pct']:6.1f}% {r['samples']:7d}  {r['frame']}" for r in top(incl)])
+    return {"samples": s.samples, "stacks": total, "interval_ms": s.interval * 1000, "top_self": top(leaf), "top_total": top(incl),
+            "text": text, "collapsed": collapsed}
+
+
+def _cprofile_report(prof: cProfile.Profile) -> Dict[str, Any]:
+    buf = io.StringIO()
+    st = pstats.Stats(prof, stream=buf)
+    st.sort_stats("cumulative").print_stats(PROFILE_TOP)
+    rows = [{"func": f"{fn} ({os.path.basename(file)}:{line})", "calls": nc, "self_s": round(tt, 6), "total_s": round(ct, 6)}
+            for (file, line, fn), (cc, nc, tt, ct, _callers) in st.stats.items()]
+    return {"calls": st.total_calls, "top_total": sorted(rows, key=lambda r: -r["total_s"])[:PROFILE_TOP],
+            "top_self": sorted(rows, key=lambda r: -r["self_s"])[:PROFILE_TOP], "text": buf.getvalue()}
+
+
+def _store(rep: Dict[str, Any]) -> Dict[str, Any]:
+    _reports.append(rep)
+    if PROFILE_DIR:
+        try:
+            d = Path(PROFILE_DIR); d.mkdir(parents=True, exist_ok=True)
+            (d / f"{rep['id']}.txt").write_text(rep["text"])
+            if rep.get("collapsed"):
+                (d / f"{rep['id']}.collapsed").write_text(rep["collapsed"] + "\n")
+        except OSError as e:
+            log.warning("profile:store.failed id=%s err=%s", rep["id"], e)
+    log.info("profile:done id=%s kind=%s mode=%s target=%s ms=%d", rep["id"], rep["kind"], rep["mode"],
+             rep.get("route", "-"), rep["duration_ms"])
+    return rep
+
+
+def _new_report(kind: str, mode: str, **kw) -> Dict[str, Any]:
+    return {"id": uuid.uuid4().hex[:12], "kind": kind, "mode": mode, "started_at": _now_iso(), **kw}
+
+
+# ---- 1 request trên path đã arm
+class _RequestProfile:
+    def __init__(self, key: Tuple[str, str], mode: str):
+        self.key, self.mode = key, mode
+        self.rep = _new_report("request", mode, method=key[0], route=key[1])
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        if self.mode == "cprofile":
+            self.prof = cProfile.Profile()
+            self.prof.enable()
+        else:
+            # thread event loop + mọi thread đang bận (endpoint `def` chạy trên threadpool)
+            self.sampler = _Sampler(PROFILE_INTERVAL_MS, skip_idle=True)
+            self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.mode == "cprofile":
+            self.prof.disable()
+            body = _cprofile_report(self.prof)
+        else:
+            self.sampler.finish()
+            body = _sample_report(self.sampler)
+        self.rep.update(body, duration_ms=int((time.perf_counter() - self.t0) * 1000),
+                        status=self.status, error=repr(exc) if exc else None)
+        _busy.release()
+        _store(self.rep)
+        return False
+
+
+def _take(key: Tuple[str, str]) -> Optional[_RequestProfile]:
+    """Lấy 1 lượt profile của path (None nếu không arm / hết lượt / đang profile request khác)."""
+    with _lock:
+        st = _armed.get(key)
+        if st is None:
+            return None
+        if time.time() > st["expires"]:
+            _armed.pop(key, None)
+            return None
+        if not _busy.acquire(blocking=False):
+            return None
+        st["remaining"] -= 1
+        if st["remaining"] <= 0:
+            _armed.pop(key, None)
+        return _RequestProfile(key, st["mode"])
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: không có path nào arm -> chỉ 1 phép kiểm tra dict rỗng / request.
+    Request được profile có header X-Profile-Id (xem GET /api/v1/profile/reports/{id}).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not _armed or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        p = _take((scope["method"], scope["path"]))
+        if p is None:
+            return await self.app(scope, receive, send)
+        p.status = 500
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                p.status = msg["status"]
+                msg = {**msg, "headers": [*msg.get("headers", []), (b"x-profile-id", p.rep["id"].encode())]}
+            await send(msg)
+
+        with p:
+            await self.app(scope, receive, _send)
+
+
+def arm(path: str, method: str = "GET", mode: str = "sample", count: int = 1, ttl_sec: int = 600) -> Dict[str, Any]:
+    """Profile `count` request kế tiếp tới đúng path (vd. /api/v1/misp/pull) trong ttl_sec."""
+    if mode not in MODES:
+        raise ProfileError(f"invalid mode: {mode}")
+    method = method.upper()
+    with _lock:
+        _armed[(method, path)] = {"mode": mode, "remaining": count, "expires": time.time() + ttl_sec,
+                                  "armed_at": _now_iso()}
+    log.info("profile:arm %s %s mode=%s count=%d ttl=%ds", method, path, mode, count, ttl_sec)
+    return armed()[f"{method} {path}"]
+
+
+def disarm(path: Optional[str] = None, method: Optional[str] = None) -> int:
+    with _lock:
+        keys = [k for k in _armed if (path is None or k[1] == path) and (method is None or k[0] == method.upper())]
+        for k in keys:
+            _armed.pop(k, None)
+    return len(keys)
+
+
+def armed() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {f"{m} {p}": {"method": m, "path": p, "mode": st["mode"], "remaining": st["remaining"],
+                             "expires_in_sec": max(int(st["expires"] - time.time()), 0), "armed_at": st["armed_at"]}
+                for (m, p), st in _armed.items()}
+
+
+# ---- cửa sổ sampling toàn process
+def sample_process(seconds: float, interval_ms: Optional[float] = None, include_idle: bool = False) -> Dict[str, Any]:
+    """Sampling mọi thread trong `seconds` giây (chặn caller trong thời gian đó)."""
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ProfileError(f"seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+    if not _busy.acquire(blocking=False):
+        raise ProfileError("another profile is running")
+    try:
+        rep = _new_report("process", "sample", seconds=seconds)
+        t0 = time.perf_counter()
+        s = _Sampler(interval_ms or PROFILE_INTERVAL_MS, skip_idle=not include_idle)
+        s.start()
+        time.sleep(seconds)
+        s.finish()
+        rep.update(_sample_report(s), duration_ms=int((time.perf_counter() - t0) * 1000))
+    finally:
+        _busy.release()
+    return _store(rep)
+
+
+def list_reports() -> List[Dict[str, Any]]:
+    keep = ("id", "kind", "mode", "method", "route", "started_at", "duration_ms", "samples", "calls", "error")
+    return [{k: r[k] for k in keep if k in r} for r in reversed(_reports)]
+
+
+def get_report(report_id: str) -> Optional[Dict[str, Any]]:
+    return next((r for r in _reports if r["id"] == report_id), None)
@@ -0,0 +1,292 @@
+"""
+Retro-hunt: IOC mới pull về (norm.ip / norm.host) có từng xuất hiện trong alert cũ (ids_alerts) không.
+
+- chọn IOC có source.pulled_at trong [ioc_from, ioc_to] (mốc cố định của job -> danh sách value ổn định)
+- value sort + chia batch RETRO_HUNT_BATCH; mỗi batch 1 query $in dùng index (src.ip,_id) / (dst.ip,_id)
+  trong cửa sổ RETRO_HUNT_DAYS ngày theo thời điểm ingest (_id; `ts` sensor gửi không so sánh khoảng được)
+- hit ghi vào retro_hits (_id = alert_id:ioc_uuid -> chạy lại không nhân bản), kèm event_id/event_uuid
+- tiến độ (batches_done) lưu ở retro_jobs sau mỗi batch -> job dở dang chạy tiếp từ batch kế (resume)
+- nhiều worker: job được claim nguyên tử (queued -> running + owner + lease_until, gia hạn mỗi batch);
+  worker chết -> lease hết hạn -> worker khác claim lại. Lỗi -> thử lại tới RETRO_HUNT_MAX_ATTEMPTS lần rồi failed.
+
+Host: alert Snort mặc định không có host; nếu sensor gửi thêm field (RETRO_HUNT_HOST_FIELDS, vd. http_host)
+thì host được so theo các field đó (không index riêng -> lọc trong cửa sổ ts).
+"""
+import os, uuid, time, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from pymongo import UpdateOne, ReturnDocument
+
+from app.database.collections import col_iocs, col_ids_alerts, col_retro_hits, col_retro_jobs, lease_owner
+from app.services.alert_archive import alert_id_range
+from app.services.metrics import Histogram, gauge_fn, JOB_BUCKETS
+
+log = logging.getLogger("misp.retro_hunt")
+
+RETRO_HUNT_ENABLED = os.getenv("RETRO_HUNT_ENABLED", "true").lower() == "true"   # tự chạy sau pull/sync
+RETRO_HUNT_DAYS = int(os.getenv("RETRO_HUNT_DAYS", "30"))
+RETRO_HUNT_BATCH = int(os.getenv("RETRO_HUNT_BATCH", "500"))                     # value / query $in
+RETRO_HUNT_HOST_FIELDS = [f.strip() for f in os.getenv("RETRO_HUNT_HOST_FIELDS", "").split(",") if f.strip()]
+RETRO_HUNT_LEASE_SEC = int(os.getenv("RETRO_HUNT_LEASE_SEC", "600"))             # > thời gian 1 batch
+RETRO_HUNT_MAX_ATTEMPTS = int(os.getenv("RETRO_HUNT_MAX_ATTEMPTS", "3"))
+
+_IP_FIELDS = ("src.ip", "dst.ip")
+_ALERT_PROJ = {"ts": 1, "sensor_id": 1, "rule_id": 1, "msg": 1, "src": 1, "dst": 1}
+
+# 1 luồng nền: retro-hunt là I/O Mongo, chạy tuần tự để không tranh tải với ingest alert
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retro-hunt")
+_pending = 0                    # job đã submit vào _executor, chưa chạy xong
+_pending_lock = threading.Lock()
+
+JOB_SECONDS = Histogram("retro_hunt_job_seconds", "Thời gian chạy 1 job retro-hunt", ("status",), JOB_BUCKETS)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _window_from(job: Dict[str, Any]) -> datetime:
+    # job tạo trước khi đổi sang _id lưu window_from dạng chuỗi ISO
+    w = job["window_from"]
+    return datetime.fromisoformat(w) if isinstance(w, str) else w
+
+
+def _new_values(ioc_from: datetime, ioc_to: datetime) -> Tuple[List[str], List[str], Dict[str, List[dict]]]:
+    """(ips sort, hosts sort, value -> [ioc ref]) của IOC pulled trong [ioc_from, ioc_to]."""
+    refs: Dict[str, List[dict]] = {}
+    ips, hosts = set(), set()
+    q = {"source.pulled_at": {"$gte": ioc_from, "$lte": ioc_to},
+         "$or": [{"norm.ip": {"$ne": None}}, {"norm.host": {"$ne": None}}]}
+    for d in col_iocs.find(q, {"_id": 0, "uuid": 1, "type": 1, "value": 1, "event_id": 1, "event_uuid": 1,
+                               "to_ids": 1, "norm.ip": 1, "norm.host": 1}):
+        norm = d.get("norm") or {}
+        ref = {"ioc_uuid": d["uuid"], "type": d.get("type"), "ioc_value": d.get("value"),
+               "event_id": d.get("event_id"), "event_uuid": d.get("event_uuid"), "to_ids": d.get("to_ids")}
+        if norm.get("ip") and "/" not in norm["ip"]:
+            ips.add(norm["ip"]); refs.setdefault(norm["ip"], []).append(ref)
+        if norm.get("host"):
+            hosts.add(norm["host"]); refs.setdefault(norm["host"], []).append(ref)
+    return sorted(ips), sorted(hosts), refs
+
+
+def _batches(ips: List[str], hosts: List[str], size: int) -> List[Tuple[str, List[str]]]:
+    size = max(size, 1)
+    out = [("ip", ips[i:i + size]) for i in range(0, len(ips), size)]
+    if RETRO_HUNT_HOST_FIELDS:
+        out += [("host", hosts[i:i + size]) for i in range(0, len(hosts), size)]
+    return out
+
+
+def _scan_batch(kind: str, values: List[str], window_from: datetime) -> List[Tuple[dict, str, str]]:
+    """-> [(alert, field, value)] cho 1 batch."""
+    fields = _IP_FIELDS if kind == "ip" else RETRO_HUNT_HOST_FIELDS
+    vs = set(values)
+    q = {"_id": alert_id_range(since=window_from), "$or": [{f: {"$in": values}} for f in fields]}
+    proj = dict(_ALERT_PROJ)
+    proj.update({f: 1 for f in fields if f.split(".")[0] not in proj})   # tránh path collision (src vs src.ip)
+    out = []
+    for a in col_ids_alerts.find(q, proj):
+        for f in fields:
+            cur: Any = a
+            for part in f.split("."):
+                cur = cur.get(part) if isinstance(cur, dict) else None
+            if isinstance(cur, str) and (cur if kind == "ip" else cur.lower()) in vs:
+                out.append((a, f, cur if kind == "ip" else cur.lower()))
+    return out
+
+
+def _hit_ops(hits: List[Tuple[dict, str, str]], refs: Dict[str, List[dict]], job_id: str) -> List[UpdateOne]:
+    now = _now()
+    ops = []
+    for a, field, value in hits:
+        for ref in refs.get(value, []):
+            doc = {
+                "alert_id": a["_id"], "alert_ts": a.get("ts"), "sensor_id": a.get("sensor_id"),
+                "rule_id": a.get("rule_id"), "msg": a.get("msg"),
+                "field": field, "value": value, **ref,
+                "job_id": job_id, "found_at": now,
+            }
+            ops.append(UpdateOne({"_id": f"{a['_id']}:{ref['ioc_uuid']}"},
+                                 {"$set": doc, "$setOnInsert": {"first_found_at": now}}, upsert=True))
+    return ops
+
+
+def _lease_until() -> datetime:
+    return _now() + timedelta(seconds=RETRO_HUNT_LEASE_SEC)
+
+
+def _claimable() -> Dict[str, Any]:
+    # queued, hoặc running mà lease đã hết (worker chạy nó đã chết); thiếu attempts = job cũ, coi như 0
+    return {"$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$not": {"$gte": _now()}}}],
+            "attempts": {"$not": {"$gte": RETRO_HUNT_MAX_ATTEMPTS}}}
+
+
+def _claim(job_id: str, owner: str) -> Optional[Dict[str, Any]]:
+    """queued / running hết lease -> running của owner (nguyên tử); None nếu worker khác đang giữ."""
+    return col_retro_jobs.find_one_and_update(
+        {"_id": job_id, **_claimable()},
+        {"$set": {"status": "running", "owner": owner, "lease_until": _lease_until(), "updated_at": _now()},
+         "$inc": {"attempts": 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def run_job(job_id: str) -> Dict[str, Any]:
+    """Claim rồi chạy (hoặc chạy tiếp) 1 job từ batches_done; cập nhật tiến độ + gia hạn lease sau mỗi batch."""
+    job = col_retro_jobs.find_one({"_id": job_id})
+    if job is None:
+        raise ValueError(f"retro-hunt job not found: {job_id}")
+    if job["status"] == "done":
+        return job
+    owner = lease_owner()
+    claimed = _claim(job_id, owner)
+    if claimed is None:
+        log.info("retro:skip job=%s status=%s attempts=%s", job_id, job["status"], job.get("attempts"))
+        return job
+    job = claimed
+    mine = {"_id": job_id, "owner": owner}      # mất lease (worker khác claim lại) -> update không khớp
+
+    t0 = time.perf_counter()
+    start = int(job.get("batches_done") or 0)
+    hits_total = int(job.get("hits") or 0)
+    alerts_matched = int(job.get("alerts_matched") or 0)
+    i = start
+    try:
+        # đã claim -> mọi lỗi (kể cả lúc đọc IOC / ghi tiến độ) phải trả job về queued / failed, không kẹt running
+        ips, hosts, refs = _new_values(job["ioc_from"], job["ioc_to"])
+        batches = _batches(ips, hosts, job.get("batch_size") or RETRO_HUNT_BATCH)
+        window_from = _window_from(job)
+        col_retro_jobs.update_one(mine, {"$set": {
+            "values_ip": len(ips), "values_host": len(hosts),
+            "batches_total": len(batches), "updated_at": _now(),
+            **({"resumed_from": start} if start else {}),
+        }})
+
+        for i in range(start, len(batches)):
+            kind, values = batches[i]
+            hits = _scan_batch(kind, values, window_from)
+            ops = _hit_ops(hits, refs, job_id)
+            if ops:
+                col_retro_hits.bulk_write(ops, ordered=False)
+            hits_total += len(ops)
+            alerts_matched += len({a["_id"] for a, _, _ in hits})
+            res = col_retro_jobs.update_one(mine, {"$set": {
+                "batches_done": i + 1, "hits": hits_total, "alerts_matched": alerts_matched,
+                "lease_until": _lease_until(), "updated_at": _now(),
+            }})
+            if not res.matched_count:
+                log.warning("retro:lease.lost job=%s batch=%d", job_id, i)
+                return col_retro_jobs.find_one({"_id": job_id})
+    except Exception as e:
+        # còn lượt -> queued (_run_safe đưa lại vào hàng đợi), hết -> failed (không tự chạy lại)
+        retry = job["attempts"] < RETRO_HUNT_MAX_ATTEMPTS
+        col_retro_jobs.update_one(mine, {"$set": {"status": "queued" if retry else "failed", "error": str(e),
+                                                  "lease_until": None, "updated_at": _now()}})
+        log.warning("retro:failed job=%s batch=%d attempt=%d retry=%s err=%s", job_id, i, job["attempts"], retry, e)
+        raise
+
+    ms = int((time.perf_counter() - t0) * 1000) + int(job.get("duration_ms") or 0)
+    done = {"status": "done", "hits": hits_total, "alerts_matched": alerts_matched,
+            "duration_ms": ms, "finished_at": _now(), "updated_at": _now()}
+    col_retro_jobs.update_one(mine, {"$set": {**done, "lease_until": None}})
+    log.info("retro:done job=%s days=%s ips=%d hosts=%d batches=%d hits=%d ms=%d",
+             job_id, job["days"], len(ips), len(hosts), len(batches), hits_total, ms)
+    return col_retro_jobs.find_one({"_id": job_id})
+
+
+def create_job(ioc_from: datetime, ioc_to: Optional[datetime] = None, days: Optional[int] = None,
+               trigger: str = "manual") -> Dict[str, Any]:
+    now = _now()
+    days = days or RETRO_HUNT_DAYS
+    job = {
+        "_id": uuid.uuid4().hex[:12], "status": "queued", "trigger": trigger,
+        "ioc_from": ioc_from, "ioc_to": ioc_to or now, "days": days,
+        "window_from": now - timedelta(days=days),
+        "batch_size": RETRO_HUNT_BATCH, "batches_done": 0, "hits": 0, "alerts_matched": 0, "attempts": 0,
+        "created_at": now, "updated_at": now,
+    }
+    col_retro_jobs.insert_one(job)
+    return job
+
+
+def _run_safe(job_id: str) -> None:
+    global _pending
+    t0 = time.perf_counter()
+    status = "done"
+    try:
+        run_job(job_id)
+    except Exception:
+        status = "failed"   # đã ghi status=queued (còn lượt) / failed trong run_job
+        job = col_retro_jobs.find_one({"_id": job_id}, {"status": 1})
+        if job and job["status"] == "queued":
+            _enqueue(job_id)
+    finally:
+        JOB_SECONDS.labels(status).observe(time.perf_counter() - t0)
+        with _pending_lock:
+            _pending -= 1
+
+
+def _enqueue(job_id: str) -> None:
+    global _pending
+    with _pending_lock:
+        _pending += 1
+    _executor.submit(_run_safe, job_id)
+
+
+def queue_depth() -> int:
+    return _pending
+
+
+gauge_fn("retro_hunt_queue_depth", "Job retro-hunt đang chờ / đang chạy", queue_depth)
+
+
+def submit(ioc_from: datetime, ioc_to: Optional[datetime] = None, days: Optional[int] = None,
+           trigger: str = "manual") -> Dict[str, Any]:
+    """Tạo job + chạy nền; trả job doc (status=queued)."""
+    job = create_job(ioc_from, ioc_to, days, trigger)
+    _enqueue(job["_id"])
+    return job
+
+
+def submit_after_pull(pulled_at: datetime) -> Optional[str]:
+    """Hook sau pull/sync: hunt các IOC vừa upsert (source.pulled_at = pulled_at)."""
+    if not RETRO_HUNT_ENABLED:
+        return None
+    try:
+        return submit(pulled_at, trigger="pull")["_id"]
+    except Exception as e:
+        log.warning("retro:submit.failed err=%s", e)
+        return None
+
+
+def resume_pending() -> List[str]:
+    """
+    Lúc khởi động: đưa vào hàng đợi các job queued / running hết lease (bị ngắt giữa chừng).
+    Mọi worker đều gọi; run_job claim nguyên tử nên mỗi job chỉ 1 worker chạy. Job failed không tự chạy lại.
+    """
+    # running hết lease nhưng đã hết lượt -> failed (không nằm mãi ở running)
+    col_retro_jobs.update_many(
+        {"status": "running", "lease_until": {"$not": {"$gte": _now()}}, "attempts": {"$gte": RETRO_HUNT_MAX_ATTEMPTS}},
+        {"$set": {"status": "failed", "error": "max attempts exceeded", "updated_at": _now()}})
+    ids = [j["_id"] for j in col_retro_jobs.find(_claimable(), {"_id": 1})]
+    for jid in ids:
+        _enqueue(jid)
+    if ids:
+        log.info("retro:resume jobs=%d", len(ids))
+    return ids
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return col_retro_jobs.find_one({"_id": job_id})
+
+
+def list_hits(event_id: Optional[int] = None, job_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    q: Dict[str, Any] = {}
+    if event_id is not None: q["event_id"] = event_id
+    if job_id: q["job_id"] = job_id
+    return list(col_retro_hits.find(q).sort("alert_ts", -1).limit(limit))
+
+
+def shutdown_retro_hunt() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,151 @@
+import os, time, uuid, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from app.database.collections import col_rule_sets
+from app.services.metrics import Histogram, gauge_fn, JOB_BUCKETS
+
+# Hàng đợi build rule set chạy trên process pool:
+# - gzip + sha256 ăn CPU -> chạy ở process riêng, không block worker của API
+# - job_id trả về ngay (202), client poll trạng thái
+# - 1 version chỉ có tối đa 1 job queued/running (dedup)
+# Registry job nằm trong bộ nhớ của process API (mỗi uvicorn worker có registry riêng).
+RULE_BUILD_WORKERS = int(os.getenv("RULE_BUILD_WORKERS") or os.cpu_count() or 2)
+RULE_BUILD_JOBS_KEEP = int(os.getenv("RULE_BUILD_JOBS_KEEP", "500"))   # số job đã xong giữ lại để tra cứu
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+_jobs: Dict[str, Dict[str, Any]] = {}
+_futures: Dict[str, Future] = {}
+_active_by_version: Dict[str, str] = {}
+_submitted: Dict[str, float] = {}      # job_id -> perf_counter lúc submit (đo thời gian build)
+
+# mode=queued: tính từ lúc submit (gồm chờ worker trong pool); mode=sync: build ?wait=true
+BUILD_SECONDS = Histogram("rule_set_build_seconds", "Thời gian build rule set (.tgz)", ("mode", "status"), JOB_BUCKETS)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _build_job(version: str) -> Dict[str, Any]:
+    # chạy trong process con (spawn) -> tự mở MongoClient riêng khi import
+    from app.services.rule_set_builder import build_files_for_rule_set, build_summary
+    return build_summary(build_files_for_rule_set(version))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: MongoClient không fork-safe
+        _pool = ProcessPoolExecutor(
+            max_workers=max(RULE_BUILD_WORKERS, 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(job)
+    fut = _futures.get(job["job_id"])
+    if out["status"] == "queued" and fut is not None and fut.running():
+        out["status"] = "running"
+    return out
+
+
+def _on_done(job_id: str, fut: Future) -> None:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job["finished_at"] = _now_iso()
+        t0 = _submitted.pop(job_id, None)
+        err = fut.exception()
+        if err is None:
+            job["status"] = "done"
+            job["result"] = fut.result()
+        else:
+            job["status"] = "failed"
+            job["error"] = "rule_set not found" if isinstance(err, ValueError) else str(err)
+        if _active_by_version.get(job["version"]) == job_id:
+            _active_by_version.pop(job["version"], None)
+        _futures.pop(job_id, None)
+        if t0 is not None:
+            BUILD_SECONDS.labels("queued", job["status"]).observe(time.perf_counter() - t0)
+        _trim()
+
+
+def _trim() -> None:
+    done = [j for j in _jobs.values() if j["status"] in ("done", "failed")]
+    for j in sorted(done, key=lambda j: j["finished_at"])[:max(len(done) - RULE_BUILD_JOBS_KEEP, 0)]:
+        _jobs.pop(j["job_id"], None)
+
+
+def submit_build(version: str) -> Dict[str, Any]:
+    """
+    Đưa build của 1 version vào hàng đợi. Nếu version đang có job queued/running -> trả lại job đó.
+    Raise ValueError nếu rule_set không tồn tại.
+    """
+    if not col_rule_sets.find_one({"version": version}, {"_id": 1}):
+        raise ValueError("rule_set not found")
+
+    with _lock:
+        jid = _active_by_version.get(version)
+        if jid and jid in _jobs:
+            return {**_public(_jobs[jid]), "deduplicated": True}
+
+        jid = uuid.uuid4().hex
+        job = {
+            "job_id": jid, "version": version, "status": "queued",
+            "submitted_at": _now_iso(), "finished_at": None,
+            "result": None, "error": None,
+        }
+        _jobs[jid] = job
+        _active_by_version[version] = jid
+        fut = _get_pool().submit(_build_job, version)
+        _futures[jid] = fut
+        _submitted[jid] = time.perf_counter()
+    # add_done_callback có thể gọi ngay (job xong rất nhanh) -> đăng ký ngoài lock
+    fut.add_done_callback(lambda f, jid=jid: _on_done(jid, f))
+    return {**_public(job), "deduplicated": False}
+
+
+def submit_builds(versions: List[str]) -> List[Dict[str, Any]]:
+    """Đưa nhiều version vào hàng đợi (build song song theo số worker)."""
+    out = []
+    for v in dict.fromkeys(versions):
+        try:
+            out.append(submit_build(v))
+        except ValueError as e:
+            out.append({"version": v, "status": "rejected", "error": str(e)})
+    return out
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        job = _jobs.get(job_id)
+        return _public(job) if job else None
+
+
+def list_jobs(status: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _lock:
+        jobs = [_public(j) for j in _jobs.values()]
+    if status:
+        jobs = [j for j in jobs if j["status"] == status]
+    return sorted(jobs, key=lambda j: j["submitted_at"], reverse=True)
+
+
+def queue_depth() -> int:
+    with _lock:
+        return len(_active_by_version)
+
+
+gauge_fn("rule_build_queue_depth", "Rule set đang queued/running trong build queue", queue_depth)
+
+
+def shutdown_build_queue() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -1,27 +1,45 @@
 import hashlib, ipaddress, re, os
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, List, Optional, Callable
 from datetime import datetime
+from app.services.snort_parser import parse_rule, render_rule, SnortParseError
 
 
 # --- ENV networks (mặc định dùng tên biến Snort) ---
 HOME_NET = os.getenv("HOME_NET", "$HOME_NET")
 EXTERNAL_NET = os.getenv("EXTERNAL_NET", "$EXTERNAL_NET")
 
-# --- helpers ---
-def join_tokens(tokens):
-    # mỗi token KHÔNG có ; ở cuối
-    return '; '.join(t.strip().rstrip(';') for t in tokens) + ';'
+# --- IP aggregation ---
+# single     : 1 rule / IP (mặc định, như cũ)
+# list       : gom IP theo (role, port) thành 1 rule với IP list trong header
+# reputation : gom IP vào file blocklist cho reputation inspector của Snort3
+IP_RULE_MODES = ("single", "list", "reputation")
+IP_RULE_MODE = os.getenv("IP_RULE_MODE", "single").lower()
+IP_LIST_MAX = int(os.getenv("IP_LIST_MAX", "1000"))   # số IP tối đa / rule
 
+# --- helpers ---
 def sha1_hex(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
 
+# IPv4 dạng chấm, không có số 0 đứng đầu (giống ipaddress.ip_address); re.ASCII: \d không khớp chữ số Unicode ('１', '٤')
+_IPV4_RE = re.compile(r"(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(?:\.(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)){3}", re.ASCII)
+_URL_RE = re.compile(r"^(?:https?://)?([^/]+)(/.*)?$")
+
 def is_ip(v: str) -> bool:
+    # fast path: IPv4 bằng regex compile sẵn; chỉ chuỗi có ':' mới cần ipaddress (IPv6)
+    if _IPV4_RE.fullmatch(v):
+        return True
+    if ":" not in v:
+        return False
     try:
-        ipaddress.ip_address(v)
+        ipaddress.IPv6Address(v)
         return True
-    except Exception:
+    except ValueError:
         return False
 
+def since_version(now: Optional[datetime] = None) -> str:
+    """Nhãn since_version cho mitre[]; tính 1 lần / batch."""
+    return (now or datetime.utcnow()).strftime("%Y.%m.%d-%H")
+
 def safe_msg(v: str) -> str:
     return v.replace('"', "'")[:180]
 
@@ -63,13 +81,9 @@ def parse_domain_ip(v: str) -> Tuple[str, str]:
 
 def build_rule_for_domain(val: str, sid: int) -> Tuple[str, Dict[str, Any]]:
     msg = "TLS SNI suspicious domain"
-    tokens = [
-        f'msg:"{msg}"',
-        'tls_sni', f'content:"{val}"', 'fast_pattern',
-        f"sid:{sid}", "rev:1",
-    ]
     # SRC: HOME_NET:any  ->  DST: EXTERNAL_NET:443
-    text = f'alert tcp {HOME_NET} any -> {EXTERNAL_NET} 443 ({join_tokens(tokens)})'
+    text = (f'alert tcp {HOME_NET} any -> {EXTERNAL_NET} 443 '
+            f'(msg:"{msg}"; tls_sni; content:"{val}"; fast_pattern; sid:{sid}; rev:1;)')
     meta = {
         "protocol": "tcp",
         "src_sel": f"{HOME_NET}:any",
@@ -81,37 +95,52 @@ def build_rule_for_domain(val: str, sid: int) -> Tuple[str, Dict[str, Any]]:
 
 def build_rule_for_ip(ip: str, sid: int, port: str = "any", role: str = "dst") -> Tuple[str, Dict[str, Any]]:
     msg = "Suspicious IP connection"
-    tokens = [f'msg:"{msg}"', "flow:to_server,established", f"sid:{sid}", "rev:1"]
+    opts = f'msg:"{msg}"; flow:to_server,established; sid:{sid}; rev:1;'
     dport = port or "any"
 
     if role == "src":
         # SRC: ip:any  ->  DST: EXTERNAL_NET:port
-        text = f'alert ip {ip} any -> {EXTERNAL_NET} {dport} ({join_tokens(tokens)})'
+        text = f'alert ip {ip} any -> {EXTERNAL_NET} {dport} ({opts})'
         src_sel, dst_sel = f"{ip}:any", f"{EXTERNAL_NET}:{dport}"
     else:
         # SRC: HOME_NET:any  ->  DST: ip:port
-        text = f'alert ip {HOME_NET} any -> {ip} {dport} ({join_tokens(tokens)})'
+        text = f'alert ip {HOME_NET} any -> {ip} {dport} ({opts})'
         src_sel, dst_sel = f"{HOME_NET}:any", f"{ip}:{dport}"
 
     meta = {"protocol": "ip", "src_sel": src_sel, "dst_sel": dst_sel, "buffers": [], "keywords": ["flow"]}
     return msg, {"text": text, **meta}
 
+def build_rule_for_ip_list(ips: List[str], sid: int, port: str = "any", role: str = "dst") -> Tuple[str, Dict[str, Any]]:
+    """
+    Giống build_rule_for_ip nhưng header chứa IP list '[ip1,ip2,...]'
+    -> Snort compile 1 rule thay vì N rule.
+    """
+    msg = f"Suspicious IP connection (list {role}:{port or 'any'}, {len(ips)} IPs)"
+    opts = f'msg:"{msg}"; flow:to_server,established; sid:{sid}; rev:1;'
+    dport = port or "any"
+    ip_list = "[" + ",".join(ips) + "]"
+
+    if role == "src":
+        text = f'alert ip {ip_list} any -> {EXTERNAL_NET} {dport} ({opts})'
+        src_sel, dst_sel = f"{ip_list}:any", f"{EXTERNAL_NET}:{dport}"
+    else:
+        text = f'alert ip {HOME_NET} any -> {ip_list} {dport} ({opts})'
+        src_sel, dst_sel = f"{HOME_NET}:any", f"{ip_list}:{dport}"
+
+    meta = {"protocol": "ip", "src_sel": src_sel, "dst_sel": dst_sel, "buffers": [], "keywords": ["flow"]}
+    return msg, {"text": text, **meta}
+
 def build_rule_for_url(url: str, sid: int) -> Tuple[str, Dict[str, Any]]:
     host, path = url, "/"
-    m = re.match(r"^(?:https?://)?([^/]+)(/.*)?$", url)
+    m = _URL_RE.match(url)
     if m:
         host, path = m.group(1), (m.group(2) or "/")
 
     msg = "HTTP request suspicious URL"
-    tokens = [
-        f'msg:"{msg}"',
-        'http_header', 'content:"Host"', 'http_header', f'content:"{host}"',
-        'http_uri', f'content:"{path}"', 'fast_pattern',
-        'flow:to_server,established',
-        f"sid:{sid}", "rev:1",
-    ]
     # SRC: HOME_NET:any  ->  DST: EXTERNAL_NET:80
-    text = f'alert tcp {HOME_NET} any -> {EXTERNAL_NET} 80 ({join_tokens(tokens)})'
+    text = (f'alert tcp {HOME_NET} any -> {EXTERNAL_NET} 80 '
+            f'(msg:"{msg}"; http_header; content:"Host"; http_header; content:"{host}"; '
+            f'http_uri; content:"{path}"; fast_pattern; flow:to_server,established; sid:{sid}; rev:1;)')
     meta = {
         "protocol": "tcp",
         "src_sel": f"{HOME_NET}:any",
@@ -123,9 +152,9 @@ def build_rule_for_url(url: str, sid: int) -> Tuple[str, Dict[str, Any]]:
 
 def build_rule_for_dnsq(name: str, sid: int) -> Tuple[str, Dict[str, Any]]:
     msg = "DNS query suspicious name"
-    tokens = [f'msg:"{msg}"', 'dns_query', f'content:"{name}"', 'nocase', f"sid:{sid}", "rev:1"]
     # SRC: HOME_NET:any  ->  DST: EXTERNAL_NET:53
-    text = f'alert udp {HOME_NET} any -> {EXTERNAL_NET} 53 ({join_tokens(tokens)})'
+    text = (f'alert udp {HOME_NET} any -> {EXTERNAL_NET} 53 '
+            f'(msg:"{msg}"; dns_query; content:"{name}"; nocase; sid:{sid}; rev:1;)')
     meta = {
         "protocol": "udp",
         "src_sel": f"{HOME_NET}:any",
@@ -138,55 +167,63 @@ def build_rule_for_dnsq(name: str, sid: int) -> Tuple[str, Dict[str, Any]]:
 
 
 
-def _normalize_options_block(opts: str) -> str:
-    # chuẩn hoá: tách theo ';', bỏ rỗng và dấu ';' cuối, ghép lại thành "...; ...;"
-    parts = [p.strip().rstrip(';') for p in opts.split(';') if p.strip()]
-    return '; '.join(parts) + ';' if parts else ''
-
-
 def build_rule_for_snort(rule_line: str, fallback_sid: int) -> Tuple[str, Dict[str, Any]]:
     """
     Nhận 1 dòng rule Snort bắt đầu bằng 'alert ... ( ... )'
+    - Parse thành IR (snort_parser.parse_rule): options, buffers, contents, flow, flowbits, references
     - Nếu có sid:<n>; trong options -> dùng n cho DB
     - Nếu chưa có sid -> chèn sid:fallback_sid; rev:1;
-    Trả về (msg, meta) với rule_text = raw rule (đã normalize options)
+    Trả về (msg, meta) với rule_text = rule render lại từ IR (đã normalize options)
     """
-    m = re.match(
-        r'^\s*alert\s+(\w+)\s+([^\s]+)\s+([^\s]+)\s*->\s*([^\s]+)\s+([^\s]+)\s*\((.*)\)\s*$',
-        rule_line, re.IGNORECASE | re.DOTALL
-    )
-    if not m:
-        raise ValueError("Invalid Snort rule format")
-
-    proto, src, sport, dst, dport, opts = m.groups()
-    opts_norm = _normalize_options_block(opts)
-
-    # msg (nếu có)
-    msg_match = re.search(r'msg\s*:\s*"([^"]*)"', opts_norm, re.IGNORECASE)
-    msg = msg_match.group(1) if msg_match else "Imported Snort rule"
+    try:
+        ir = parse_rule(rule_line)
+    except SnortParseError as e:
+        raise ValueError(f"Invalid Snort rule format: {e}")
 
-    # sid trong rule (nếu có)
-    sid_match = re.search(r'\bsid\s*:\s*(\d+)\s*;', opts_norm, re.IGNORECASE)
-    db_sid = int(sid_match.group(1)) if sid_match else int(fallback_sid)
+    msg = ir["msg"] or "Imported Snort rule"
+    db_sid = ir["sid"] if ir["sid"] is not None else int(fallback_sid)
 
     # Nếu chưa có sid thì chèn sid + rev vào cuối
-    if not sid_match:
-        opts_norm = _normalize_options_block(opts_norm + f' sid:{db_sid}; rev:1;')
-
-    rule_text = f'alert {proto} {src} {sport} -> {dst} {dport} ({opts_norm})'
+    if ir["sid"] is None:
+        ir["options"].append({"name": "sid", "arg": str(db_sid)})
+        if "rev" not in ir["keywords"]:
+            ir["options"].append({"name": "rev", "arg": "1"})
+        ir["sid"] = db_sid
 
     meta = {
-        "protocol": proto.lower(),
-        "src_sel": f"{src}:{sport}",
-        "dst_sel": f"{dst}:{dport}",
-        "buffers": [],
-        "keywords": [],  # có thể parse thêm nếu cần
+        "protocol": ir["protocol"],
+        "src_sel": f"{ir['src']}:{ir['sport']}",
+        "dst_sel": f"{ir['dst']}:{ir['dport']}",
+        "buffers": ir["buffers"],
+        "keywords": ir["keywords"],
+        "options": ir["options"],
+        "contents": ir["contents"],
+        "flow": ir["flow"],
+        "flowbits": ir["flowbits"],
+        "references": ir["references"],
+        "classtype": ir["classtype"],
         "db_sid": db_sid,  # trả về để caller dùng làm gid/sid DB
     }
-    return msg, {"text": rule_text, **meta}
+    return msg, {"text": render_rule(ir), **meta}
 
 # --- main dispatch ---
 
+IP_TYPES = {"ip-dst", "ip-src", "ip-dst|port", "ip-src|port"}
+
+def ip_ioc_key(ioc: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """
+    IOC IP hợp lệ -> (role, port, ip); không phải IP -> None
+    """
+    t = ioc.get("type", "").lower()
+    if t not in IP_TYPES:
+        return None
+    v = str(ioc.get("value", "")).strip()
+    ip, port = parse_ip_port(v) if t.endswith("|port") else (v, "any")
+    if not is_ip(ip):
+        return None
+    role = "src" if t.startswith("ip-src") else "dst"
+    return role, port or "any", ip
+
 SNORTABLE_TYPES = {
     "domain", "hostname",
     "domain|ip",
@@ -196,79 +233,93 @@ SNORTABLE_TYPES = {
     "snort",
 }
 
-def ioc_to_rule(ioc: Dict[str, Any], sid: int) -> Dict[str, Any]:
-    
-    t = ioc.get("type", "").lower()
-    v = str(ioc.get("value", "")).strip()
+# Bảng dispatch: type -> conv(v, sid) trả (msg, built) hoặc None (-> fallback generic)
+def _conv_domain(v: str, sid: int):
+    return build_rule_for_domain(v, sid)
 
-    msg, built = None, None
+def _conv_domain_ip(v: str, sid: int):
+    # domain|ip -> ưu tiên domain cho DNS query
+    dom, ip = parse_domain_ip(v)
+    return build_rule_for_dnsq(dom or ip or v, sid)
 
-    # 1) Domain / hostname -> TLS SNI rule
-    if t in ("domain", "hostname"):
-        msg, built = build_rule_for_domain(v, sid)
+def _conv_ip(role: str, with_port: bool):
+    def conv(v: str, sid: int):
+        # '1.2.3.4' hoặc '1.2.3.4|443' / '1.2.3.4:443'
+        ip, port = parse_ip_port(v) if with_port else (v, "any")
+        if is_ip(ip):
+            return build_rule_for_ip(ip, sid, port=port, role=role)
+        return None
+    return conv
+
+def _conv_url(v: str, sid: int):
+    return build_rule_for_url(v, sid)
+
+def _conv_snort(v: str, sid: int):
+    if v[:5].lower() == "alert":
+        return build_rule_for_snort(v, sid)
+    return None
+
+_CONVERTERS: Dict[str, Callable[[str, int], Optional[Tuple[str, Dict[str, Any]]]]] = {
+    "domain": _conv_domain,
+    "hostname": _conv_domain,
+    "domain|ip": _conv_domain_ip,
+    "ip-dst": _conv_ip("dst", False),
+    "ip-src": _conv_ip("src", False),
+    "ip-dst|port": _conv_ip("dst", True),
+    "ip-src|port": _conv_ip("src", True),
+    "url": _conv_url,
+    "uri": _conv_url,
+    "snort": _conv_snort,
+}
 
-    # 2) domain|ip -> ưu tiên domain cho DNS query
-    elif t == "domain|ip":
-        dom, ip = parse_domain_ip(v)
-        name = dom or ip or v
-        msg, built = build_rule_for_dnsq(name, sid)
+def _generic_rule(t: str, v: str, sid: int) -> Tuple[str, Dict[str, Any]]:
+    # fallback generic cho mấy type khác (chỉ dùng khi muốn rất aggressive)
+    text = (
+        f'alert ip any any -> any any (msg:"{safe_msg(v)}"; '
+        f'content:"{v}"; sid:{sid}; rev:1;)'
+    )
+    return f"Generic match for {t}", {
+        "text": text,
+        "protocol": "ip",
+        "src_sel": "any:any",
+        "dst_sel": "any:any",
+        "buffers": [],
+        "keywords": ["content"],
+    }
 
-    # 3) IP dst/src không port
-    elif t == "ip-dst" and is_ip(v):
-        msg, built = build_rule_for_ip(v, sid, role="dst")
-    elif t == "ip-src" and is_ip(v):
-        msg, built = build_rule_for_ip(v, sid, role="src")
+def ioc_to_rule(ioc: Dict[str, Any], sid: int, since: Optional[str] = None) -> Dict[str, Any]:
+    """
+    1 IOC -> rule payload. since: since_version đã tính sẵn cho cả batch (xem iocs_to_rules).
+    """
+    t = ioc.get("type", "").lower()
+    v = str(ioc.get("value", "")).strip()
 
-    # 4) IP dst/src có port: '1.2.3.4|443' / '1.2.3.4:443'
-    elif t == "ip-dst|port":
-        ip, port = parse_ip_port(v)
-        if is_ip(ip):
-            msg, built = build_rule_for_ip(ip, sid, port=port, role="dst")
-    elif t == "ip-src|port":
-        ip, port = parse_ip_port(v)
-        if is_ip(ip):
-            msg, built = build_rule_for_ip(ip, sid, port=port, role="src")
-
-    # 5) URL / URI
-    elif t in ("url", "uri"):
-        msg, built = build_rule_for_url(v, sid)
-    elif t == "snort" and v.lower().startswith("alert"):
-        msg, built = build_rule_for_snort(v, sid)
-        # Nếu rule có sid riêng -> ghi đè sid DB bằng sid của rule
+    conv = _CONVERTERS.get(t)
+    res = conv(v, sid) if conv else None
+    if res:
+        msg, built = res
+        # Nếu rule snort có sid riêng -> ghi đè sid DB bằng sid của rule
         if "db_sid" in built:
             sid = built.pop("db_sid")
-    # 6) fallback generic cho mấy type khác (chỉ dùng khi muốn rất aggressive)
-    if not built:
-        msg = f"Generic match for {t}"
-        text = (
-            f'alert ip any any -> any any (msg:"{safe_msg(v)}"; '
-            f'content:"{v}"; sid:{sid}; rev:1;)'
-        )
-        built = {
-            "text": text,
-            "protocol": "ip",
-            "src_sel": "any:any",
-            "dst_sel": "any:any",
-            "buffers": [],
-            "keywords": ["content"],
-        }
-
-    rule_hash = sha1_hex(f"{t}|{v}|{built['text']}")
-
-    return {
+    else:
+        msg, built = _generic_rule(t, v, sid)
+
+    out = {
         "msg": msg,
         "protocol": built["protocol"],
         "src_sel": built["src_sel"],
         "dst_sel": built["dst_sel"],
-        "rule_text": built["text"],  
-        "rule_hash": rule_hash,
+        "rule_text": built["text"],
+        "rule_hash": sha1_hex(f"{t}|{v}|{built['text']}"),
         "buffers": built["buffers"],
         "keywords": built["keywords"],
-        "flow": {},
-        "flowbits": {},
+        "options": built.get("options", []),
+        "contents": built.get("contents", []),
+        "flow": built.get("flow", {}),
+        "flowbits": built.get("flowbits", {}),
         "references": [
             {"type": "misp", "value": str(ioc.get("event_uuid", ""))}
-        ],
+        ] + built.get("references", []),
         "metadata": {
             "event_id": ioc.get("event_id"),
             "attr_id": ioc.get("attr_id"),
@@ -278,7 +329,104 @@ def ioc_to_rule(ioc: Dict[str, Any], sid: int) -> Dict[str, Any]:
         "mitre": [
             {
                 "status_default": "enabled",
-                "since_version": datetime.utcnow().strftime("%Y.%m.%d-%H"),
+                "since_version": since or since_version(),
             }
         ],
     }
+    if built.get("classtype"):
+        out["classtype"] = built["classtype"]
+    return out
+
+
+def iocs_to_rules(iocs: List[Dict[str, Any]], sids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Batch API: convert list IOC với list sid tương ứng (cùng độ dài).
+    since_version tính 1 lần cho cả batch.
+    """
+    if len(iocs) != len(sids):
+        raise ValueError("iocs and sids must have the same length")
+    since = since_version()
+    return [ioc_to_rule(ioc, sid, since) for ioc, sid in zip(iocs, sids)]
+
+
+def ip_iocs_to_group_rules(
+    iocs: List[Dict[str, Any]],
+    sid_fn: Callable[[], int],
+    mode: str = "list",
+) -> List[Dict[str, Any]]:
+    """
+    Gom các IOC IP theo (role, port), chia chunk IP_LIST_MAX.
+    Trả về list rule payload (kèm 'sid'); metadata.members giữ liên kết về MISP
+    (ip, event_id, attr_id, uuid) để map alert -> attribute (sidecar index).
+    - mode="list"       : rule_text = 1 rule với IP list
+    - mode="reputation" : rule_text rỗng, IP được builder ghi vào console.blocklist
+    """
+    groups: Dict[Tuple[str, str], Dict[str, List[Dict[str, Any]]]] = {}
+    for ioc in iocs:
+        key = ip_ioc_key(ioc)
+        if not key:
+            continue
+        role, port, ip = key
+        groups.setdefault((role, port), {}).setdefault(ip, []).append({
+            "ip": ip,
+            "event_id": ioc.get("event_id"),
+            "attr_id": ioc.get("attr_id"),
+            "uuid": ioc.get("uuid"),
+            "event_uuid": ioc.get("event_uuid"),
+        })
+
+    out: List[Dict[str, Any]] = []
+    since = since_version()
+    for (role, port), by_ip in sorted(groups.items()):
+        ips = sorted(by_ip)
+        for i in range(0, len(ips), max(IP_LIST_MAX, 1)):
+            chunk = ips[i:i + IP_LIST_MAX]
+            members = [m for ip in chunk for m in by_ip[ip]]
+            sid = sid_fn()
+            if mode == "reputation":
+                msg = f"Reputation blocklist ({role}, {len(chunk)} IPs)"
+                built = {
+                    "text": "",
+                    "protocol": "ip",
+                    "src_sel": "any:any",
+                    "dst_sel": "any:any",
+                    "buffers": [],
+                    "keywords": [],
+                }
+            else:
+                msg, built = build_rule_for_ip_list(chunk, sid, port=port, role=role)
+
+            first = members[0]
+            out.append({
+                "sid": sid,
+                "msg": msg,
+                "protocol": built["protocol"],
+                "src_sel": built["src_sel"],
+                "dst_sel": built["dst_sel"],
+                "rule_text": built["text"],
+                "rule_hash": sha1_hex(f"ip-{mode}|{role}|{port}|" + ",".join(chunk)),
+                "buffers": built["buffers"],
+                "keywords": built["keywords"],
+                "flow": {},
+                "flowbits": {},
+                "references": [
+                    {"type": "misp", "value": u}
+                    for u in sorted({str(m.get("event_uuid") or "") for m in members})
+                ],
+                "metadata": {
+                    "event_id": first.get("event_id"),
+                    "attr_id": None,
+                    "ioc_type": f"ip-{role}" + ("|port" if port != "any" else ""),
+                    "ip_mode": mode,
+                    "ip_role": role,
+                    "ip_port": port,
+                    "members": members,
+                },
+                "mitre": [
+                    {
+                        "status_default": "enabled",
+                        "since_version": since,
+                    }
+                ],
+            })
+    return out
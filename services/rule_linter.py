@@ -0,0 +1,102 @@
+import os
+from typing import Dict, Any, Optional
+from app.services.snort_parser import parse_rule, SnortParseError
+
+# ---- cấu hình budget ----
+# RULE_COST_BUDGET : rule có cost > budget bị xử lý theo RULE_COST_ACTION
+# RULE_COST_ACTION : quarantine (lưu rule_item nhưng không đưa vào set) | block (bỏ hẳn) | off
+RULE_COST_BUDGET = int(os.getenv("RULE_COST_BUDGET", "60"))
+RULE_COST_ACTION = os.getenv("RULE_COST_ACTION", "quarantine").lower()
+RULE_COST_ACTIONS = ("quarantine", "block", "off")
+if RULE_COST_ACTION not in RULE_COST_ACTIONS:
+    raise ValueError(f"RULE_COST_ACTION={RULE_COST_ACTION!r}: must be one of {', '.join(RULE_COST_ACTIONS)}")
+
+# option soi payload (không kể content); rule chỉ có header/flow thì rẻ
+PAYLOAD_OPTIONS = {"pcre", "regex", "byte_test", "byte_jump", "byte_extract", "byte_math", "isdataat", "base64_decode"}
+
+# ---- trọng số ----
+W_PROTO = {"ip": 30, "tcp": 10, "udp": 10, "icmp": 5}
+W_ANY_PORTS = 20         # cả sport & dport = any
+W_ANY_ADDRS = 20         # cả src & dst = any (không dùng HOME_NET/EXTERNAL_NET)
+W_NO_CONTENT = 40        # soi payload nhưng không có content -> không có fast pattern, eval mọi packet khớp header
+W_SHORT_FP = 25          # fast pattern < MIN_FP_LEN byte
+W_RAW_BUFFER = 20        # content trên full packet (không sticky buffer)
+W_NO_FLOW = 10           # tcp không có flow
+W_PCRE = 30              # mỗi pcre
+W_PCRE_UNANCHORED = 20   # pcre không có content đi kèm
+MIN_FP_LEN = 4
+
+
+def _content_len(value: str) -> int:
+    """Độ dài byte của giá trị content 'ab|41 42|c' (hex trong |..| tính theo byte)."""
+    n, raw, i = 0, value, 0
+    while i < len(raw):
+        if raw[i] == "|":
+            j = raw.find("|", i + 1)
+            if j < 0:
+                break
+            n += len(raw[i + 1:j].split())
+            i = j + 1
+        else:
+            n += 1
+            i += 2 if raw[i] == "\\" else 1
+    return n
+
+
+def lint_rule(rule_text: str, ir: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Chấm điểm chi phí tĩnh của 1 rule (càng cao càng đắt cho sensor).
+    ir: IR đã parse sẵn (snort_parser.parse_rule) nếu có, tránh parse lại.
+    Trả về {"score", "reasons", "fast_pattern_len", "over_budget"}.
+    """
+    if ir is None:
+        try:
+            ir = parse_rule(rule_text)
+        except SnortParseError:
+            return {"score": 0, "reasons": ["unparsed"], "fast_pattern_len": 0, "over_budget": False}
+    proto = ir["protocol"]
+    kws = set(ir["keywords"])
+
+    score, reasons = 0, []
+    def add(w: int, why: str):
+        nonlocal score
+        score += w
+        reasons.append(f"{why}(+{w})")
+
+    if W_PROTO.get(proto):
+        add(W_PROTO[proto], f"proto:{proto}")
+    if ir["sport"] == "any" and ir["dport"] == "any" and proto in W_PROTO:
+        add(W_ANY_PORTS, "ports:any")
+    if ir["src"] == "any" and ir["dst"] == "any" and proto in W_PROTO:
+        add(W_ANY_ADDRS, "addrs:any")
+
+    # content: (len, sticky, fast_pattern) — sticky = nằm trong buffer đã parse, không phải full packet
+    contents = [(_content_len(c["value"]), c["buffer"] is not None, c["fast_pattern"])
+                for c in ir["contents"] if not c["negated"]]
+    pcres = len(ir["pcres"])
+    payload_opts = len(kws & PAYLOAD_OPTIONS)
+
+    # fast pattern: content được đánh dấu, nếu không thì Snort chọn content dài nhất
+    fp = [c for c in contents if c[2]] or sorted(contents, key=lambda c: c[0], reverse=True)[:1]
+    fp_len = fp[0][0] if fp else 0
+    if not contents:
+        if payload_opts:
+            add(W_NO_CONTENT, "no_content")
+    else:
+        if fp_len < MIN_FP_LEN:
+            add(W_SHORT_FP, f"short_fast_pattern:{fp_len}")
+        if not fp[0][1]:
+            add(W_RAW_BUFFER, "raw_buffer")
+    if proto == "tcp" and not ir["flow"]:
+        add(W_NO_FLOW, "no_flow")
+    if pcres:
+        add(W_PCRE * pcres, f"pcre:{pcres}")
+        if not contents:
+            add(W_PCRE_UNANCHORED, "pcre_unanchored")
+
+    return {
+        "score": score,
+        "reasons": reasons,
+        "fast_pattern_len": fp_len,
+        "over_budget": score > RULE_COST_BUDGET,
+    }
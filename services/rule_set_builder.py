@@ -2,8 +2,9 @@ from datetime import datetime
 from pathlib import Path
 from hashlib import sha256
 from tempfile import TemporaryDirectory
-import tarfile, os
+import tarfile, os, json
 from bson import ObjectId
+from app.services.rule_linter import lint_rule
 from app.database.collections import (
     col_rule_sets,
     col_rule_set_items,
@@ -32,25 +33,51 @@ def build_files_for_rule_set(version: str, engine: str | None = None) -> dict:
     if not rs:
         raise ValueError("rule_set not found")
 
-    # 1) lấy danh sách rule_item_id từ rule_set_items
-    set_items = list(
-        col_rule_set_items.find(
-            {"rule_set_id": rs["_id"]}, {"rule_item_id": 1, "_id": 0}
-        )
+    # 1) lấy danh sách item_id từ rule_set_items (link lưu set_version + item_id dạng str)
+    set_items = col_rule_set_items.find(
+        {"set_version": rs["version"]}, {"item_id": 1, "_id": 0}
     )
-    rule_item_ids = [si["rule_item_id"] for si in set_items]
+    rule_item_ids = [ObjectId(si["item_id"]) for si in set_items if ObjectId.is_valid(si.get("item_id", ""))]
 
-    # 2) build file console.rules tạm
+    # 2) build file console.rules (+ console.blocklist, ioc_index.json) tạm
+    # ioc_index.json: sidecar map sid / IP -> MISP attribute để truy ngược alert
+    ioc_index = {"rules": {}, "blocklist": {}}
+    blocklist: set = set()
+    cost = {"cost_total": 0, "cost_max": 0, "cost_over_budget": 0}
     with TemporaryDirectory() as tmpdir:
         rules_file = Path(tmpdir) / "console.rules"
         with open(rules_file, "w", encoding="utf-8") as f:
             cursor = col_rule_items.find(
-                {"_id": {"$in": rule_item_ids}}, {"rule_text": 1}
+                {"_id": {"$in": rule_item_ids}}, {"rule_text": 1, "sid": 1, "metadata": 1, "cost": 1}
             )
             for doc in cursor:
+                meta = doc.get("metadata") or {}
+                members = meta.get("members") or []
+                if meta.get("ip_mode") == "reputation":
+                    for m in members:
+                        blocklist.add(m["ip"])
+                        ioc_index["blocklist"].setdefault(m["ip"], []).append(m)
+                    continue
                 text = (doc.get("rule_text") or "").strip()
                 if text:
                     f.write(text + "\n")
+                    c = doc.get("cost") or lint_rule(text)
+                    cost["cost_total"] += c.get("score", 0)
+                    cost["cost_max"] = max(cost["cost_max"], c.get("score", 0))
+                    cost["cost_over_budget"] += bool(c.get("over_budget"))
+                    ioc_index["rules"][str(doc.get("sid"))] = members or [{
+                        "event_id": meta.get("event_id"), "attr_id": meta.get("attr_id"),
+                    }]
+
+        blocklist_file = Path(tmpdir) / "console.blocklist"
+        if blocklist:
+            with open(blocklist_file, "w", encoding="utf-8") as f:
+                for ip in sorted(blocklist):
+                    f.write(ip + "\n")
+
+        index_file = Path(tmpdir) / "ioc_index.json"
+        with open(index_file, "w", encoding="utf-8") as f:
+            json.dump(ioc_index, f, default=str)
 
         # 3) nén thành snort3_<version>.tgz
         out_dir = Path(RULE_BASE_DIR)
@@ -58,6 +85,9 @@ def build_files_for_rule_set(version: str, engine: str | None = None) -> dict:
         tgz_path = out_dir / f"{engine}_{version}.tgz"
         with tarfile.open(tgz_path, mode="w:gz") as tar:
             tar.add(rules_file, arcname="console.rules")
+            if blocklist:
+                tar.add(blocklist_file, arcname="console.blocklist")
+            tar.add(index_file, arcname="ioc_index.json")
 
     # 4) sha256
     digest = _compute_sha256(tgz_path)
@@ -71,9 +101,28 @@ def build_files_for_rule_set(version: str, engine: str | None = None) -> dict:
                 "sha256": digest,
             }
         },
+        "blocklist_count": len(blocklist),
+        **cost,
         "active": False,          # mới build, chưa deploy
         "status": "built",        
     }
     col_rule_sets.update_one({"_id": rs["_id"]}, {"$set": update})
     rs.update(update)
-    return rs
\ No newline at end of file
+    return rs
+
+def build_summary(rs: dict) -> dict:
+    """rule_sets doc (sau build) -> dict cho RuleSetBuildResponse (serializable, dùng được qua process pool)."""
+    tar_info = (rs.get("files") or {}).get("tar") or {}
+    return {
+        "id": str(rs["_id"]),
+        "version": rs["version"],
+        "build_time": rs["build_time"].isoformat(),
+        "path": tar_info.get("path", ""),
+        "sha256": tar_info.get("sha256", ""),
+        "item_count": rs.get("item_count", 0),
+        "status": rs.get("status", "ready"),
+        "active": rs.get("active", False),
+        "cost_total": rs.get("cost_total", 0),
+        "cost_max": rs.get("cost_max", 0),
+        "cost_over_budget": rs.get("cost_over_budget", 0),
+    }
@@ -1,16 +1,29 @@
 from typing import List, Dict, Any, Tuple
 from bson import ObjectId
 from datetime import datetime
-import os
+import os, re, time
 
 from app.database.collections import (
     col_iocs, col_events, col_rule_items, col_rule_sets,
-    col_rule_set_items, next_sid
+    col_rule_set_items, next_sid, next_sids
 )
 from app.models.rule_models import RuleItem, RuleSet, RuleSetItem
-from app.services.rule_converter import ioc_to_rule
+from app.services.rule_linter import lint_rule, RULE_COST_ACTION
+from app.services.misp_stats import bump
+from app.services.alert_enrichment import invalidate as invalidate_enrichment
+from app.services.rule_converter import (
+    iocs_to_rules, ip_ioc_key, ip_iocs_to_group_rules, sha1_hex, IP_RULE_MODE, IP_RULE_MODES
+)
+from app.services.metrics import Counter, Histogram, JOB_BUCKETS
 
 CONVERTED_TAG = os.getenv("CONVERTED_TAG") or "console:converted"
+# IOC có rule bị cost guard giữ lại (quarantine / block): không chọn lại ở lần convert only_new sau
+COST_REJECTED_TAG = os.getenv("COST_REJECTED_TAG") or "console:cost-rejected"
+_SID_OPT = re.compile(r"\bsid\s*:\s*\d+\s*;")
+
+CONVERT_SECONDS = Histogram("rule_convert_seconds", "Thời gian convert IOC -> rule của 1 event", ("ip_mode",), JOB_BUCKETS)
+CONVERT_IOCS = Counter("rule_convert_iocs_total", "IOC đọc để convert: converted / rejected (cost guard)", ("result",))
+CONVERT_RULES = Counter("rule_convert_rules_total", "Rule đưa vào rule set / bị cost guard giữ lại", ("result",))
 
 
 # Version: YYYY.MM.DD-HHMMSS-e<event_id>[-NN] (duy nhất)
@@ -43,11 +56,15 @@ def upsert_rule_item(rule_doc: Dict[str, Any]) -> str:
         dst_sel=rule_doc["dst_sel"],
         buffers=rule_doc.get("buffers", []),
         keywords=rule_doc.get("keywords", []),
+        options=rule_doc.get("options", []),
+        contents=rule_doc.get("contents", []),
         flow=rule_doc.get("flow", {}),
         flowbits=rule_doc.get("flowbits", {}),
         references=rule_doc.get("references", []),
         metadata=rule_doc.get("metadata", {}),
         mitre=rule_doc.get("mitre", []),
+        cost=rule_doc.get("cost", {}),
+        status=rule_doc.get("status", "active"),
         classtype=rule_doc.get("classtype", "trojan-activity"),
         priority=rule_doc.get("priority", 1),
         gid=1,
@@ -58,7 +75,38 @@ def upsert_rule_item(rule_doc: Dict[str, Any]) -> str:
     return str(res.inserted_id)
 
 
-def build_rules_for_event(event_id: int, only_new: bool = True) -> Dict[str, Any]:
+def _apply_cost_guard(rule_payload: Dict[str, Any], guard: Dict[str, Any]) -> bool:
+    """
+    Lint rule_payload (ghi kết quả vào 'cost'); cập nhật thống kê guard.
+    Trả về True nếu rule được đưa vào set.
+    Rule vượt budget: block -> bỏ; quarantine -> vẫn lưu rule_item (status=quarantined) để review.
+    """
+    cost = lint_rule(rule_payload["rule_text"])
+    rule_payload["cost"] = cost
+    if not cost["over_budget"] or RULE_COST_ACTION == "off":
+        guard["cost_total"] += cost["score"]
+        guard["cost_max"] = max(guard["cost_max"], cost["score"])
+        return True
+    if RULE_COST_ACTION == "block":
+        guard["blocked"] += 1
+        return False
+    # rule_hash gồm rule_text (có sid mới cấp) -> hash bỏ sid để lần convert lại không nhân bản item quarantine;
+    # rule không có sid trong text (reputation: text rỗng) giữ rule_hash của converter (theo IP, không theo sid)
+    rule_payload["status"] = "quarantined"
+    text = rule_payload["rule_text"]
+    if _SID_OPT.search(text):
+        rule_payload["rule_hash"] = sha1_hex("quarantined|" + _SID_OPT.sub("", text))
+    upsert_rule_item(rule_payload)
+    guard["quarantined"] += 1
+    return False
+
+
+def build_rules_for_event(event_id: int, only_new: bool = True, ip_mode: str | None = None) -> Dict[str, Any]:
+    ip_mode = (ip_mode or IP_RULE_MODE).lower()
+    if ip_mode not in IP_RULE_MODES:
+        raise ValueError(f"invalid ip_mode: {ip_mode}")
+
+    t0 = time.perf_counter()
     event = col_events.find_one({"event_id": int(event_id)}) or {}
     event_uuid = event.get("uuid", "")
 
@@ -72,25 +120,74 @@ def build_rules_for_event(event_id: int, only_new: bool = True) -> Dict[str, Any
     }
     
     if only_new:
-        ioc_filter["tags"] = {"$ne": CONVERTED_TAG}
+        ioc_filter["tags"] = {"$nin": [CONVERTED_TAG, COST_REJECTED_TAG]}
 
     cur = col_iocs.find(
         ioc_filter,
-        {"_id": 1, "type": 1, "value": 1, "event_uuid": 1, "event_id": 1, "attr_id": 1, "source": 1}
+        {"_id": 1, "uuid": 1, "type": 1, "value": 1, "event_uuid": 1, "event_id": 1, "attr_id": 1, "source": 1, "tags": 1}
     )
 
     made_links: List[Tuple[str, int]] = []   # (rule_item_id, sid)
     touched_ioc_ids: List[ObjectId] = []
+    rejected_ioc_ids: List[ObjectId] = []    # rule bị cost guard giữ lại
+    ip_iocs: List[Dict[str, Any]] = []       # gom lại khi ip_mode != single
+    guard = {"cost_total": 0, "cost_max": 0, "quarantined": 0, "blocked": 0}
 
+    rule_iocs: List[Dict[str, Any]] = []
+    already_converted = set()                # only_new=False -> không đếm lại vào stats
     for ioc in cur:
-        sid = next_sid()
-        rule_payload = ioc_to_rule(ioc, sid)  # trả về rule_text, rule_hash, msg, ...
-        rule_id = upsert_rule_item({**rule_payload, "sid": sid})
+        if CONVERTED_TAG in (ioc.get("tags") or []):
+            already_converted.add(ioc["_id"])
+        if ip_mode != "single" and ip_ioc_key(ioc):
+            ip_iocs.append(ioc)
+        else:
+            rule_iocs.append(ioc)
+
+    # cấp sid theo block + convert theo batch (since_version tính 1 lần)
+    sids = next_sids(len(rule_iocs))
+    for ioc, sid, rule_payload in zip(rule_iocs, sids, iocs_to_rules(rule_iocs, sids)):
+        rule_payload["sid"] = sid   # trả về rule_text, rule_hash, msg, ...
+        if not _apply_cost_guard(rule_payload, guard):
+            rejected_ioc_ids.append(ioc["_id"])
+            continue
+        rule_id = upsert_rule_item(rule_payload)
         made_links.append((rule_id, sid))
         touched_ioc_ids.append(ioc["_id"])
 
+    if ip_iocs:
+        # IOC của từng group rule lấy theo metadata.members (uuid) -> converted / rejected theo kết quả guard của group
+        id_by_uuid = {ioc.get("uuid"): ioc["_id"] for ioc in ip_iocs}
+        for rule_payload in ip_iocs_to_group_rules(ip_iocs, next_sid, mode=ip_mode):
+            sid = rule_payload["sid"]
+            member_ids = list(dict.fromkeys(id_by_uuid[m["uuid"]] for m in rule_payload["metadata"]["members"]
+                                            if m.get("uuid") in id_by_uuid))
+            if not _apply_cost_guard(rule_payload, guard):
+                rejected_ioc_ids.extend(member_ids)
+                continue
+            rule_id = upsert_rule_item(rule_payload)
+            made_links.append((rule_id, sid))
+            touched_ioc_ids.extend(member_ids)
+
+    # sid mới (có thể đã bị cache "không tìm thấy" nếu alert tới trước) + event vừa đổi
+    invalidate_enrichment(sids=[sid for _, sid in made_links], event_ids=[int(event_id)])
+    CONVERT_SECONDS.labels(ip_mode).observe(time.perf_counter() - t0)
+    CONVERT_IOCS.labels("converted").inc(len(set(touched_ioc_ids)))
+    CONVERT_IOCS.labels("rejected").inc(len(set(rejected_ioc_ids)))
+    CONVERT_RULES.labels("linked").inc(len(made_links))
+    for k in ("quarantined", "blocked"):
+        CONVERT_RULES.labels(k).inc(guard[k])
+
+    # đánh dấu IOC bị cost guard giữ lại (kể cả khi không tạo set) -> không cấp sid / quarantine lại mỗi lần convert;
+    # convert lại sau khi nới budget: only_new=False
+    if rejected_ioc_ids:
+        col_iocs.update_many(
+            {"_id": {"$in": rejected_ioc_ids}},
+            {"$addToSet": {"tags": COST_REJECTED_TAG},
+             "$set": {"cost_rejected_at": datetime.utcnow(), "cost_action": RULE_COST_ACTION}},
+        )
+
     if not made_links:
-        return {"set_id": None, "count": 0, "version": None, "event_id": int(event_id), "status": "noop"}
+        return {"set_id": None, "count": 0, "version": None, "event_id": int(event_id), "status": "noop", **guard}
 
     # Tạo RuleSet
     version = _new_unique_version(event_id)
@@ -101,6 +198,8 @@ def build_rules_for_event(event_id: int, only_new: bool = True) -> Dict[str, Any
         event_uuid=str(event_uuid),
         item_count=len(made_links),
         status="ready",
+        cost_total=guard["cost_total"],
+        cost_max=guard["cost_max"],
     ).model_dump()
     set_id = str(col_rule_sets.insert_one(rs).inserted_id)
 
@@ -126,6 +225,10 @@ def build_rules_for_event(event_id: int, only_new: bool = True) -> Dict[str, Any
                 }
             }
         )
+        bump({"converted": len(set(touched_ioc_ids) - already_converted)})
+        # convert lại (only_new=False) thành công -> gỡ dấu cost-rejected cũ
+        col_iocs.update_many({"_id": {"$in": touched_ioc_ids}, "tags": COST_REJECTED_TAG},
+                             {"$pull": {"tags": COST_REJECTED_TAG}})
 
     # Cập nhật event
     col_events.update_one(
@@ -142,11 +245,17 @@ def build_rules_for_event(event_id: int, only_new: bool = True) -> Dict[str, Any
         upsert=False
     )
 
-    return {"set_id": set_id, "count": len(made_links), "version": version, "event_id": int(event_id), "status": "ok"}
+    return {
+        "set_id": set_id, "count": len(made_links), "version": version, "event_id": int(event_id),
+        "ioc_count": len(touched_ioc_ids), "ip_mode": ip_mode, "status": "ok", **guard,
+    }
 
 
-def build_rules_for_all_new() -> List[Dict[str, Any]]:
-    """Mỗi event tạo 1 set; chỉ convert IOC (to_ids=true HOẶC type=snort với value chứa alert) CHƯA có tag console:converted."""
+def build_rules_for_all_new(ip_mode: str | None = None) -> List[Dict[str, Any]]:
+    """
+    Mỗi event tạo 1 set; chỉ convert IOC (to_ids=true HOẶC type=snort với value chứa alert)
+    CHƯA có tag console:converted / console:cost-rejected.
+    """
     results: List[Dict[str, Any]] = []
     event_ids = col_iocs.distinct(
         "event_id",
@@ -155,9 +264,9 @@ def build_rules_for_all_new() -> List[Dict[str, Any]]:
                 {"to_ids": True},
                 {"type": "snort", "value": {"$regex": "alert", "$options": "i"}}
             ],
-            "tags": {"$ne": CONVERTED_TAG}
+            "tags": {"$nin": [CONVERTED_TAG, COST_REJECTED_TAG]}
         }
     )
     for eid in event_ids:
-        results.append(build_rules_for_event(int(eid), only_new=True))
+        results.append(build_rules_for_event(int(eid), only_new=True, ip_mode=ip_mode))
     return results
@@ -0,0 +1,183 @@
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+# Tokenizer 1 lượt cho rule Snort (2/3) -> IR dạng dict để lưu rule_items
+#   alert tcp $HOME_NET any -> $EXTERNAL_NET 80 (msg:"..."; content:"a", fast_pattern; sid:1;)
+#   alert http (msg:"..."; ...)                  # snort3 service rule, header rút gọn
+
+ACTIONS = {"alert", "log", "pass", "drop", "reject", "sdrop", "block", "rewrite", "react"}
+
+# sticky buffer (snort3): áp dụng cho các content/pcre đứng SAU nó
+BUFFER_KEYWORDS = {
+    "http_uri", "http_raw_uri", "http_header", "http_raw_header", "http_method",
+    "http_cookie", "http_raw_cookie", "http_client_body", "http_raw_body",
+    "http_stat_code", "http_stat_msg", "http_true_ip", "http_version",
+    "http_param", "http_raw_request", "http_raw_status", "http_trailer",
+    "tls_sni", "ssl_state", "ssl_version", "dns_query",
+    "file_data", "pkt_data", "raw_data", "js_data", "vba_data",
+    "sip_header", "sip_body", "sip_method", "sip_stat_code", "base64_data",
+}
+CONTENT_MODIFIERS = {"nocase", "rawbytes", "depth", "offset", "distance", "within", "fast_pattern"}
+
+
+class SnortParseError(ValueError):
+    pass
+
+
+# 1 option = name[:arg]; arg có thể chứa "..." (kể cả ';' và \" bên trong)
+_OPT_TOKEN_RE = re.compile(r'\s*([A-Za-z_][\w.-]*)\s*(?::\s*((?:"(?:[^"\\]++|\\.)*+"|[^;"]++)*+))?;')
+_HDR_TOKEN_RE = re.compile(r'!?\[(?:[^\[\]]|\[[^\]]*\])*\]|\S+')
+_QUOTED_RE = re.compile(r'"((?:[^"\\]++|\\.)*+)"')
+
+
+def _split_options(body: str) -> List[Tuple[str, str]]:
+    """Tách 'a:b; c; d:"x;y";' -> [(a,b),(c,''),(d,'"x;y"')] trong 1 lượt quét (regex compile sẵn)."""
+    body = body.strip()
+    if body and body[-1] != ";":
+        body += ";"
+    out: List[Tuple[str, str]] = []
+    pos = 0
+    for m in _OPT_TOKEN_RE.finditer(body):
+        if m.start() != pos:
+            break
+        arg = m.group(2)
+        out.append((m.group(1).lower(), arg.strip() if arg else ""))
+        pos = m.end()
+    if body[pos:].strip():
+        raise SnortParseError(f"invalid option near: {body[pos:pos + 40]!r}")
+    return out
+
+
+def _split_header(hdr: str) -> List[str]:
+    """Tách header theo khoảng trắng, giữ nguyên list '[a, b]'."""
+    if "[" not in hdr:
+        return hdr.split()
+    return _HDR_TOKEN_RE.findall(hdr)
+
+
+def _unquote(arg: str) -> str:
+    if len(arg) >= 2 and arg[0] == '"' and arg[-1] == '"':
+        return arg[1:-1]
+    return arg
+
+
+def _content_value(arg: str) -> Tuple[str, bool, List[str]]:
+    """content:!"abc", nocase, fast_pattern -> ("abc", negated, ["nocase","fast_pattern"])"""
+    negated = arg.startswith("!")
+    if negated:
+        arg = arg[1:].lstrip()
+    m = _QUOTED_RE.match(arg)
+    if m:
+        value, rest = m.group(1), arg[m.end():]
+    else:
+        value, _, rest = arg.partition(",")
+    mods = [x.strip() for x in rest.split(",") if x.strip()]
+    return value, negated, mods
+
+
+def _find_options_start(text: str) -> int:
+    i = text.find("(")
+    if i < 0:
+        raise SnortParseError("missing option block")
+    return i
+
+
+def parse_rule(text: str) -> Dict[str, Any]:
+    """
+    Parse 1 rule -> IR:
+    {action, protocol, src, sport, direction, dst, dport, options:[{name,arg}],
+     msg, gid, sid, rev, classtype, priority, buffers, contents, pcres,
+     flow, flowbits, references, metadata, keywords}
+    """
+    s = (text or "").strip()
+    start = _find_options_start(s)
+    end = s.rfind(")")
+    if end < start:
+        raise SnortParseError("unbalanced option block")
+
+    hdr = _split_header(s[:start])
+    if not hdr or hdr[0].lower() not in ACTIONS:
+        raise SnortParseError("unknown rule action")
+    if len(hdr) == 7 and hdr[4] in ("->", "<>"):
+        action, proto, src, sport, direction, dst, dport = hdr
+    elif len(hdr) == 2:
+        action, proto = hdr
+        src = sport = dst = dport = "any"
+        direction = "->"
+    else:
+        raise SnortParseError("invalid rule header")
+
+    options = _split_options(s[start + 1:end])
+
+    ir: Dict[str, Any] = {
+        "action": action.lower(), "protocol": proto.lower(),
+        "src": src, "sport": sport, "direction": direction, "dst": dst, "dport": dport,
+        "options": [{"name": n, "arg": a} for n, a in options],
+        "msg": None, "gid": 1, "sid": None, "rev": 1,
+        "classtype": None, "priority": None,
+        "buffers": [], "contents": [], "pcres": [],
+        "flow": {}, "flowbits": {}, "references": [], "metadata": {},
+        "keywords": [],
+    }
+
+    buf: Optional[str] = None
+    seen = set()
+    for name, arg in options:
+        if name not in seen:
+            seen.add(name); ir["keywords"].append(name)
+
+        if name == "msg":
+            ir["msg"] = _unquote(arg)
+        elif name in ("sid", "gid", "rev", "priority"):
+            try:
+                ir[name] = int(arg)
+            except ValueError:
+                raise SnortParseError(f"invalid {name}: {arg}")
+        elif name == "classtype":
+            ir["classtype"] = arg
+        elif name in BUFFER_KEYWORDS:
+            buf = None if name in ("pkt_data", "raw_data") else name
+        elif name == "content":
+            value, negated, mods = _content_value(arg)
+            ir["contents"].append({
+                "value": value, "buffer": buf, "negated": negated,
+                "modifiers": mods, "fast_pattern": "fast_pattern" in mods,
+            })
+            if buf:
+                ir["buffers"].append({"name": buf, "content": value})
+        elif name in CONTENT_MODIFIERS and ir["contents"]:
+            last = ir["contents"][-1]
+            last["modifiers"].append(f"{name}:{arg}" if arg else name)
+            if name == "fast_pattern":
+                last["fast_pattern"] = True
+        elif name in ("pcre", "regex"):
+            ir["pcres"].append({"value": _unquote(arg.split(",")[0].strip()), "buffer": buf})
+        elif name == "flow":
+            ir["flow"] = {"raw": arg, "opts": [o.strip() for o in arg.split(",") if o.strip()]}
+        elif name == "flowbits":
+            cmd, _, bits = arg.partition(",")
+            ir["flowbits"].setdefault(cmd.strip(), []).extend(
+                b.strip() for b in bits.replace("&", "|").split("|") if b.strip()
+            )
+        elif name == "reference":
+            rtype, _, rval = arg.partition(",")
+            ir["references"].append({"type": rtype.strip(), "value": rval.strip()})
+        elif name == "metadata":
+            for kv in arg.split(","):
+                k, _, v = kv.strip().partition(" ")
+                if k:
+                    ir["metadata"].setdefault(k, []).append(v.strip())
+    return ir
+
+
+def render_options(ir: Dict[str, Any]) -> str:
+    """IR options -> 'a:b; c; d:e;' (chuẩn hoá spacing)."""
+    return "; ".join(o["name"] + (f":{o['arg']}" if o["arg"] else "") for o in ir["options"]) + ";"
+
+
+def render_rule(ir: Dict[str, Any]) -> str:
+    if ir["src"] == "any" and ir["dst"] == "any" and ir["sport"] == "any" and ir["dport"] == "any" \
+            and ir["protocol"] not in ("ip", "tcp", "udp", "icmp"):
+        return f'{ir["action"]} {ir["protocol"]} ({render_options(ir)})'
+    return (f'{ir["action"]} {ir["protocol"]} {ir["src"]} {ir["sport"]} {ir["direction"]} '
+            f'{ir["dst"]} {ir["dport"]} ({render_options(ir)})')
@@ -0,0 +1,17 @@
+"""Fixture chung: ids_alerts / leases trên mongomock, ARCHIVE_DIR tạm."""
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from app.database import collections
+from app.services import alert_archive
+
+
+@pytest.fixture
+def alerts(monkeypatch, tmp_path):
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(alert_archive, "col_ids_alerts", db.ids_alerts)
+    monkeypatch.setattr(collections, "col_leases", db.leases)
+    monkeypatch.setattr(alert_archive, "ARCHIVE_DIR", tmp_path)
+    return db.ids_alerts
+
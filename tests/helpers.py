@@ -0,0 +1,12 @@
+"""Helper dựng dữ liệu test dùng chung (import được, khác conftest chỉ để pytest nạp fixture)."""
+from datetime import datetime
+
+from app.api.helpers import _normalize
+
+
+def snort_alert(**kw):
+    a = _normalize({"timestamp": datetime.utcnow().strftime("%m/%d-%H:%M:%S.%f"), "sensor_id": "s1",
+                    "rule": "1:3000001:1", "src_addr": "10.0.0.1", "src_port": 40000,
+                    "dst_addr": "192.0.2.10", "dst_port": 443})
+    a.update(kw)
+    return a
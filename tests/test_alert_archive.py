@@ -0,0 +1,57 @@
+"""
+Archive chọn alert theo thời điểm ingest (_id), không theo `ts` sensor gửi.
+
+Cần mongomock + pyarrow; chạy từ thư mục cha của package (import app.*):
+    python -m pytest app/tests
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pyarrow")
+
+from bson import ObjectId
+
+from app.api.helpers import _parse_ts
+from app.database import collections
+from app.services import alert_archive
+from app.tests.helpers import snort_alert
+
+
+def test_parse_ts_snort_format():
+    assert _parse_ts("10/24-06:41:36.678258").endswith("-10-24T06:41:36.678258")
+    assert _parse_ts("2026-01-02T03:04:05") == "2026-01-02T03:04:05"
+
+
+def test_fresh_snort_alert_not_archived(alerts):
+    fresh = snort_alert(_id=ObjectId())
+    fresh["ts"] = "10/19-06:41:36.678258"     # ts thô kiểu Snort (dữ liệu cũ trước khi sửa _parse_ts)
+    alerts.insert_one(fresh)
+
+    res = alert_archive.archive(days=90)
+
+    assert res["alerts"] == 0
+    assert alerts.count_documents({}) == 1
+
+
+def test_old_alert_archived(alerts):
+    old_id = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(days=100))
+    alerts.insert_many([snort_alert(_id=old_id), snort_alert(_id=ObjectId())])
+
+    res = alert_archive.archive(days=90)
+
+    assert res["alerts"] == 1
+    assert alerts.count_documents({"_id": old_id}) == 0
+    assert alert_archive.load_manifest()[0]["rows"] == 1
+
+
+def test_archive_skips_when_lease_held(alerts):
+    alerts.insert_one(snort_alert(_id=ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(days=100))))
+    assert collections.acquire_lease("alert-archive", 60, owner="other-host:1")
+
+    res = alert_archive.archive(days=90)
+
+    assert res["alerts"] == 0 and res["skipped"]
+    assert alerts.count_documents({}) == 1
+
@@ -0,0 +1,37 @@
+"""enrich_many: spool degraded -> không query Mongo, không cache "không tìm thấy"."""
+from types import SimpleNamespace
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from app.services import alert_enrichment, alert_spool
+
+
+@pytest.fixture
+def rules_db(monkeypatch):
+    db = mongomock.MongoClient().db
+    db.rule_items.insert_one({"sid": 3000001, "gid": 1, "metadata": {"event_id": 7, "attr_id": 70}})
+    db.events.insert_one({"event_id": 7, "uuid": "ev-7", "info": "phish", "tags": []})
+    for name, col in (("col_rule_items", db.rule_items), ("col_events", db.events), ("col_iocs", db.iocs)):
+        monkeypatch.setattr(alert_enrichment, name, col)
+    alert_enrichment.invalidate()
+    yield db
+    alert_enrichment.invalidate()
+
+
+def test_degraded_spool_skips_loads_without_negative_cache(rules_db, monkeypatch):
+    spool = SimpleNamespace(degraded=True)
+    monkeypatch.setattr(alert_spool, "_spool", spool)
+    queried = []
+    find = rules_db.rule_items.find
+    monkeypatch.setattr(alert_enrichment.col_rule_items, "find", lambda *a, **k: queried.append(a) or find(*a, **k))
+
+    [a] = alert_enrichment.enrich_many([{"rule_id": "1:3000001:1"}])
+    assert a["sid"] == 3000001 and "misp" not in a
+    assert not queried
+
+    spool.degraded = False          # Mongo hồi phục -> sid chưa bị cache "không tìm thấy", nạp lại được
+    [a] = alert_enrichment.enrich_many([{"rule_id": "1:3000001:1"}])
+    assert len(queried) == 1
+    assert a["misp"]["event_id"] == 7 and a["misp"]["event_uuid"] == "ev-7"
@@ -0,0 +1,23 @@
+"""Export lọc khoảng thời gian theo thời điểm ingest (_id)."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("mongomock")
+
+from bson import ObjectId
+
+from app.services import alert_export
+from app.tests.helpers import snort_alert
+
+
+def test_export_window_uses_ingest_time(alerts, monkeypatch):
+    monkeypatch.setattr(alert_export, "col_ids_alerts", alerts)
+    alerts.insert_one(snort_alert(_id=ObjectId()))
+    now = datetime.now(timezone.utc)
+
+    hit = alert_export.export_filter(since=now - timedelta(hours=1), until=now + timedelta(hours=1))
+    miss = alert_export.export_filter(since=now - timedelta(days=2), until=now - timedelta(days=1))
+
+    assert alerts.count_documents(hit) == 1
+    assert alerts.count_documents(miss) == 0
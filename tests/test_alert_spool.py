@@ -0,0 +1,83 @@
+"""Spool: record lỗi dữ liệu -> dead-letter (không kẹt degraded), slot riêng / worker, adopt slot mồ côi."""
+import bson
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from app.services import alert_spool
+from app.services.alert_spool import AlertSpool, _claim_slot, _unlock
+
+
+@pytest.fixture
+def written(monkeypatch):
+    out = []
+
+    def write(docs, folds):
+        if any(d.get("bad") for d in docs):
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "Document failed validation"}]})
+        out.extend(docs)
+        return len(docs)
+    monkeypatch.setattr(alert_spool, "write_alerts", write)
+    return out
+
+
+def _spool(root):
+    sp = AlertSpool(root)
+    sp.open()
+    return sp
+
+
+def test_poison_record_moves_to_dead_letter(tmp_path, written):
+    sp = _spool(tmp_path / "w0")
+    sp.append([{"_id": 1, "bad": True}], [])
+    sp.append([{"_id": 2}], [])
+
+    for _ in range(alert_spool.SPOOL_MAX_ATTEMPTS - 1):
+        with pytest.raises(BulkWriteError):
+            sp.drain_once()
+    assert sp.drain_once() == 1
+
+    assert [d["_id"] for d in written] == [2]
+    assert not sp.degraded and sp.pending_bytes() == 0
+    assert sp.stats["dead_lettered"] == 1
+    rec = bson.decode((tmp_path / "w0" / "dead-letter.log").read_bytes()[alert_spool._HDR.size:])
+    assert rec["docs"] == [{"_id": 1, "bad": True}] and rec["write_errors"] == ["Document failed validation"]
+    sp.close()
+
+
+def test_transient_error_never_dead_letters(tmp_path, monkeypatch):
+    def down(docs, folds):
+        raise AutoReconnect("connection refused")
+    monkeypatch.setattr(alert_spool, "write_alerts", down)
+    sp = _spool(tmp_path / "w0")
+    sp.append([{"_id": 1}], [])
+
+    for _ in range(alert_spool.SPOOL_MAX_ATTEMPTS + 2):
+        with pytest.raises(AutoReconnect):
+            sp.drain_once()
+
+    assert sp.degraded and sp.pending_bytes() > 0
+    assert not (tmp_path / "w0" / "dead-letter.log").exists()
+    sp.close()
+
+
+def test_each_process_gets_own_slot(tmp_path):
+    (a, fa), (b, fb) = _claim_slot(tmp_path), _claim_slot(tmp_path)
+    assert (a.name, b.name) == ("w0", "w1")
+    _unlock(fa)
+    c, fc = _claim_slot(tmp_path)
+    assert c.name == "w0"
+    _unlock(fb); _unlock(fc)
+
+
+def test_orphan_slot_is_adopted(tmp_path, written):
+    orphan = _spool(tmp_path / "w3")          # worker đã thoát, còn dữ liệu chưa replay
+    orphan.append([{"_id": 7}], [])
+    orphan.close()
+
+    root, fd = _claim_slot(tmp_path)
+    sp = AlertSpool(root, base=tmp_path)
+    sp.open()
+    assert sp.adopt_orphans() == 1
+    assert [d["_id"] for d in written] == [7]
+    assert not list((tmp_path / "w3").glob("seg-*.log"))
+    sp.close(); _unlock(fd)
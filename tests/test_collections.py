@@ -0,0 +1,20 @@
+"""ensure_indexes: index lỗi không chặn các index sau."""
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from app.database import collections
+
+
+def test_failed_index_does_not_abort_the_rest(monkeypatch):
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(collections, "_INDEXES",
+                        [(db[col.name], keys, opts) for col, keys, opts in collections._INDEXES])
+    db.sensor_infor.insert_many([{"sensor_id": "s1"}, {"sensor_id": "s1"}])     # dữ liệu cũ đang trùng
+
+    failed = collections.ensure_indexes()
+
+    assert [(f["collection"], f["keys"]) for f in failed] == [("sensor_infor", "sensor_id")]
+    # index khai báo sau sensor_infor vẫn được tạo
+    assert "payload.sha256_1" in db.ids_alerts.index_information()
+    assert "uuid_1" in db.iocs.index_information()
@@ -0,0 +1,50 @@
+"""IOCIndex.refresh: copy-and-swap (không sửa bảng reader đang giữ) và watermark có overlap."""
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from app.services.ioc_index import IOCIndex
+
+
+def _ioc(uuid, value, pulled_at, type_="ip-dst"):
+    return {"uuid": uuid, "type": type_, "value": value, "event_id": 1, "to_ids": True,
+            "norm": {"ip": value}, "source": {"pulled_at": pulled_at}}
+
+
+def test_refresh_swaps_tables_instead_of_mutating():
+    col = mongomock.MongoClient().db.iocs
+    now = datetime.utcnow()
+    col.insert_many([_ioc("u1", "198.51.100.1", now), _ioc("c1", "10.0.0.0/8", now)])
+    idx = IOCIndex()
+    idx.rebuild(col)
+    exact, cidr, octets = idx.exact, idx.cidr, idx.cidr_octets
+    snap = (dict(exact), {p: dict(n) for p, n in cidr.items()}, set(octets))
+
+    col.insert_many([_ioc("u2", "198.51.100.1", now + timedelta(seconds=1)),
+                     _ioc("c2", "172.16.0.0/12", now + timedelta(seconds=1))])
+    assert idx.refresh(col)["loaded"] >= 2
+
+    # reader đang giữ bảng cũ không thấy thay đổi giữa chừng
+    assert (dict(exact), {p: dict(n) for p, n in cidr.items()}, set(octets)) == snap
+    assert set(exact["198.51.100.1"]) == {"u1"}
+    hits = idx.lookup(["198.51.100.1", "172.16.5.5", "10.1.2.3"])
+    assert {h["uuid"] for h in hits["198.51.100.1"]} == {"u1", "u2"}
+    assert [h["uuid"] for h in hits["172.16.5.5"]] == ["c2"]
+    assert [h["uuid"] for h in hits["10.1.2.3"]] == ["c1"]
+
+
+def test_refresh_picks_up_overlapping_pull_older_than_watermark():
+    col = mongomock.MongoClient().db.iocs
+    now = datetime.utcnow()
+    col.insert_one(_ioc("u1", "198.51.100.1", now))
+    idx = IOCIndex()
+    idx.rebuild(col)
+
+    # pull song song commit sau, nhưng pulled_at (lúc nó bắt đầu) cũ hơn watermark
+    col.insert_one(_ioc("late", "198.51.100.2", now - timedelta(seconds=30)))
+    idx.refresh(col)
+
+    assert idx.contains("198.51.100.2")
+    assert idx.watermark > now - timedelta(seconds=1)      # watermark không lùi
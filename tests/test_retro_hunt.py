@@ -0,0 +1,87 @@
+"""Retro-hunt: cửa sổ theo thời điểm ingest (_id), claim job nguyên tử, giới hạn số lần thử."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from bson import ObjectId
+
+from app.services import retro_hunt
+from app.tests.helpers import snort_alert
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock.MongoClient().db
+    for name, col in (("col_iocs", db.iocs), ("col_ids_alerts", db.ids_alerts),
+                      ("col_retro_hits", db.retro_hits), ("col_retro_jobs", db.retro_jobs)):
+        monkeypatch.setattr(retro_hunt, name, col)
+    monkeypatch.setattr(retro_hunt, "_enqueue", lambda job_id: None)
+    now = datetime.now(timezone.utc)
+    db.iocs.insert_one({"uuid": "ioc-1", "type": "ip-dst", "value": "192.0.2.10", "event_id": 1,
+                        "norm": {"ip": "192.0.2.10"}, "source": {"pulled_at": now}})
+    return db
+
+
+def _job(**kw):
+    now = datetime.now(timezone.utc)
+    return retro_hunt.create_job(now - timedelta(minutes=1), now + timedelta(minutes=1), **kw)
+
+
+def test_snort_format_alert_in_window_is_hit(db):
+    a = snort_alert(_id=ObjectId())
+    a["ts"] = "10/19-06:41:36.678258"
+    db.ids_alerts.insert_one(a)
+    db.ids_alerts.insert_one(snort_alert(_id=ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(days=60))))
+
+    job = retro_hunt.run_job(_job(days=30)["_id"])
+
+    assert job["status"] == "done"
+    assert job["alerts_matched"] == 1
+    assert db.retro_hits.find_one()["alert_id"] == a["_id"]
+
+
+def test_running_job_not_claimed_twice(db):
+    job_id = _job()["_id"]
+    assert retro_hunt._claim(job_id, "worker-a") is not None
+    assert retro_hunt._claim(job_id, "worker-b") is None
+    assert retro_hunt.resume_pending() == []
+
+
+def test_expired_lease_is_reclaimed(db):
+    job_id = _job()["_id"]
+    retro_hunt._claim(job_id, "worker-a")
+    db.retro_jobs.update_one({"_id": job_id}, {"$set": {"lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+    assert retro_hunt.resume_pending() == [job_id]
+    assert retro_hunt._claim(job_id, "worker-b")["owner"] == "worker-b"
+
+
+def test_failing_job_stops_after_max_attempts(db, monkeypatch):
+    def boom(*a):
+        raise RuntimeError("bad query")
+    monkeypatch.setattr(retro_hunt, "_scan_batch", boom)
+    job_id = _job()["_id"]
+
+    for _ in range(retro_hunt.RETRO_HUNT_MAX_ATTEMPTS):
+        with pytest.raises(RuntimeError):
+            retro_hunt.run_job(job_id)
+
+    job = retro_hunt.get_job(job_id)
+    assert job["status"] == "failed" and job["attempts"] == retro_hunt.RETRO_HUNT_MAX_ATTEMPTS
+    assert retro_hunt.resume_pending() == []
+    assert retro_hunt.run_job(job_id)["status"] == "failed"
+
+
+def test_error_before_first_batch_requeues_job(db, monkeypatch):
+    def boom(*a):
+        raise RuntimeError("iocs unavailable")
+    monkeypatch.setattr(retro_hunt, "_new_values", boom)
+    job_id = _job()["_id"]
+
+    with pytest.raises(RuntimeError):
+        retro_hunt.run_job(job_id)
+
+    job = retro_hunt.get_job(job_id)
+    assert job["status"] == "queued" and job["error"] == "iocs unavailable" and job["lease_until"] is None
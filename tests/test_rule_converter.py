@@ -0,0 +1,19 @@
+"""is_ip: fast path regex IPv4 khớp đúng như ipaddress (chỉ chữ số ASCII)."""
+import pytest
+
+from app.services.rule_converter import is_ip
+
+
+@pytest.mark.parametrize("v", ["1.2.3.4", "255.255.255.255", "0.0.0.0", "2001:db8::1", "::ffff:1.2.3.4"])
+def test_is_ip_accepts(v):
+    assert is_ip(v)
+
+
+@pytest.mark.parametrize("v", [
+    "１.2.3.4",        # chữ số fullwidth
+    "1.2.3.٤",        # chữ số Ả Rập-Ấn
+    "1.2.3.४",        # chữ số Devanagari
+    "01.2.3.4", "256.1.1.1", "1.2.3", "evil.com",
+])
+def test_is_ip_rejects(v):
+    assert not is_ip(v)
@@ -0,0 +1,88 @@
+"""Cost guard: IOC bị quarantine / block không bị convert lại (cấp sid, nhân bản rule_item) mỗi lần."""
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from app.database import collections
+from app.services import rules_service
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock.MongoClient().db
+    for name in ("col_iocs", "col_events", "col_rule_items", "col_rule_sets", "col_rule_set_items"):
+        monkeypatch.setattr(rules_service, name, db[name[4:]])
+    monkeypatch.setattr(collections, "col_counters", db.counters)
+    monkeypatch.setattr(rules_service, "bump", lambda *a, **kw: None)
+    db.events.insert_one({"event_id": 1, "uuid": "ev-1"})
+    return db
+
+
+@pytest.fixture
+def over_budget_ioc(db, monkeypatch):
+    db.iocs.insert_one({"uuid": "ioc-1", "event_id": 1, "event_uuid": "ev-1", "type": "md5",
+                        "value": "d41d8cd98f00b204e9800998ecf8427e", "to_ids": True})
+    # chắc chắn vượt budget, không phụ thuộc điểm của rule generic
+    monkeypatch.setattr(rules_service, "lint_rule", lambda text: {"score": 999, "reasons": ["test"],
+                                                                  "fast_pattern_len": 0, "over_budget": True})
+
+
+@pytest.mark.parametrize("action,counter", [("quarantine", "quarantined"), ("block", "blocked")])
+def test_rejected_ioc_not_reconverted(db, over_budget_ioc, monkeypatch, action, counter):
+    monkeypatch.setattr(rules_service, "RULE_COST_ACTION", action)
+
+    first = rules_service.build_rules_for_all_new()
+    sid_after_first = db.counters.find_one({"_id": "sid"})["value"]
+    second = rules_service.build_rules_for_all_new()
+
+    assert first[0]["status"] == "noop" and first[0][counter] == 1
+    assert second == []
+    assert db.counters.find_one({"_id": "sid"})["value"] == sid_after_first
+    assert rules_service.COST_REJECTED_TAG in db.iocs.find_one()["tags"]
+    assert db.rule_items.count_documents({"status": "quarantined"}) == (1 if action == "quarantine" else 0)
+
+
+def test_quarantined_item_deduped_across_sids(db, over_budget_ioc, monkeypatch):
+    monkeypatch.setattr(rules_service, "RULE_COST_ACTION", "quarantine")
+
+    rules_service.build_rules_for_event(1, only_new=False)
+    rules_service.build_rules_for_event(1, only_new=False)     # convert lại: sid mới, cùng rule
+
+    assert db.rule_items.count_documents({"status": "quarantined"}) == 1
+
+
+def test_unknown_cost_action_rejected(monkeypatch):
+    import importlib
+    from app.services import rule_linter
+    monkeypatch.setenv("RULE_COST_ACTION", "quarantien")
+    with pytest.raises(ValueError, match="RULE_COST_ACTION"):
+        importlib.reload(rule_linter)
+    monkeypatch.delenv("RULE_COST_ACTION")
+    importlib.reload(rule_linter)
+
+
+@pytest.mark.parametrize("action", ["quarantine", "block"])
+def test_rejected_ip_group_marks_members_rejected(db, monkeypatch, action):
+    db.iocs.insert_many([{"uuid": f"ip-{i}", "event_id": 1, "event_uuid": "ev-1", "type": "ip-dst",
+                          "value": f"198.51.100.{i}", "to_ids": True} for i in range(3)])
+    monkeypatch.setattr(rules_service, "lint_rule", lambda text: {"score": 999, "reasons": ["test"],
+                                                                  "fast_pattern_len": 0, "over_budget": True})
+    monkeypatch.setattr(rules_service, "RULE_COST_ACTION", action)
+
+    res = rules_service.build_rules_for_event(1, ip_mode="list")
+
+    assert res["status"] == "noop"
+    for ioc in db.iocs.find():
+        assert rules_service.CONVERTED_TAG not in ioc["tags"]
+        assert rules_service.COST_REJECTED_TAG in ioc["tags"]
+    assert rules_service.build_rules_for_all_new(ip_mode="list") == []
+
+
+def test_accepted_ip_group_marks_members_converted(db):
+    db.iocs.insert_many([{"uuid": f"ip-{i}", "event_id": 1, "event_uuid": "ev-1", "type": "ip-dst",
+                          "value": f"198.51.100.{i}", "to_ids": True} for i in range(3)])
+
+    res = rules_service.build_rules_for_event(1, ip_mode="list")
+
+    assert res["status"] == "ok" and res["ioc_count"] == 3
+    assert all(rules_service.CONVERTED_TAG in ioc["tags"] for ioc in db.iocs.find())